@@ -3,4 +3,5 @@
 
 from src.main import main
 
-main()
+if __name__ == '__main__': # Required for the worker processes of --dlf-batch
+    main()
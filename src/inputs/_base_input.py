@@ -2,7 +2,8 @@
 #-*- encoding: Utf-8 -*-
 from threading import current_thread, main_thread, Thread
 from struct import pack, unpack, unpack_from, calcsize
-from logging import debug, info, warning, error
+from logging import getLogger, debug, info, warning, error, DEBUG
+from concurrent.futures import Future, TimeoutError
 from threading import Condition, Lock
 from traceback import format_exc
 from time import sleep, time
@@ -12,6 +13,11 @@ from struct import pack
 
 from ..modules.cli import CommandLineInterface
 from ..protocol.messages import *
+from ..protocol.headers import DIAG_LOG_OUTER_HEADER, LOG_HEADER
+from ._dispatch_queue import DispatchQueue, DISPATCH_POLICY_BLOCK
+from ._diag_tracer import DiagTracer
+from ._diag_requests import DiagRequestWindow, UnmatchedDiagResponseError, OPCODE_ERRORS, get_request_key, get_response_key
+from ._log_mask_manager import LogMaskManager
 
 LOG_CONFIG_DISABLE_OP = 0
 
@@ -33,16 +39,30 @@ class BaseInput:
         
         self.modules = [] # Instances for running modules
         
+        """
+            Index of the "on_log" and "on_message" callbacks of running
+            modules, by log code and message opcode. Modules may restrict the
+            log codes and message opcodes they receive by defining the
+            "limit_registered_logs" and "limit_registered_messages" attributes.
+            
+            Rebuilt each time a module is added or removed.
+        """
+        
+        self.log_code_to_callbacks = {} # {16-bit log code: [bound "on_log" methods]}
+        self.any_log_callbacks = [] # "on_log" methods for log codes not present in the dict above
+        
+        self.opcode_to_message_callbacks = {} # {opcode: [bound "on_message" methods]}
+        self.any_message_callbacks = []
+        
         self.modules_already_initialized = False # Whether these instances have been initialized yet
         
         """
-            Inter-thread context used for dispatching responses, when the
-            self.send_recv() response is called
+            Requests in flight, sent through self.send_recv_async() (or
+            self.send_recv()), to which the read thread passes the responses
+            through futures
         """
         
-        self.event_diag_response_received = Condition()
-        
-        self.raw_diag_response = None
+        self.diag_request_window = DiagRequestWindow()
         
         self.DIAG_TIMEOUT = 5
         self.DIAG_MAX_RETRANSMITS = 3
@@ -68,6 +88,75 @@ class BaseInput:
         self.input_send_lock = Lock()
         
         self.deinitialization_lock = Lock()
+        
+        """
+            Queue between the read thread and the dispatch thread, when the
+            pipelined dispatch mode is enabled (see enable_dispatch_pipeline)
+        """
+        
+        self.dispatch_queue = None
+        
+        """
+            Tracer for sent and received packets, only set when tracing is
+            enabled (see enable_diag_tracing)
+        """
+        
+        self.diag_tracer = None
+        
+        """
+            Log masks merging the logs needed by the running modules, to
+            which modules register interest through "EnableLogMixin"
+        """
+        
+        self.log_mask_manager = LogMaskManager(self)
+    
+    """
+        enable_dispatch_pipeline: Make the read thread only read, deframe and
+        parse Diag packets, while logs and messages are passed to modules from
+        a separate dispatch thread, through a bounded queue. Responses to
+        requests are still processed from the read thread.
+        
+        Must be called before run().
+        
+        :param queue_size: Maximal number of packets pending dispatch
+        :param policy: Backpressure policy when the queue is full, see
+            _dispatch_queue.py
+        :param droppable_log_codes: Optional set of log codes which may be
+            dropped when the queue is full
+    """
+    
+    def enable_dispatch_pipeline(self, queue_size, policy = DISPATCH_POLICY_BLOCK, droppable_log_codes = None):
+        
+        self.dispatch_queue = DispatchQueue(queue_size, policy, droppable_log_codes)
+    
+    """
+        enable_diag_tracing: Trace sent and received Diag packets, either as
+        debug log lines when the debug level is enabled (-v), or to a binary
+        trace file. The debug level is only checked once, here.
+        
+        :param log_codes: Optional set of log codes to which tracing is narrowed
+        :param opcodes: Optional set of opcodes to which tracing of requests,
+            responses and messages is narrowed
+        :param trace_file: Optional file object, see _diag_tracer.py
+    """
+    
+    def enable_diag_tracing(self, log_codes = None, opcodes = None, trace_file = None):
+        
+        if trace_file or getLogger().isEnabledFor(DEBUG):
+            
+            self.diag_tracer = DiagTracer(log_codes, opcodes, trace_file)
+    
+    """
+        set_diag_request_window: Set the maximal number of Diag requests
+        in flight, beyond which self.send_recv_async() blocks.
+        
+        :param max_size: Number of requests, 1 for sending requests one at a
+            time
+    """
+    
+    def set_diag_request_window(self, max_size):
+        
+        self.diag_request_window.max_size = max_size
     
     """
         add_module: Add a module to self.modules.
@@ -77,14 +166,16 @@ class BaseInput:
         
         self.modules.append(module)
         
+        self._index_module_callbacks()
+        
         # Call the "on_init" callback if the initial step where we initialize
         # all modules was already taken (because we're adding a module through
         # the interactive prompt)
         
         if self.modules_already_initialized:
-                
+            
             self._init_single_module(module)
-        
+    
     """
         Processing loop.
         
@@ -104,13 +195,13 @@ class BaseInput:
     """
     
     def run(self):
-
+        
         with self.shutdown_event:
-
+            
             try:
                 
                 if self.modules:
-                    
+                        
                         # Initalize modules sequentially in the initialization
                         # thread, triggering the "on_init" callback from modules
                         
@@ -121,10 +212,17 @@ class BaseInput:
                         
                         Thread(target = self._read_thread, daemon = True).start()
                         
+                        # In pipelined mode, call the "on_log" and "on_message"
+                        # callbacks from a separate thread
+                        
+                        if self.dispatch_queue:
+                            
+                            Thread(target = self._dispatch_thread, daemon = True).start()
+                        
                         self.shutdown_event.wait()
-
+            
             except KeyboardInterrupt:
-
+                
                 # The main thread stops when the use hits Ctrl+C, or there is no more
                 # active module and the last call to diag_input.remove_module()
                 # triggers a SIGABRT to the main thread
@@ -134,7 +232,7 @@ class BaseInput:
             except Exception:
                 
                 error(format_exc())
-
+            
             finally:
                 
                 self.program_is_terminating = True
@@ -146,9 +244,9 @@ class BaseInput:
                 if not self.read_thread_did_shutdown and modules_remain:
                     
                     Thread(target = self._deinit_modules, daemon = True).start()
-
+                    
                     self.shutdown_event.wait()
-
+                
                 # When the daemon thread holding a terminal CLI is present, an abrupt
                 # shutdown may break the state of the terminal (suppress echo). Avoid
                 # this by restoring the TTY's state.
@@ -156,8 +254,21 @@ class BaseInput:
                 if which('stty'):
                     run(['stty', 'sane'])
                 
+                if self.dispatch_queue and self.dispatch_queue.num_dropped:
+                    
+                    warning('%d logs or messages were dropped because modules did not process them fast enough (maximal queue depth: %d): %s' % (
+                        self.dispatch_queue.num_dropped,
+                        self.dispatch_queue.max_depth,
+                        ', '.join('%s: %d' % ('0x%04x' % log_code if log_code is not None else 'messages', num_dropped)
+                            for log_code, num_dropped in self.dispatch_queue.num_dropped_per_log_code.most_common())
+                    ))
+                
+                if self.diag_tracer:
+                    
+                    self.diag_tracer.flush()
+                
                 # Apply any further actions to clean up the Input class's
-            
+                
                 self.__del__()
     
     def _read_thread(self):
@@ -172,12 +283,49 @@ class BaseInput:
         
         finally:
             
-            with self.shutdown_event:
+            # In pipelined mode, let the dispatch thread process pending
+            # packets before signaling the end of the input
+            
+            if self.dispatch_queue:
                 
-                self.read_thread_did_shutdown = True
+                self.dispatch_queue.put_end()
+            
+            else:
                 
-                self.shutdown_event.notify()
+                self._signal_read_thread_shutdown()
+    
+    def _dispatch_thread(self):
+        
+        try:
+            
+            while True:
+                
+                item = self.dispatch_queue.get()
+                
+                if item is None:
+                    
+                    break
+                
+                callback, args = item
+                
+                callback(*args)
+        
+        except Exception:
             
+            error(format_exc())
+        
+        finally:
+            
+            self._signal_read_thread_shutdown()
+    
+    def _signal_read_thread_shutdown(self):
+        
+        with self.shutdown_event:
+            
+            self.read_thread_did_shutdown = True
+            
+            self.shutdown_event.notify()
+    
     """
         _init_modules: if the current input is a Diag device to which we can
         send messages, send Diag commands to disable preexisting logging,
@@ -195,10 +343,11 @@ class BaseInput:
             
             if hasattr(self, 'send_request'):
                 
-                self.send_recv(DIAG_LOG_CONFIG_F, pack('<3xI', LOG_CONFIG_DISABLE_OP), accept_error = True)
+                self.send_recv_batch([
+                    (DIAG_LOG_CONFIG_F, pack('<3xI', LOG_CONFIG_DISABLE_OP)),
+                    (DIAG_EXT_MSG_CONFIG_F, pack('<BxxI', MSG_EXT_SUBCMD_SET_ALL_RT_MASKS, MSG_LVL_NONE))
+                ], accept_error = True)
                 
-                self.send_recv(DIAG_EXT_MSG_CONFIG_F, pack('<BxxI', MSG_EXT_SUBCMD_SET_ALL_RT_MASKS, MSG_LVL_NONE), accept_error = True)
-            
                 for module in self.modules:
                     
                     self._init_single_module(module)
@@ -208,11 +357,11 @@ class BaseInput:
             error(format_exc())
             
             with self.shutdown_event:
-            
+                
                 self.shutdown_event.notify()
     
     def _init_single_module(self, module):
-
+        
         # Don't call "on_init" if the current input isn't a Diag device we
         # can send messages to
         
@@ -227,7 +376,7 @@ class BaseInput:
                 # Initialize the module by calling the "on_init" callback.
                 
                 module.on_init()
-                    
+            
             except Exception:
                 
                 error(format_exc())
@@ -256,81 +405,206 @@ class BaseInput:
     
     def send_recv(self, req_opcode, req_payload, accept_error = False):
         
-        with self.input_send_lock:
+        return self.wait_diag_response(self.send_recv_async(req_opcode, req_payload), accept_error)
+    
+    """
+        This function will send a message on the diag socket without waiting
+        for its response, so that several requests may be in flight at once
+        (bulk transfers then don't pay a round trip per request).
+        
+        It blocks while the maximal number of requests in flight is reached
+        (see set_diag_request_window), so that the futures of previously
+        sent requests have to be waited for, in order, through
+        self.wait_diag_response().
+        
+        Responses are matched to requests through their opcode, subsystem
+        command and, where the protocol echoes it, EFS2 file descriptor and
+        offset or memory address (see _diag_requests.py).
+        
+        :param req_opcode: first byte of the unframed Diag message to send (int).
+        :param req_payload: subsequent bytes (bytes).
+        
+        :returns A Future resolved with the (resp_opcode, resp_payload) tuple
+            of the response.
+    """
+    
+    def send_recv_async(self, req_opcode, req_payload):
+        
+        future = Future()
+        
+        future.diag_request = (req_opcode, req_payload) # Kept for retransmissions and errors
+        
+        self.diag_request_window.reserve()
+        
+        with self.input_send_lock: # Requests are registered in the order they are sent
             
-            with self.event_diag_response_received:
+            self.diag_request_window.add(get_request_key(req_opcode, req_payload), future)
+            
+            self.send_request(req_opcode, req_payload) # Dispatched to the underlying input
+        
+        return future
+    
+    """
+        This function will send several messages on the diag socket at once,
+        in a single write when the underlying input supports it (through a
+        "send_requests" method taking a list of (opcode, payload) tuples),
+        then wait for all their responses.
+        
+        This makes a sequence of independent requests (e.g, setting log masks)
+        cost a single round trip. Batches larger than the maximal number of
+        requests in flight (see set_diag_request_window) are split.
+        
+        :param requests: A list of (req_opcode, req_payload) tuples.
+        :param accept_error: Whether error responses are acceptable
+        
+        :returns A list of (resp_opcode, resp_payload) tuples of the
+            responses, in the order of the requests.
+    """
+    
+    def send_recv_batch(self, requests, accept_error = False):
+        
+        responses = []
+        
+        batch_size = max(self.diag_request_window.max_size, 1)
+        
+        for batch_start in range(0, len(requests), batch_size):
+            
+            batch = requests[batch_start:batch_start + batch_size]
+            
+            futures = []
+            
+            for req_opcode, req_payload in batch:
                 
-                for nb_tries in range(self.DIAG_MAX_RETRANSMITS + 1):
-                    
-                    self.send_request(req_opcode, req_payload) # Dispatched to the underlying input
+                future = Future()
+                
+                future.diag_request = (req_opcode, req_payload)
+                
+                futures.append(future)
+            
+            self.diag_request_window.reserve(len(batch))
+            
+            with self.input_send_lock:
+                
+                for future in futures:
                     
-                    OPCODE_ERRORS = [
-                        DIAG_BAD_CMD_F, DIAG_BAD_PARM_F, DIAG_BAD_LEN_F,
-                        DIAG_BAD_MODE_F, DIAG_BAD_SPC_MODE_F, DIAG_BAD_SEC_MODE_F,
-                        DIAG_BAD_TRANS_F
-                    ]
+                    self.diag_request_window.add(get_request_key(*future.diag_request), future)
+                
+                if hasattr(self, 'send_requests'):
                     
-                    response_received = self.event_diag_response_received.wait(self.DIAG_TIMEOUT)
+                    self.send_requests(batch)
+                
+                else:
                     
-                    if response_received:
+                    for req_opcode, req_payload in batch:
                         
-                        break
+                        self.send_request(req_opcode, req_payload)
+            
+            for future in futures:
                 
-                if not response_received:
-                    
-                    error('Error: Diag request %s with payload %s timed out' % (
-                        message_id_to_name.get(req_opcode, req_opcode),
-                        repr(req_payload)
-                    ))
-                    
-                    with self.shutdown_event:
-                    
-                        self.shutdown_event.notify()
+                responses.append(self.wait_diag_response(future, accept_error))
+        
+        return responses
+    
+    """
+        Wait for the response to a request sent with self.send_recv_async(),
+        retransmitting the request when it times out.
+        
+        The request is only retransmitted while no other request is in
+        flight: a response to both the request and its retransmission
+        would otherwise match another pending request with the same key, or
+        none. Meanwhile, its response is waited for longer instead.
+        
+        :param future: The Future returned by self.send_recv_async()
+        :param accept_error: Whether an error response is acceptable
+        
+        :returns An (resp_opcode, resp_payload) tuple of the response.
+    """
+    
+    def wait_diag_response(self, future, accept_error = False):
+        
+        req_opcode, req_payload = future.diag_request
+        
+        for nb_tries in range(self.DIAG_MAX_RETRANSMITS + 1):
+            
+            if nb_tries:
+                
+                with self.input_send_lock:
                     
-                    exit()
+                    if not self.diag_request_window.has_other_requests(future):
+                        
+                        self.send_request(req_opcode, req_payload)
+            
+            try:
                 
-                resp_opcode, resp_payload = self.raw_diag_response[0], self.raw_diag_response[1:]
+                resp_opcode, resp_payload = future.result(self.DIAG_TIMEOUT)
                 
-                if resp_opcode not in [req_opcode, *OPCODE_ERRORS]:
-                    
-                    error(('Error: unmatched response received: %s with payload %s, while ' +
-                        'the request was %s with payload %s. This is possibly due to ' +
-                        'another client talking to the Diag device (which is forbidden).') % (
-                        message_id_to_name.get(resp_opcode, resp_opcode),
-                        repr(resp_payload),
-                        message_id_to_name.get(req_opcode, req_opcode),
-                        repr(req_payload)
-                    ))
-                    
-                    with self.shutdown_event:
-                    
-                        self.shutdown_event.notify()
-                    
-                    exit()
+                break
+            
+            except TimeoutError:
                 
-                if resp_opcode in OPCODE_ERRORS and not accept_error:
-                    
-                    error(('Error: error response received: %s with payload %s, while ' +
-                        'the request was %s with payload %s. Maybe this operation is ' +
-                        'not supported by your device.') % (
-                        message_id_to_name.get(resp_opcode, resp_opcode),
-                        repr(resp_payload),
-                        message_id_to_name.get(req_opcode, req_opcode),
-                        repr(req_payload)
-                    ))
-                    
-                    with self.shutdown_event:
-                    
-                        self.shutdown_event.notify()
+                pass
+            
+            except UnmatchedDiagResponseError as unmatched_response:
+                
+                error(('Error: unmatched response received: %s with payload %s, while ' +
+                    'the request was %s with payload %s. This is possibly due to ' +
+                    'another client talking to the Diag device (which is forbidden).') % (
+                    message_id_to_name.get(unmatched_response.resp_opcode, unmatched_response.resp_opcode),
+                    repr(unmatched_response.resp_payload),
+                    message_id_to_name.get(req_opcode, req_opcode),
+                    repr(req_payload)
+                ))
+                
+                with self.shutdown_event:
                     
-                    exit()
+                    self.shutdown_event.notify()
                 
-                return resp_opcode, resp_payload
+                exit()
+        
+        else:
+            
+            self.diag_request_window.remove(future)
+            
+            error('Error: Diag request %s with payload %s timed out' % (
+                message_id_to_name.get(req_opcode, req_opcode),
+                repr(req_payload)
+            ))
+            
+            with self.shutdown_event:
+                
+                self.shutdown_event.notify()
+            
+            exit()
+        
+        if resp_opcode in OPCODE_ERRORS and not accept_error:
+            
+            error(('Error: error response received: %s with payload %s, while ' +
+                'the request was %s with payload %s. Maybe this operation is ' +
+                'not supported by your device.') % (
+                message_id_to_name.get(resp_opcode, resp_opcode),
+                repr(resp_payload),
+                message_id_to_name.get(req_opcode, req_opcode),
+                repr(req_payload)
+            ))
+            
+            with self.shutdown_event:
+                
+                self.shutdown_event.notify()
+            
+            exit()
+        
+        return resp_opcode, resp_payload
     
     """
         This function will call the "on_message" and "on_log" function for
         each of the current modules, when a response, message or log is
         received
+        
+        :param unframed_diag_packet: The raw packet (bytes-like). When it is
+            a memoryview, logs and messages are passed to modules as
+            memoryviews over it, without copies, if the module has set its
+            "accepts_memoryviews" attribute. Other modules receive copies as
+            bytes.
     """
     
     def dispatch_received_diag_packet(self, unframed_diag_packet):
@@ -343,9 +617,9 @@ class BaseInput:
             # saved using the DLF format, generated by QXDM, only the inner
             # header is saved.
             
-            (pending_msgs, log_outer_length), inner_log_packet = unpack_from('<BH', payload), payload[calcsize('<BH'):]
-
-            (log_inner_length, log_type, log_time), log_payload = unpack_from('<HHQ', inner_log_packet), inner_log_packet[calcsize('<HHQ'):]
+            (pending_msgs, log_outer_length), inner_log_packet = DIAG_LOG_OUTER_HEADER.unpack_from(payload), payload[DIAG_LOG_OUTER_HEADER.size:]
+            
+            (log_inner_length, log_type, log_time), log_payload = LOG_HEADER.unpack_from(inner_log_packet), inner_log_packet[LOG_HEADER.size:]
             
             # Call the function that will dispatch the log packet, along with
             # metadata (log type, original inner header, timestamp)
@@ -358,7 +632,7 @@ class BaseInput:
             self.dispatch_diag_log(
                 log_type, # 16-bit log code
                 log_payload, # Inner log payload
-                inner_log_packet[:calcsize('<HHQ')], # Inner log header
+                inner_log_packet[:LOG_HEADER.size], # Inner log header
                 time() # Timestamp
             )
         
@@ -375,40 +649,136 @@ class BaseInput:
         else: # This is a "response"
             
             self.dispatch_diag_response(unframed_diag_packet)
-            
+    
     
     def dispatch_diag_response(self, unframed_diag_packet):
         
         opcode, payload = unframed_diag_packet[0], unframed_diag_packet[1:]
         
-        debug('[<] Received response %s of length %d: %s' % (message_id_to_name.get(opcode, opcode), len(payload), repr(payload)))
-
-        with self.event_diag_response_received:
+        if self.diag_tracer:
             
-            self.raw_diag_response = unframed_diag_packet
-
-            self.event_diag_response_received.notifyAll()
+            self.diag_tracer.trace_response(opcode, payload)
+        
+        payload = bytes(payload) # Responses are returned to modules as bytes
+        
+        future, is_matched = self.diag_request_window.pop(get_response_key(opcode, payload))
+        
+        if is_matched:
+            
+            future.set_result((opcode, payload))
+        
+        elif future:
+            
+            future.set_exception(UnmatchedDiagResponseError(opcode, payload))
+        
+        else:
             
+            debug('Ignoring response %s received while no request is pending' % message_id_to_name.get(opcode, opcode))
+    
     
     def dispatch_diag_log(self, log_type, log_payload, log_header, timestamp):
         
-        debug('[<] Received log 0x%04x of length %d: %s' % (log_type, len(log_payload), repr(log_payload)))
+        if self.diag_tracer:
+            
+            self.diag_tracer.trace_log(log_type, log_payload)
         
-        for module in self.modules:
-            if hasattr(module, 'on_log'):
-                
-                module.on_log(log_type, log_payload, log_header, timestamp)
+        if self.dispatch_queue:
+            
+            self.dispatch_queue.put((self._dispatch_diag_log_to_modules, (log_type, log_payload, log_header, timestamp)), log_type)
+        
+        else:
+            
+            self._dispatch_diag_log_to_modules(log_type, log_payload, log_header, timestamp)
+    
+    def _dispatch_diag_log_to_modules(self, log_type, log_payload, log_header, timestamp):
+        
+        for callback in self.log_code_to_callbacks.get(log_type, self.any_log_callbacks):
             
+            callback(log_type, log_payload, log_header, timestamp)
+    
     
     def dispatch_diag_message(self, opcode, payload):
         
-        debug('[<] Received message with opcode %s of length %d: %s' % (message_id_to_name.get(opcode, opcode), len(payload), repr(payload)))
+        if self.diag_tracer:
+            
+            self.diag_tracer.trace_message(opcode, payload)
+        
+        if self.dispatch_queue:
+            
+            self.dispatch_queue.put((self._dispatch_diag_message_to_modules, (opcode, payload)))
+        
+        else:
+            
+            self._dispatch_diag_message_to_modules(opcode, payload)
+    
+    def _dispatch_diag_message_to_modules(self, opcode, payload):
+        
+        for callback in self.opcode_to_message_callbacks.get(opcode, self.any_message_callbacks):
+            
+            callback(opcode, payload)
+    
+    
+    """
+        _index_module_callbacks: Rebuild the indexes of the "on_log" and
+        "on_message" callbacks from modules.
+    """
+    
+    def _index_module_callbacks(self):
+        
+        (self.log_code_to_callbacks,
+         self.any_log_callbacks) = self._build_callback_index('on_log', 'limit_registered_logs')
+        
+        (self.opcode_to_message_callbacks,
+         self.any_message_callbacks) = self._build_callback_index('on_message', 'limit_registered_messages')
+    
+    """
+        :param callback_name: Name of the module method to index
+        :param limit_attribute_name: Name of the module attribute optionally
+            restricting the codes the module is interested in
         
-        for module in self.modules:
-            if hasattr(module, 'on_message'):
+        :returns A ({code: [callbacks]}, [callbacks for any other code]) tuple,
+            callbacks being sorted in the order of self.modules
+    """
+    
+    def _build_callback_index(self, callback_name, limit_attribute_name):
+        
+        modules = [module for module in self.modules if hasattr(module, callback_name)]
+        
+        code_to_callbacks = {}
+        
+        for module in modules:
+            
+            for code in getattr(module, limit_attribute_name, None) or ():
                 
-                module.on_message(opcode, payload)
-
+                code_to_callbacks[code] = []
+        
+        any_code_callbacks = []
+        
+        for module in modules:
+            
+            callback = getattr(module, callback_name)
+            
+            if not getattr(module, 'accepts_memoryviews', False):
+                
+                callback = _with_bytes_arguments(callback)
+            
+            limited_codes = getattr(module, limit_attribute_name, None)
+            
+            if limited_codes is None:
+                
+                any_code_callbacks.append(callback)
+                
+                for callbacks in code_to_callbacks.values():
+                    
+                    callbacks.append(callback)
+            
+            else:
+                
+                for code in set(limited_codes):
+                    
+                    code_to_callbacks[code].append(callback)
+        
+        return code_to_callbacks, any_code_callbacks
     
     """
         remove_module: Remove a module from self.modules. If the current input
@@ -421,19 +791,21 @@ class BaseInput:
         try:
             
             with self.deinitialization_lock:
-            
-                if module in self.modules:
                 
+                if module in self.modules:
+                    
                     self.modules.remove(module)
                     
+                    self._index_module_callbacks()
+                    
                     try:
-
+                        
                         if hasattr(module, 'on_deinit') and hasattr(self, 'send_request'):
                             
                             module.on_deinit()
                     
                     except Exception:
-
+                        
                         error(format_exc())
                     
                     finally:
@@ -452,27 +824,55 @@ class BaseInput:
                 with self.shutdown_event:
                     
                     self.shutdown_event.notify()
-
+    
     """
-        _deinit_modules: call remove_module() for all modules.
+        _deinit_modules: disable logging, then call remove_module() for all
+        modules.
     """
     
     def _deinit_modules(self):
         
+        if hasattr(self, 'send_request'):
+            
+            # Disable the logs needed by all the modules in one batch of
+            # requests, rather than as each module is removed
+            
+            try:
+                
+                self.log_mask_manager.unsubscribe_all()
+            
+            except Exception:
+                
+                error(format_exc())
+        
         for module in list(self.modules):
             
             self.remove_module(module)
     
-
+    
     def dispose(self, disposing=True):
         """
             Release unmanaged ressources
         """
         pass 
-
+    
     def __del__(self):
         self.dispose(disposing=False)
 
+"""
+    Wrap a module callback so that the memoryviews passed as arguments are
+    converted to bytes, for modules which need to keep the received data or
+    to use methods specific to bytes.
+"""
+
+def _with_bytes_arguments(callback):
+    
+    def callback_with_bytes(*args):
+        
+        return callback(*(bytes(arg) if type(arg) is memoryview else arg for arg in args))
+    
+    return callback_with_bytes
+
 from ..protocol import messages
 
 message_id_to_name = {
@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from struct import Struct
+from threading import Condition
+
+from ..protocol.subsystems import *
+from ..protocol.messages import *
+from ..protocol.efs2 import *
+from ..protocol.headers import DIAG_SUBSYS_HEADER
+
+"""
+    This file implements the bookkeeping of Diag requests sent through
+    BaseInput.send_recv_async, which may be in flight at the same time.
+    
+    Responses are matched to pending requests through a key extracted from
+    both, made of the fields that the response echoes from the request:
+    
+    * The opcode,
+    
+    * For subsystem commands, the subsystem ID and subcommand code,
+    
+    * For EFS2 READ and WRITE subcommands, the file descriptor and offset,
+    
+    * For PEEK commands, the address.
+    
+    Error responses (such as DIAG_BAD_CMD_F) embed the start of the request
+    that they reply to, from which a (possibly truncated) key is extracted.
+    
+    When several pending requests have the same key, these are assumed to be
+    replied to in order.
+"""
+
+OPCODE_ERRORS = [
+    DIAG_BAD_CMD_F, DIAG_BAD_PARM_F, DIAG_BAD_LEN_F,
+    DIAG_BAD_MODE_F, DIAG_BAD_SPC_MODE_F, DIAG_BAD_SEC_MODE_F,
+    DIAG_BAD_TRANS_F
+]
+
+DEFAULT_DIAG_REQUEST_WINDOW = 8
+
+_REQUEST_FD_OFFSET_FORMAT = {
+    EFS2_DIAG_READ: Struct('<3xi4xI'), # Subsystem ID, subcommand, fd, bytes to read, offset
+    EFS2_DIAG_WRITE: Struct('<3xiI') # Subsystem ID, subcommand, fd, offset
+}
+
+_RESPONSE_FD_OFFSET_FORMAT = {
+    EFS2_DIAG_READ: Struct('<3xiI'), # Subsystem ID, subcommand, fd, offset
+    EFS2_DIAG_WRITE: Struct('<3xiI')
+}
+
+_PEEK_ADDRESS = Struct('<I')
+
+"""
+    :param fd_offset_format: Format of the subsystem command fields from
+        which the file descriptor and offset of EFS2 READ and WRITE are read,
+        which differs between requests and responses
+"""
+
+def _get_diag_key(opcode, payload, fd_offset_format):
+    
+    key = (opcode,)
+    
+    if opcode in (DIAG_SUBSYS_CMD_F, DIAG_SUBSYS_CMD_VER_2_F) and len(payload) >= 3:
+        
+        subsystem_id, subcommand_code = DIAG_SUBSYS_HEADER.unpack_from(payload)
+        
+        key += (subsystem_id, subcommand_code)
+        
+        if (opcode == DIAG_SUBSYS_CMD_F and subsystem_id == DIAG_SUBSYS_FS and
+            subcommand_code in (EFS2_DIAG_READ, EFS2_DIAG_WRITE)):
+            
+            fields = fd_offset_format[subcommand_code]
+            
+            if len(payload) >= fields.size:
+                
+                key += fields.unpack_from(payload)
+    
+    elif opcode in (DIAG_PEEKB_F, DIAG_PEEKW_F, DIAG_PEEKD_F) and len(payload) >= 4:
+        
+        key += _PEEK_ADDRESS.unpack_from(payload)
+    
+    return key
+
+def get_request_key(opcode, payload):
+    
+    return _get_diag_key(opcode, payload, _REQUEST_FD_OFFSET_FORMAT)
+
+def get_response_key(opcode, payload):
+    
+    if opcode in OPCODE_ERRORS:
+        
+        return get_request_key(payload[0], payload[1:]) if payload else ()
+    
+    return _get_diag_key(opcode, payload, _RESPONSE_FD_OFFSET_FORMAT)
+
+"""
+    Raised from the future of the oldest pending request when a response
+    matching no pending request is received.
+"""
+
+class UnmatchedDiagResponseError(Exception):
+    
+    def __init__(self, resp_opcode, resp_payload):
+        
+        super().__init__(resp_opcode, resp_payload)
+        
+        self.resp_opcode = resp_opcode
+        self.resp_payload = resp_payload
+
+"""
+    This class holds the requests in flight, in the order they were sent,
+    along with the futures to which their response is passed.
+"""
+
+class DiagRequestWindow:
+    
+    """
+        :param max_size: Maximal number of requests in flight
+    """
+    
+    def __init__(self, max_size = DEFAULT_DIAG_REQUEST_WINDOW):
+        
+        self.max_size = max_size
+        
+        self.pending_requests = [] # [(key, future)]
+        
+        self.num_reserved = 0 # Requests about to be sent
+        
+        self.condition = Condition()
+    
+    """
+        Wait for the window to have room for a request, and reserve it.
+        
+        :param count: Number of requests to reserve room for at once, at
+            most max_size
+    """
+    
+    def reserve(self, count = 1):
+        
+        with self.condition:
+            
+            while len(self.pending_requests) + self.num_reserved + count > self.max_size:
+                
+                self.condition.wait()
+            
+            self.num_reserved += count
+    
+    """
+        Register a request for which room was reserved, right before it is
+        sent. Requests must be added in the order they are sent, as pending
+        requests with the same key are matched in order.
+    """
+    
+    def add(self, key, future):
+        
+        with self.condition:
+            
+            self.num_reserved -= 1
+            
+            self.pending_requests.append((key, future))
+    
+    """
+        Remove a request for which no response is awaited anymore.
+    """
+    
+    def remove(self, future):
+        
+        with self.condition:
+            
+            self.pending_requests = [
+                (key, pending_future) for key, pending_future in self.pending_requests
+                if pending_future is not future
+            ]
+            
+            self.condition.notify_all()
+    
+    """
+        :returns Whether requests other than the one of a future are in
+            flight or about to be sent
+    """
+    
+    def has_other_requests(self, future):
+        
+        with self.condition:
+            
+            return self.num_reserved > 0 or any(pending_future is not future
+                for key, pending_future in self.pending_requests)
+    
+    """
+        :param response_key: Key extracted with get_response_key()
+        
+        :returns A (future, is_matched) tuple, where future is the one of the
+            oldest pending request matching the key, or else the one of the
+            oldest pending request, or None. The request is removed.
+    """
+    
+    def pop(self, response_key):
+        
+        with self.condition:
+            
+            if not self.pending_requests:
+                
+                return None, False
+            
+            index, is_matched = 0, False
+            
+            for pending_index, (key, future) in enumerate(self.pending_requests):
+                
+                if response_key and key[:len(response_key)] == response_key:
+                    
+                    index, is_matched = pending_index, True
+                    
+                    break
+            
+            key, future = self.pending_requests.pop(index)
+            
+            self.condition.notify_all()
+            
+            return future, is_matched
@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from logging import debug
+from threading import Lock
+from struct import Struct
+from time import time
+
+"""
+    This class traces each Diag packet sent to or received from an input,
+    when verbose mode is enabled or a trace file was requested.
+    
+    Inputs only hold an instance of it while tracing is enabled, and test for
+    it before calling it, so that no formatting happens on the path of
+    received packets otherwise.
+    
+    Traces are written either as debug log lines (to stderr), or as binary
+    records to a trace file, each made of a TRACE_RECORD_HEADER followed by
+    the payload of the packet:
+    
+    * Timestamp (double, seconds since the Epoch)
+    * Direction (TRACE_DIRECTION_*)
+    * Packet type (TRACE_TYPE_*)
+    * Opcode, or 16-bit log code for logs
+    * Payload length (excluding the opcode, or the log header for logs)
+"""
+
+TRACE_RECORD_HEADER = Struct('<dBBHI')
+
+TRACE_DIRECTION_SENT = 0
+TRACE_DIRECTION_RECEIVED = 1
+
+TRACE_TYPE_REQUEST = 0
+TRACE_TYPE_RESPONSE = 1
+TRACE_TYPE_LOG = 2
+TRACE_TYPE_MESSAGE = 3
+
+class DiagTracer:
+    
+    """
+        :param log_codes: Optional set of 16-bit log codes to trace, None
+            meaning all of them
+        :param opcodes: Optional set of opcodes for which to trace requests,
+            responses and messages, None meaning all of them
+        :param trace_file: Optional file object opened in binary mode, to
+            which traces are written instead of debug log lines
+    """
+    
+    def __init__(self, log_codes = None, opcodes = None, trace_file = None):
+        
+        self.log_codes = log_codes
+        self.opcodes = opcodes
+        
+        self.trace_file = trace_file
+        
+        self.trace_file_lock = Lock() # Requests are sent from other threads than the read thread
+    
+    def trace_request(self, opcode, payload):
+        
+        if self.opcodes is None or opcode in self.opcodes:
+            
+            self._trace(TRACE_DIRECTION_SENT, TRACE_TYPE_REQUEST, opcode, payload,
+                '[>] Sending request %s of length %d: %s')
+    
+    def trace_response(self, opcode, payload):
+        
+        if self.opcodes is None or opcode in self.opcodes:
+            
+            self._trace(TRACE_DIRECTION_RECEIVED, TRACE_TYPE_RESPONSE, opcode, payload,
+                '[<] Received response %s of length %d: %s')
+    
+    def trace_log(self, log_type, log_payload):
+        
+        if self.log_codes is None or log_type in self.log_codes:
+            
+            self._trace(TRACE_DIRECTION_RECEIVED, TRACE_TYPE_LOG, log_type, log_payload,
+                '[<] Received log %s of length %d: %s')
+    
+    def trace_message(self, opcode, payload):
+        
+        if self.opcodes is None or opcode in self.opcodes:
+            
+            self._trace(TRACE_DIRECTION_RECEIVED, TRACE_TYPE_MESSAGE, opcode, payload,
+                '[<] Received message with opcode %s of length %d: %s')
+    
+    def _trace(self, direction, packet_type, code, payload, log_format):
+        
+        if self.trace_file:
+            
+            with self.trace_file_lock:
+                
+                self.trace_file.write(TRACE_RECORD_HEADER.pack(time(), direction, packet_type, code, len(payload)))
+                self.trace_file.write(payload)
+        
+        else:
+            
+            from ._base_input import message_id_to_name # Not at the top, as _base_input.py imports this file
+            
+            code_name = '0x%04x' % code if packet_type == TRACE_TYPE_LOG else message_id_to_name.get(code, code)
+            
+            debug(log_format % (code_name, len(payload), repr(bytes(payload))))
+    
+    def flush(self):
+        
+        if self.trace_file:
+            
+            with self.trace_file_lock:
+                
+                self.trace_file.flush()
@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from collections import deque, Counter
+from threading import Condition
+
+"""
+    This class implements the bounded queue placed between the read thread
+    of an input (which deframes and parses Diag packets) and the dispatch
+    thread (which calls the "on_log" and "on_message" callbacks of modules),
+    when the pipelined dispatch mode is enabled.
+    
+    When the queue is full, the backpressure policy decides what happens to
+    an incoming log or message:
+    
+    * "block": the read thread waits for the dispatch thread to catch up.
+    
+    * "drop-newest": the incoming packet is discarded.
+    
+    * "drop-oldest": the packet at the head of the queue is discarded to make
+      room for the incoming one.
+    
+    When a set of droppable log codes is given, only logs with these codes
+    may be dropped, other packets block the read thread as with "block".
+"""
+
+DISPATCH_POLICY_BLOCK = 'block'
+DISPATCH_POLICY_DROP_OLDEST = 'drop-oldest'
+DISPATCH_POLICY_DROP_NEWEST = 'drop-newest'
+
+DISPATCH_POLICIES = [DISPATCH_POLICY_BLOCK, DISPATCH_POLICY_DROP_OLDEST, DISPATCH_POLICY_DROP_NEWEST]
+
+class DispatchQueue:
+    
+    """
+        :param max_size: Maximal number of packets pending dispatch
+        :param policy: One of DISPATCH_POLICIES
+        :param droppable_log_codes: Optional set of 16-bit log codes that may
+            be dropped, None meaning that any log or message may be dropped
+    """
+    
+    def __init__(self, max_size, policy = DISPATCH_POLICY_BLOCK, droppable_log_codes = None):
+        
+        assert policy in DISPATCH_POLICIES
+        
+        self.max_size = max_size
+        self.policy = policy
+        self.droppable_log_codes = droppable_log_codes
+        
+        self.items = deque()
+        
+        self.condition = Condition()
+        
+        # Statistics
+        
+        self.max_depth = 0 # Highest number of packets that were pending dispatch
+        self.num_dropped = 0
+        self.num_dropped_per_log_code = Counter() # {log code or None for messages: number of packets dropped}
+        
+        self.end_reached = False
+    
+    """
+        Queue a packet for the dispatch thread.
+        
+        :param item: An opaque object returned by get()
+        :param log_code: The 16-bit log code of the packet, None for messages
+    """
+    
+    def put(self, item, log_code = None):
+        
+        with self.condition:
+            
+            if len(self.items) >= self.max_size:
+                
+                if self.policy == DISPATCH_POLICY_DROP_NEWEST and self.is_droppable(log_code):
+                    
+                    self.num_dropped += 1
+                    self.num_dropped_per_log_code[log_code] += 1
+                    
+                    return
+                
+                elif self.policy == DISPATCH_POLICY_DROP_OLDEST:
+                    
+                    self.drop_oldest()
+                
+                while len(self.items) >= self.max_size:
+                    
+                    self.condition.wait()
+            
+            self.items.append((log_code, item))
+            
+            self.max_depth = max(self.max_depth, len(self.items))
+            
+            self.condition.notify_all()
+    
+    def is_droppable(self, log_code):
+        
+        return self.droppable_log_codes is None or log_code in self.droppable_log_codes
+    
+    """
+        Remove the oldest droppable packet from the queue, if any.
+    """
+    
+    def drop_oldest(self):
+        
+        for index, (log_code, item) in enumerate(self.items):
+            
+            if self.is_droppable(log_code):
+                
+                del self.items[index]
+                
+                self.num_dropped += 1
+                self.num_dropped_per_log_code[log_code] += 1
+                
+                return
+    
+    """
+        Signal the dispatch thread that no more packets will be queued, once
+        it has dispatched the packets that are still pending.
+    """
+    
+    def put_end(self):
+        
+        with self.condition:
+            
+            self.end_reached = True
+            
+            self.condition.notify_all()
+    
+    """
+        Wait for a packet to dispatch.
+        
+        :returns The item passed to put(), or None when put_end() was called
+            and the queue was drained.
+    """
+    
+    def get(self):
+        
+        with self.condition:
+            
+            while not self.items:
+                
+                if self.end_reached:
+                    
+                    return None
+                
+                self.condition.wait()
+            
+            log_code, item = self.items.popleft()
+            
+            self.condition.notify_all()
+            
+            return item
+    
+    @property
+    def depth(self):
+        
+        return len(self.items)
@@ -7,6 +7,87 @@ from time import time
 
 from ..protocol.messages import *
 
+"""
+    This class accumulates the raw bytes read from a Diag device, and splits
+    them into pseudo-HDLC frames (each terminated by a trailer character).
+    
+    Bytes are appended to a growable bytearray, and the trailer character is
+    searched from the offset where the previous search stopped, so that each
+    received byte is scanned and copied a bounded number of times, whatever
+    the size of the reads and of the frames.
+"""
+
+class HdlcDeframer:
+    
+    TRAILER_CHAR = b'\x7e'
+    
+    def __init__(self):
+        
+        self.buffer = bytearray()
+        
+        self.scan_offset = 0 # Offset before which no trailer character is present in self.buffer
+        
+        self.consumed_size = 0 # Size of the frames already yielded at the head of self.buffer
+    
+    """
+        Append bytes read from the device, and yield the complete frames that
+        they terminate.
+        
+        :param data: Raw bytes (bytes, bytearray or memoryview)
+        
+        :returns An iterator over complete frames, including their trailer
+            character. These are memoryviews over the internal buffer, which
+            are only valid until the next call and must not be kept.
+    """
+    
+    def feed(self, data):
+        
+        buffer = self.buffer
+        
+        # Drop the frames yielded by the previous call from the head of the
+        # buffer (this can't be done at the end of the previous call, as the
+        # caller may still hold the last yielded view at this moment)
+        
+        del buffer[:self.consumed_size]
+        
+        self.scan_offset -= self.consumed_size
+        self.consumed_size = 0
+        
+        buffer += data
+        
+        frame_start = 0
+        
+        with memoryview(buffer) as buffer_view:
+            
+            while True:
+                
+                trailer_pos = buffer.find(self.TRAILER_CHAR, max(frame_start, self.scan_offset))
+                
+                if trailer_pos < 0:
+                    
+                    break
+                
+                frame_end = trailer_pos + 1
+                
+                self.consumed_size = frame_end
+                
+                yield buffer_view[frame_start:frame_end]
+                
+                frame_start = frame_end
+        
+        self.scan_offset = len(buffer)
+    
+    """
+        Discard any partial frame pending in the buffer.
+    """
+    
+    def reset(self):
+        
+        del self.buffer[:]
+        
+        self.scan_offset = 0
+        self.consumed_size = 0
+
 """
     This class implements the pseudo-HDLC framing using for the Qualcomm Diag
     protocol.
@@ -16,7 +97,23 @@ class HdlcMixin:
 
     ESCAPE_CHAR = b'\x7d'
     TRAILER_CHAR = b'\x7e'
+    
+    ESCAPED_ESCAPE_CHAR = b'\x7d\x5d'
+    ESCAPED_TRAILER_CHAR = b'\x7d\x5e'
+    
+    diag_tracer = None # See BaseInput.enable_diag_tracing
+    
+    def __init__(self):
+        
+        self.hdlc_deframer = HdlcDeframer()
+        
+        self.received_first_packet = False
+        
+        super().__init__()
 
+    # crcmod precomputes a 256-entry table for the polynomial, and walks it
+    # from its C extension
+    
     ccitt_crc16 = staticmethod(
         mkCrcFun(0x11021, initCrc=0, xorOut=0xffff)
     )
@@ -29,7 +126,9 @@ class HdlcMixin:
 
     def hdlc_encapsulate(self, payload) -> bytes:
         
-        debug('[>] Sending request %s of length %d: %s' % (message_id_to_name.get(payload[0], payload[0]), len(payload[1:]), payload[1:]))
+        if self.diag_tracer:
+            
+            self.diag_tracer.trace_request(payload[0], payload[1:])
         
         # Add the CRC16
         
@@ -46,16 +145,33 @@ class HdlcMixin:
         
         return payload
 
+    """
+        Encapsulate several Diag requests, for sending them in a single
+        write (see BaseInput.send_recv_batch)
+        
+        :param requests: A list of (opcode, payload) tuples
+    """
+    
+    def hdlc_encapsulate_batch(self, requests) -> bytes:
+        
+        return b''.join(self.hdlc_encapsulate(bytes([opcode]) + payload) for opcode, payload in requests)
+
     """
         Utility function to decode the reverse way
         
-        :param payload: An encapsulated payload to be made raw
+        The frame is copied once, while being unescaped, and the returned
+        memoryview is backed by this copy, so that it may be sliced without
+        further copies by the dispatching code.
+        
+        :param payload: An encapsulated payload to be made raw (bytes-like)
         :raises InvalidFrameError: Used to signal to the caller through
             an Exception that a packet that is too short or with an invalid
             CRC-16 was received, along with a warning
+        
+        :returns A memoryview over the raw payload
     """
 
-    def hdlc_decapsulate(self, payload) -> bytes:
+    def hdlc_decapsulate(self, payload) -> memoryview:
         
         # Check the message length
         
@@ -67,28 +183,123 @@ class HdlcMixin:
         
         # Remove the trailer
         
-        assert payload[-1:] == self.TRAILER_CHAR
-        payload = payload[:-1]
+        assert payload[-1] == self.TRAILER_CHAR[0]
+        payload = bytes(payload[:-1])
+        
+        # Unescape the message (most frames don't contain any escaped byte,
+        # in which case the two replacement passes are skipped)
+        
+        if self.ESCAPE_CHAR in payload:
+            
+            payload = payload.replace(self.ESCAPED_TRAILER_CHAR, self.TRAILER_CHAR)
+            payload = payload.replace(self.ESCAPED_ESCAPE_CHAR, self.ESCAPE_CHAR)
+            
+            # Check the unescaped message length, which must at least hold
+            # the CRC
+            
+            if len(payload) < 2:
+                
+                error('Too short Diag frame received')
+                
+                raise self.InvalidFrameError
         
-        # Unescape the message
+        payload_view = memoryview(payload)
         
-        payload = payload.replace(bytes([self.ESCAPE_CHAR[0], self.TRAILER_CHAR[0] ^ 0x20]), self.TRAILER_CHAR)
-        payload = payload.replace(bytes([self.ESCAPE_CHAR[0], self.ESCAPE_CHAR[0] ^ 0x20]), self.ESCAPE_CHAR)
+        # Check the CRC16 (little-endian, compared as an integer)
         
-        # Check the CRC16
+        expected_crc = self.ccitt_crc16(payload_view[:-2])
+        received_crc = payload[-2] | (payload[-1] << 8)
         
-        if payload[-2:] != pack('<H', self.ccitt_crc16(payload[:-2])):
+        if received_crc != expected_crc:
+            
+            warning('Ignoring (partial?) frame of %d bytes: Wrong CRC (is: %04x, should be: %04x)' % (
+                    len(payload) - 2, received_crc, expected_crc))
             
-            warning('Ignoring (partial?) frame: Wrong CRC: %s (is: %02x, should be: %02x)' % (
-                    repr(payload[:-2]),
-                    unpack('<H', payload[-2:])[0],
-                    self.ccitt_crc16(payload[:-2])))
+            debug('Frame with wrong CRC: %s' % repr(payload[:-2]))
             
             raise self.InvalidFrameError
-
-        payload = payload[:-2]
         
-        return payload
+        return payload_view[:-2]
+    
+    """
+        Feed raw bytes read from the device to the deframer, and decapsulate
+        all the frames that these complete, in a single call.
+        
+        Empty frames are signalled through on_empty_hdlc_frame(), frames too
+        short to hold a CRC through on_too_short_hdlc_frame(), and frames
+        with a wrong CRC are skipped.
+        
+        :param data: Raw bytes read from the device
+        
+        :returns A list of memoryviews over the raw payloads, which unlike the
+            frames yielded by the deframer, may be kept by the caller
+    """
+    
+    def hdlc_decapsulate_batch(self, data) -> list:
+        
+        unframed_messages = []
+        
+        hdlc_decapsulate = self.hdlc_decapsulate
+        
+        for raw_payload in self.hdlc_deframer.feed(data):
+            
+            if len(raw_payload) == 1:
+                
+                self.on_empty_hdlc_frame()
+                
+                continue
+            
+            if len(raw_payload) < 3:
+                
+                self.on_too_short_hdlc_frame()
+                
+                continue
+            
+            try:
+            
+                unframed_messages.append(hdlc_decapsulate(raw_payload))
+            
+            except self.InvalidFrameError:
+                
+                # The first packet that we receive over the Diag input may
+                # be partial
+                
+                pass
+            
+            self.received_first_packet = True
+        
+        return unframed_messages
+    
+    """
+        Feed raw bytes read from the device to the deframer, then decapsulate
+        and dispatch every frame that has been completed.
+        
+        :param data: Raw bytes read from the device
+    """
+    
+    def dispatch_hdlc_data(self, data):
+        
+        for unframed_message in self.hdlc_decapsulate_batch(data):
+            
+            self.dispatch_received_diag_packet(unframed_message)
+    
+    """
+        Called when a lone trailer character is received, inputs may
+        override it.
+    """
+    
+    def on_empty_hdlc_frame(self):
+        
+        warning('(Received an empty diag frame)')
+    
+    """
+        Called when a frame too short to hold a CRC is received, inputs may
+        override it.
+    """
+    
+    def on_too_short_hdlc_frame(self):
+        
+        error('Too short Diag frame received')
     
     class InvalidFrameError(Exception):
         
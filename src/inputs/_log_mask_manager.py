@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from struct import pack, unpack_from
+from typing import Dict, List, Optional, Iterable
+from logging import warning, info, debug
+from threading import Lock
+
+from ._log_masks import LogMaskCache, build_log_mask, get_firmware_build_id, LOG_MASK_CACHE_PATH
+from ..protocol.messages import *
+from ..protocol.headers import DIAG_LOG_CONFIG_HEADER
+
+"""
+    This file implements the log mask manager owned by BaseInput, through
+    which modules register interest in logs (see "_enable_log_mixin.py").
+    
+    Each subscribed module states the set of log codes it needs (or all of
+    them). The manager sends the device the masks enabling the union of
+    these, and when modules are added or removed, only sends the masks of
+    the log types which changed, so that a module stopping does not disable
+    logs that another one still needs.
+"""
+
+LOG_CONFIG_RETRIEVE_ID_RANGES_OP = 1
+LOG_CONFIG_SET_MASK_OP = 3
+
+LOG_CONFIG_SUCCESS_S = 0
+
+LOG_TYPE_NAMES = {
+    0x1: '1X',
+    0x4: 'WCDMA',
+    0x5: 'GSM',
+    0x6: 'LBS',
+    0x7: 'UMTS',
+    0x8: 'TDMA',
+    0xA: 'DTV',
+    0xB: 'APPS/LTE/WIMAX',
+    0xC: 'DSP',
+    0xD: 'TDSCDMA',
+    0xF: 'TOOLS'
+}
+
+class LogMaskManager:
+    
+    """
+        :param cache_path: Path of the cache of the log masks, keyed by
+            firmware build ID (see "_log_masks.py"), or None for not using it
+    """
+    
+    def __init__(self, diag_input, cache_path : Optional[str] = LOG_MASK_CACHE_PATH):
+        
+        self.diag_input = diag_input
+        
+        self.cache_path = cache_path
+        
+        self.subscriber_to_log_codes : Dict[object, Optional[frozenset]] = {}
+        
+        # Number of log codes of each log type, retrieved from the device
+        # along with its build ID when the first module subscribes
+        
+        self.id_ranges : Optional[List[int]] = None
+        
+        self.build_id : Optional[str] = None
+        
+        self.log_mask_cache : Optional[LogMaskCache] = None
+        
+        # Masks last sent to the device for each log type
+        
+        self.log_type_to_mask : Dict[int, bytes] = {}
+        
+        self.lock = Lock()
+    
+    """
+        Register interest for logs, and update the masks of the device.
+        
+        :param subscriber: The module registering interest
+        :param log_codes: Log codes needed by the module, or None for all
+    """
+    
+    def subscribe(self, subscriber, log_codes : Optional[Iterable[int]] = None):
+        
+        with self.lock:
+            
+            self.subscriber_to_log_codes[subscriber] = frozenset(log_codes) if log_codes is not None else None
+            
+            self._update_masks()
+    
+    """
+        Unregister the interest of a module for logs, and update the masks of
+        the device, disabling the logs that no other module needs.
+    """
+    
+    def unsubscribe(self, subscriber):
+        
+        with self.lock:
+            
+            if subscriber in self.subscriber_to_log_codes:
+                
+                del self.subscriber_to_log_codes[subscriber]
+                
+                self._update_masks()
+    
+    """
+        Unregister all the modules at once, disabling all the logs in a
+        single batch of requests (when the program terminates).
+    """
+    
+    def unsubscribe_all(self):
+        
+        with self.lock:
+            
+            if self.subscriber_to_log_codes:
+                
+                self.subscriber_to_log_codes.clear()
+                
+                self._update_masks()
+    
+    """
+        :returns The union of the log codes needed by the subscribed modules,
+            or None when one of them needs all the logs
+    """
+    
+    def get_enabled_log_codes(self) -> Optional[frozenset]:
+        
+        enabled_log_codes = frozenset()
+        
+        for log_codes in self.subscriber_to_log_codes.values():
+            
+            if log_codes is None:
+                return None
+            
+            enabled_log_codes |= log_codes
+        
+        return enabled_log_codes
+    
+    def _update_masks(self):
+        
+        if self.id_ranges is None:
+            
+            self._retrieve_id_ranges()
+        
+        enabled_log_codes = self.get_enabled_log_codes()
+        
+        log_type_to_new_mask = {}
+        
+        for log_type, log_mask_bitsize in enumerate(self.id_ranges):
+            
+            if not log_mask_bitsize:
+                continue
+            
+            if self.subscriber_to_log_codes:
+                log_mask = self.log_mask_cache.get_log_mask(self.build_id, log_type, log_mask_bitsize, enabled_log_codes)
+            else:
+                log_mask = build_log_mask(log_type, log_mask_bitsize, bit_value = 0)
+            
+            if self.log_type_to_mask.get(log_type) != log_mask:
+                
+                log_type_to_new_mask[log_type] = log_mask
+        
+        # Send the masks which changed at once (see BaseInput.send_recv_batch)
+        
+        responses = self.diag_input.send_recv_batch([
+            (DIAG_LOG_CONFIG_F, pack('<3xIII',
+                LOG_CONFIG_SET_MASK_OP,
+                log_type,
+                self.id_ranges[log_type]
+            ) + log_mask)
+            for log_type, log_mask in log_type_to_new_mask.items()
+        ])
+        
+        for opcode, payload in responses:
+            
+            operation, status = DIAG_LOG_CONFIG_HEADER.unpack_from(payload)
+            
+            assert operation == LOG_CONFIG_SET_MASK_OP
+            
+            if status != LOG_CONFIG_SUCCESS_S:
+                
+                warning('Warning: log operation %d resulted in status %d' % (operation, status))
+        
+        self.log_type_to_mask.update(log_type_to_new_mask)
+        
+        updated_log_types = ['%s (%d)' % (LOG_TYPE_NAMES.get(log_type, 'UNKNOWN'), log_type)
+            for log_type in log_type_to_new_mask]
+        
+        self.log_mask_cache.save()
+        
+        if not updated_log_types:
+            
+            debug('Log masks unchanged')
+        
+        elif self.subscriber_to_log_codes:
+            
+            info('Enabled logging for: ' + ', '.join(updated_log_types))
+        
+        else:
+            
+            debug('Disabled logging for: ' + ', '.join(updated_log_types))
+    
+    """
+        Obtain the highest valid log code for each existing log type (see
+        the definitions in "_enable_log_mixin.py"), from the cache when the
+        firmware is known, or else from the device.
+    """
+    
+    def _retrieve_id_ranges(self):
+        
+        self.build_id = get_firmware_build_id(self.diag_input)
+        
+        self.log_mask_cache = LogMaskCache(self.cache_path)
+        
+        self.id_ranges = self.log_mask_cache.get_id_ranges(self.build_id)
+        
+        if self.id_ranges is None:
+            
+            opcode, payload = self.diag_input.send_recv(DIAG_LOG_CONFIG_F, pack('<3xI', LOG_CONFIG_RETRIEVE_ID_RANGES_OP))
+            
+            operation, status = DIAG_LOG_CONFIG_HEADER.unpack_from(payload)
+            
+            assert operation == LOG_CONFIG_RETRIEVE_ID_RANGES_OP
+            
+            if status != LOG_CONFIG_SUCCESS_S:
+                
+                warning('Warning: log operation %d resulted in status %d' % (operation, status))
+            
+            self.id_ranges = list(unpack_from('<16I', payload, DIAG_LOG_CONFIG_HEADER.size))
+            
+            if status == LOG_CONFIG_SUCCESS_S:
+                
+                self.log_mask_cache.set_id_ranges(self.build_id, self.id_ranges)
@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from os.path import expandvars, dirname
+from typing import Dict, List, Optional, Iterable
+from os import makedirs, replace
+from sys import platform
+import json
+
+from ..protocol.messages import *
+from ..protocol.headers import DIAG_EXT_BUILD_ID_HEADER
+
+"""
+    This file builds the log masks sent through DIAG_LOG_CONFIG_F (see
+    "_log_mask_manager.py"), and caches them on the disk along with the
+    number of log codes of each log type (LOG_CONFIG_RETRIEVE_ID_RANGES_OP),
+    per firmware build ID (see get_firmware_build_id), so that starting
+    again against the same device does not query and compute them again.
+    
+    The cache (LOG_MASK_CACHE_PATH) has the following format:
+    
+    {"<build ID>": {
+        "id_ranges": [0, 1234, 0, ...],
+        "masks": {"<log type>:<number of bits>:<enabled log codes, or *>": "<hex mask>", ...}
+    }, ...}
+"""
+
+if platform in ('win32', 'cygwin'):
+    
+    LOG_MASK_CACHE_PATH = expandvars('%LOCALAPPDATA%\\QCSuper\\log_masks.json')
+
+else:
+    
+    LOG_MASK_CACHE_PATH = expandvars('$HOME/.cache/qcsuper/log_masks.json')
+
+if '%' in LOG_MASK_CACHE_PATH or '$' in LOG_MASK_CACHE_PATH:
+    LOG_MASK_CACHE_PATH = None # Variable expansion did not work
+
+"""
+    :returns The firmware build ID of the device (DIAG_EXT_BUILD_ID_F), or
+        None if it does not support the request
+"""
+
+def get_firmware_build_id(diag_input) -> Optional[str]:
+    
+    opcode, payload = diag_input.send_recv(DIAG_EXT_BUILD_ID_F, b'', accept_error = True)
+    
+    if opcode != DIAG_EXT_BUILD_ID_F or len(payload) < DIAG_EXT_BUILD_ID_HEADER.size:
+        
+        return None
+    
+    return payload[DIAG_EXT_BUILD_ID_HEADER.size:].split(b'\x00', 1)[0].decode('ascii', 'replace')
+
+"""
+    Build the mask enabling logs for a log type, the bit for the log code
+    (log_type << 12) | i being the bit (i % 8) of the byte (i // 8).
+    
+    :param num_bits: Number of log codes of the log type
+    :param enabled_log_codes: Set of the log codes to enable, or None for all
+    :param bit_value: 0 for building a mask disabling all the logs
+"""
+
+def build_log_mask(log_type : int, num_bits : int, enabled_log_codes : Optional[Iterable[int]] = None,
+    bit_value : int = 1) -> bytes:
+    
+    num_bytes = (num_bits + 7) // 8
+    
+    if not bit_value:
+        return bytes(num_bytes)
+    
+    if enabled_log_codes is None:
+        return ((1 << num_bits) - 1).to_bytes(num_bytes, 'little')
+    
+    mask = 0
+    
+    for log_code in enabled_log_codes:
+        
+        if log_code >> 12 == log_type and log_code & 0xfff < num_bits:
+            
+            mask |= 1 << (log_code & 0xfff)
+    
+    return mask.to_bytes(num_bytes, 'little')
+
+class LogMaskCache:
+    
+    """
+        :param path: Path of the cache file, or None for not using one.
+            Malformed contents are ignored, and replaced when saving.
+    """
+    
+    def __init__(self, path : Optional[str] = LOG_MASK_CACHE_PATH):
+        
+        self.path = path
+        
+        self.build_id_to_entry : Dict[str, dict] = {}
+        
+        self.is_modified = False
+        
+        if self.path:
+            
+            try:
+                
+                with open(self.path) as cache_file:
+                    
+                    build_id_to_entry = json.load(cache_file)
+            
+            except (OSError, ValueError):
+                
+                pass
+            
+            else:
+                
+                if isinstance(build_id_to_entry, dict):
+                    
+                    self.build_id_to_entry = {build_id: entry for build_id, entry in build_id_to_entry.items()
+                        if isinstance(entry, dict)}
+    
+    """
+        :returns The number of log codes of each of the 16 log types for a
+            firmware, or None if unknown
+    """
+    
+    def get_id_ranges(self, build_id : Optional[str]) -> Optional[List[int]]:
+        
+        id_ranges = self.build_id_to_entry.get(build_id, {}).get('id_ranges') if build_id else None
+        
+        if isinstance(id_ranges, list) and len(id_ranges) == 16 and all(
+            type(num_log_codes) == int and num_log_codes >= 0 for num_log_codes in id_ranges):
+            
+            return id_ranges
+        
+        return None
+    
+    def set_id_ranges(self, build_id : Optional[str], id_ranges : List[int]):
+        
+        if build_id:
+            
+            self.build_id_to_entry[build_id] = {'id_ranges': list(id_ranges), 'masks': {}}
+            
+            self.is_modified = True
+    
+    """
+        :returns The mask enabling the given logs (see build_log_mask), taken
+            from the cache when it was already built for the firmware
+    """
+    
+    def get_log_mask(self, build_id : Optional[str], log_type : int, num_bits : int,
+        enabled_log_codes : Optional[Iterable[int]] = None) -> bytes:
+        
+        masks = self.build_id_to_entry.get(build_id, {}).get('masks') if build_id else None
+        
+        if not isinstance(masks, dict):
+            return build_log_mask(log_type, num_bits, enabled_log_codes)
+        
+        mask_key = '%x:%d:%s' % (log_type, num_bits, '*' if enabled_log_codes is None else
+            ','.join('%04x' % log_code for log_code in sorted(enabled_log_codes) if log_code >> 12 == log_type))
+        
+        try:
+            
+            log_mask = bytes.fromhex(masks[mask_key])
+        
+        except (KeyError, TypeError, ValueError):
+            
+            log_mask = None
+        
+        if log_mask is None or len(log_mask) != (num_bits + 7) // 8: # Not cached yet, or malformed
+            
+            log_mask = build_log_mask(log_type, num_bits, enabled_log_codes)
+            
+            masks[mask_key] = log_mask.hex()
+            
+            self.is_modified = True
+        
+        return log_mask
+    
+    """
+        Write the cache to the disk if it was modified, ignoring errors (the
+        cache being optional).
+    """
+    
+    def save(self):
+        
+        if not self.path or not self.is_modified:
+            return
+        
+        try:
+            
+            makedirs(dirname(self.path), exist_ok = True)
+            
+            with open(self.path + '.tmp', 'w') as cache_file:
+                
+                json.dump(self.build_id_to_entry, cache_file, indent = 4)
+            
+            replace(self.path + '.tmp', self.path)
+            
+            self.is_modified = False
+        
+        except OSError:
+            
+            pass
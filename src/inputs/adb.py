@@ -242,8 +242,6 @@ class AdbConnector(HdlcMixin, BaseInput):
             # Launch the adb_bridge
             
             self._relaunch_adb_bridge()
-
-            self.packet_buffer = b''
             
             super().__init__()
     
@@ -372,7 +370,11 @@ class AdbConnector(HdlcMixin, BaseInput):
         
         raw_payload = self.hdlc_encapsulate(bytes([packet_type]) + packet_payload)
         
-        self.socket.send(raw_payload)
+        self.socket.sendall(raw_payload)
+    
+    def send_requests(self, requests):
+        
+        self.socket.sendall(self.hdlc_encapsulate_batch(requests))
     
     def get_gps_location(self):
         
@@ -392,70 +394,43 @@ class AdbConnector(HdlcMixin, BaseInput):
         
         while True:
             
-            while self.TRAILER_CHAR not in self.packet_buffer:
+            # Read message from the TCP socket
+            
+            socket_read = self.socket.recv(1024 * 1024 * 10)
+            
+            if not socket_read and platform in ('cygwin', 'win32'):
                 
-                # Read message from the TCP socket
+                # Windows user hit Ctrl+C from the terminal, which
+                # subsequently propagated to adb_bridge and killed it.
+                # Try to restart the subprocess in order to perform
+                # the deinitialization sequence well.
                 
-                socket_read = self.socket.recv(1024 * 1024 * 10)
+                self._relaunch_adb_bridge()
                 
-                if not socket_read and platform in ('cygwin', 'win32'):
-                    
-                    # Windows user hit Ctrl+C from the terminal, which
-                    # subsequently propagated to adb_bridge and killed it.
-                    # Try to restart the subprocess in order to perform
-                    # the deinitialization sequence well.
-                    
-                    self._relaunch_adb_bridge()
-                    
-                    # If restarting adb succeeded, this confirms the idea
-                    # than the user did Ctrl+C, so we propagate the actual
-                    # Ctrl+C to the main thread.
-                    
-                    if not self.program_is_terminating:
-                        
-                        with self.shutdown_event:
-                        
-                            self.shutdown_event.notify()
-                    
-                    socket_read = self.socket.recv(1024 * 1024 * 10)
+                # If restarting adb succeeded, this confirms the idea
+                # than the user did Ctrl+C, so we propagate the actual
+                # Ctrl+C to the main thread.
                 
-                if not socket_read:
+                if not self.program_is_terminating:
                     
-                    error('\nThe connection to the adb bridge was closed, or ' +
-                        'preempted by another QCSuper instance')
+                    with self.shutdown_event:
                     
-                    return
+                        self.shutdown_event.notify()
                 
-                self.packet_buffer += socket_read
+                socket_read = self.socket.recv(1024 * 1024 * 10)
             
-            while self.TRAILER_CHAR in self.packet_buffer:
-
-                # TODO: Add better auto-reconnect?
-                
-                # Parse frame
-                
-                raw_payload, self.packet_buffer = self.packet_buffer.split(self.TRAILER_CHAR, 1)
-                
-                # Decapsulate and dispatch
-                
-                try:
-                
-                    unframed_message = self.hdlc_decapsulate(
-                        payload = raw_payload + self.TRAILER_CHAR
-                    )
-                
-                except self.InvalidFrameError:
-                    
-                    # The first packet that we receive over the Diag input may
-                    # be partial
-                    
-                    continue
+            if not socket_read:
                 
-                finally:
-                    
-                    self.received_first_packet = True
+                error('\nThe connection to the adb bridge was closed, or ' +
+                    'preempted by another QCSuper instance')
                 
-                self.dispatch_received_diag_packet(unframed_message)
+                return
+            
+            # TODO: Add better auto-reconnect?
+            
+            # Decapsulate and dispatch
+            
+            self.dispatch_hdlc_data(socket_read)
 
     def dispose(self, disposing=True):
 
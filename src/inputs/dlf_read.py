@@ -1,10 +1,15 @@
 #!/usr/bin/python3
 #-*- encoding: Utf-8 -*-
+from logging import info, warning
+from io import UnsupportedOperation
+from mmap import mmap, ACCESS_READ
+from os import replace
 from datetime import datetime
-from struct import unpack
+from struct import Struct
 import gzip
 
 from ._base_input import BaseInput
+from ..protocol.headers import LOG_HEADER
 
 """
     This class implements reading Qualcomm DIAG data from a DLF file.
@@ -15,56 +20,360 @@ from ._base_input import BaseInput
     The default export format for recent versions of QXDM is ISF, but an
     ISF file can be converted to DLF using an internal QXDM tool. This
     format is implemented here for interoperability purposes.
+    
+    Regular files are memory-mapped, and records are walked by offset and
+    passed to modules as memoryviews over the mapping. Gzipped files and
+    pipes are read as a stream.
+    
+    Records may be selected by time range and log code. When the use of an
+    index is requested, a sidecar index file (see DlfIndex) is loaded or
+    built, so that only the selected records are accessed.
+"""
+
+"""
+    You can encounter multiple formats for the timestamps used in Diag LOG
+    frames, but the most common uses a QWORD where the upper bits are units
+    of 20 ms, and the 20 lower bits are the mantissa.
+    
+    Timestamps outside of the [TIMESTAMP_MIN, TIMESTAMP_MAX] range are
+    considered to use an uncommon format, and are replaced with the
+    timestamp of the latest read packet.
+"""
+
+TIMESTAMP_OFFSET = datetime(1980, 1, 6).timestamp()
+TIMESTAMP_MIN = datetime(2010, 1, 1).timestamp()
+TIMESTAMP_MAX = datetime(2050, 1, 1).timestamp()
+
+def decode_log_time(log_time, previous_timestamp):
+    
+    log_time = (log_time >> 20) / 50 + TIMESTAMP_OFFSET + ((log_time & 0xfffff) / 0x100000)
+    
+    return log_time if TIMESTAMP_MIN <= log_time <= TIMESTAMP_MAX else previous_timestamp
+
+"""
+    Walk the complete records of a memory-mapped DLF file.
+    
+    :param dlf_map: A bytes-like object with the contents of the file
+    :param offset: Offset of the first record to walk
+    :param timestamp: Timestamp of the record preceding it, if any
+    
+    :returns An iterator over (offset, log length, log code, timestamp) tuples
+"""
+
+def iter_dlf_records(dlf_map, offset = 0, timestamp = 0):
+    
+    size = len(dlf_map)
+    
+    unpack_log_header = LOG_HEADER.unpack_from
+    
+    while offset + LOG_HEADER.size <= size:
+        
+        log_length, log_type, log_time = unpack_log_header(dlf_map, offset)
+        
+        if log_length < LOG_HEADER.size or offset + log_length > size:
+            
+            warning('Corrupt or truncated DLF record at offset %d, ignoring the rest of the file' % offset)
+            
+            break
+        
+        timestamp = decode_log_time(log_time, timestamp)
+        
+        yield offset, log_length, log_type, timestamp
+        
+        offset += log_length
+
+"""
+    Read the records of a DLF file which can't be memory-mapped (gzipped
+    file or pipe).
+    
+    :param dlf_file: A file object opened in binary mode
+    :param timestamp: Timestamp of the record preceding the first one, if any
+    
+    :returns An iterator over (log header, log payload, log code, timestamp)
+        tuples
+"""
+
+def iter_streamed_dlf_records(dlf_file, timestamp = 0):
+    
+    offset = 0
+    
+    while True:
+        
+        """
+            Parse the inner header and payload.
+        """
+        
+        log_header = dlf_file.read(LOG_HEADER.size)
+        if not log_header:
+            return
+        
+        if len(log_header) < LOG_HEADER.size:
+            
+            warning('Corrupt or truncated DLF record at offset %d, ignoring the rest of the file' % offset)
+            
+            return
+        
+        log_length, log_type, log_time = LOG_HEADER.unpack(log_header)
+        
+        log_data = dlf_file.read(max(log_length - LOG_HEADER.size, 0))
+        
+        if log_length < LOG_HEADER.size or len(log_data) < log_length - LOG_HEADER.size:
+            
+            warning('Corrupt or truncated DLF record at offset %d, ignoring the rest of the file' % offset)
+            
+            return
+        
+        offset += log_length
+        
+        timestamp = decode_log_time(log_time, timestamp)
+        
+        yield log_header, log_data, log_type, timestamp
+
 """
+    This class implements the sidecar index of a DLF file, stored next to it
+    with an ".idx" suffix. It is made of an INDEX_HEADER followed by one
+    INDEX_RECORD for each record of the DLF file.
+    
+    The index records the size of the DLF file it covers, so that it is
+    extended rather than rebuilt when records were appended to the file.
+"""
+
+INDEX_MAGIC = b'QCSDLFI\x01'
+
+INDEX_HEADER = Struct('<8sQ') # Magic, size of the indexed part of the DLF file
+INDEX_RECORD = Struct('<QHHd') # Record offset, log length, log code, timestamp
+
+class DlfIndex:
+    
+    def __init__(self):
+        
+        self.records = bytearray() # Packed INDEX_RECORD structures
+        
+        self.indexed_size = 0
+    
+    """
+        :param dlf_map: The memory-mapped DLF file
+        :param index_path: Path to the sidecar index file
+    """
+    
+    @classmethod
+    def load_or_build(cls, dlf_map, index_path):
+        
+        index = cls()
+        
+        try:
+            
+            with open(index_path, 'rb') as index_file:
+                
+                index.load(index_file.read(), dlf_map)
+        
+        except OSError:
+            
+            pass
+        
+        loaded_size = index.indexed_size
+        
+        index.extend(dlf_map)
+        
+        if index.indexed_size != loaded_size or not loaded_size:
+            
+            info('Indexed %d records of %s' % (len(index.records) // INDEX_RECORD.size, index_path))
+            
+            index.save(index_path)
+        
+        return index
+    
+    """
+        Load the contents of an index file, unless it doesn't match the DLF
+        file (in which case the index is left empty and will be rebuilt).
+    """
+    
+    def load(self, index_data, dlf_map):
+        
+        if len(index_data) < INDEX_HEADER.size or (len(index_data) - INDEX_HEADER.size) % INDEX_RECORD.size:
+            
+            return
+        
+        magic, indexed_size = INDEX_HEADER.unpack_from(index_data)
+        
+        if magic != INDEX_MAGIC or indexed_size > len(dlf_map):
+            
+            return
+        
+        records = index_data[INDEX_HEADER.size:]
+        
+        # Check that the last indexed record is still present in the DLF file,
+        # as a replaced file of a larger size could otherwise be mistaken for
+        # an appended one
+        
+        if records:
+            
+            offset, log_length, log_type, timestamp = INDEX_RECORD.unpack_from(records, len(records) - INDEX_RECORD.size)
+            
+            if (offset + log_length != indexed_size or
+                LOG_HEADER.unpack_from(dlf_map, offset)[:2] != (log_length, log_type)):
+                
+                return
+        
+        self.records = bytearray(records)
+        self.indexed_size = indexed_size
+    
+    """
+        Index the records of the DLF file which follow the indexed part.
+    """
+    
+    def extend(self, dlf_map):
+        
+        timestamp = 0
+        
+        if self.records:
+            
+            timestamp = INDEX_RECORD.unpack_from(self.records, len(self.records) - INDEX_RECORD.size)[3]
+        
+        pack_index_record = INDEX_RECORD.pack
+        
+        for offset, log_length, log_type, timestamp in iter_dlf_records(dlf_map, self.indexed_size, timestamp):
+            
+            self.records += pack_index_record(offset, log_length, log_type, timestamp)
+            
+            self.indexed_size = offset + log_length
+    
+    def save(self, index_path):
+        
+        try:
+            
+            with open(index_path + '.tmp', 'wb') as index_file:
+                
+                index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, self.indexed_size))
+                index_file.write(self.records)
+            
+            replace(index_path + '.tmp', index_path)
+        
+        except OSError as exception:
+            
+            warning('Could not write the DLF index to %s: %s' % (index_path, exception))
+    
+    """
+        :returns An iterator over the (offset, log length, log code,
+            timestamp) tuples of the selected records
+    """
+    
+    def select(self, start_time = None, stop_time = None, log_codes = None):
+        
+        for offset, log_length, log_type, timestamp in INDEX_RECORD.iter_unpack(self.records):
+            
+            if ((log_codes is None or log_type in log_codes) and
+                (start_time is None or timestamp >= start_time) and
+                (stop_time is None or timestamp <= stop_time)):
+                
+                yield offset, log_length, log_type, timestamp
 
 class DlfReader(BaseInput):
     
-    def __init__(self, dlf_file):
+    """
+        :param dlf_file: A file object opened in binary mode
+        :param use_index: Whether to load or build a sidecar index for the
+            DLF file, when it can be memory-mapped
+        :param start_time: Optional timestamp of the first record to read
+        :param stop_time: Optional timestamp of the last record to read
+        :param log_codes: Optional set of log codes to read
+    """
+    
+    def __init__(self, dlf_file, use_index = False, start_time = None, stop_time = None, log_codes = None):
         
         self.dlf_file = dlf_file
         
+        self.use_index = use_index
+        
+        self.start_time = start_time
+        self.stop_time = stop_time
+        self.log_codes = log_codes
+        
         # We keep track of the timestamp of the latest read packet, in the case
         # where the next packet we'll read happens to use an uncommon format
         
         self.timestamp = 0
         
+        # Gzipped files expose the descriptor of the compressed file, which
+        # must not be mapped
+        
+        self.dlf_map = None
+        
+        if not isinstance(dlf_file, gzip.GzipFile):
+            
+            try:
+                
+                self.dlf_map = mmap(dlf_file.fileno(), 0, access = ACCESS_READ)
+            
+            except (OSError, ValueError, UnsupportedOperation): # Pipe or empty file
+                
+                pass
+        
+        if use_index and not (self.dlf_map and isinstance(getattr(dlf_file, 'name', None), str) and not dlf_file.name.startswith('<')):
+            
+            warning('The DLF file is not a regular file, it will be read without an index')
+            
+            self.use_index = False
+        
         super().__init__()
     
+    def is_selected(self, log_type, timestamp):
+        
+        return ((self.log_codes is None or log_type in self.log_codes) and
+            (self.start_time is None or timestamp >= self.start_time) and
+            (self.stop_time is None or timestamp <= self.stop_time))
+    
     def read_loop(self):
         
-        while True:
+        if self.dlf_map:
             
-            TIMESTAMP_OFFSET = datetime(1980, 1, 6).timestamp()
-            TIMESTAMP_MIN = datetime(2010, 1, 1).timestamp()
-            TIMESTAMP_MAX = datetime(2050, 1, 1).timestamp()
+            self.read_mapped_records()
+        
+        else:
             
-            """
-                Parse the inner header and payload.
-            """
+            self.read_streamed_records()
+        
+        exit(0)
+    
+    def read_mapped_records(self):
+        
+        dlf_view = memoryview(self.dlf_map)
+        
+        if self.use_index:
             
-            log_header = self.dlf_file.read(12)
-            if not log_header:
-                exit(0)
+            index = DlfIndex.load_or_build(self.dlf_map, self.dlf_file.name + '.idx')
             
-            log_length, log_type, log_time = unpack('<HHQ', log_header)
+            records = index.select(self.start_time, self.stop_time, self.log_codes)
+        
+        else:
             
-            log_data = self.dlf_file.read(log_length - 12)
+            records = (
+                record for record in iter_dlf_records(self.dlf_map)
+                if self.is_selected(record[2], record[3])
+            )
+        
+        header_size = LOG_HEADER.size
+        
+        for offset, log_length, log_type, self.timestamp in records:
             
             """
-                You can encounter multiple formats for the timestamps used
-                in Diag LOG frames, but the most common uses a QWORD where
-                the upper bits are units of 20 ms, and the 20 lower bits
-                are the mantissa.
+                Dispatch the log frame to modules.
             """
             
-            log_time = (log_time >> 20) / 50 + TIMESTAMP_OFFSET + ((log_time & 0xfffff) / 0x100000)
+            self.dispatch_diag_log(log_type,
+                dlf_view[offset + header_size:offset + log_length],
+                dlf_view[offset:offset + header_size],
+                self.timestamp)
+    
+    def read_streamed_records(self):
+        
+        for log_header, log_data, log_type, self.timestamp in iter_streamed_dlf_records(self.dlf_file, self.timestamp):
+            
+            if not self.is_selected(log_type, self.timestamp):
+                continue
             
-            if TIMESTAMP_MIN <= log_time <= TIMESTAMP_MAX:
-                self.timestamp = log_time        
             """
                 Dispatch the log frame to modules.
             """
             
             self.dispatch_diag_log(log_type, log_data, log_header, self.timestamp)
-
-
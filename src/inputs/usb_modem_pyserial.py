@@ -28,8 +28,15 @@ from ..protocol.messages import *
 """
     This class implements reading Qualcomm DIAG data from an USB modem
     exposing a pseudo-serial port.
+    
+    Reads are performed in bulk: the bytes already pending on the serial
+    port are drained at once, or when none are, up to "read_size" bytes are
+    waited for during at most "read_latency" seconds.
 """
 
+DEFAULT_SERIAL_READ_SIZE = 0x10000
+DEFAULT_SERIAL_READ_LATENCY = 0.01
+
 class UsbModemPyserialConnector(HdlcMixin, BaseInput):
     
     """
@@ -42,9 +49,13 @@ class UsbModemPyserialConnector(HdlcMixin, BaseInput):
     
         :param device (str): Name of the serial device (like "/dev/ttyHS2" on
             UNIX, or "COM1" on Windows)
+        :param read_size (int): Maximal number of bytes requested at once from
+            the serial port when no byte is already pending
+        :param read_latency (float): Maximal time in seconds waited for
+            "read_size" bytes before dispatching the bytes already received
     """
     
-    def __init__(self, device):
+    def __init__(self, device, read_size = DEFAULT_SERIAL_READ_SIZE, read_latency = DEFAULT_SERIAL_READ_LATENCY):
 
         # WIP
         # <Implement Parser of USB-device syntax BEGIN>
@@ -77,12 +88,14 @@ class UsbModemPyserialConnector(HdlcMixin, BaseInput):
             baudrate = 115200,
             
             rtscts = True,
-            dsrdtr = True
+            dsrdtr = True,
+            
+            timeout = read_latency
         )
         
         self.device = device
         
-        self.received_first_packet = False
+        self.read_size = read_size
         
         super().__init__()
     
@@ -224,51 +237,35 @@ class UsbModemPyserialConnector(HdlcMixin, BaseInput):
         
         self.serial.write(raw_payload)
     
+    def send_requests(self, requests):
+        
+        self.serial.write(self.hdlc_encapsulate_batch(requests))
+    
     def read_loop(self):
         
         while True:
                 
-            # Read more bytes until a trailer character is found
-
-            raw_payload = b''
-            
-            while not raw_payload.endswith(self.TRAILER_CHAR):
-                
-                try:
-                    char_read = self.serial.read()
-                    assert char_read
-                
-                except Exception:
-                    error('\nThe serial port was closed or preempted by another process.')
-                    
-                    exit()
-                
-                raw_payload += char_read
+            # Read the pending bytes, or wait for more bytes until the
+            # latency bound is reached
             
-            # Decapsulate and dispatch
+            try:
+                data_read = self.serial.read(self.serial.in_waiting or self.read_size)
             
-            if raw_payload == self.TRAILER_CHAR:
-                error('The modem seems to be unavailable.')
+            except Exception:
+                error('\nThe serial port was closed or preempted by another process.')
                 
                 exit()
             
-            try:
-            
-                unframed_message = self.hdlc_decapsulate(
-                    payload = raw_payload
-                )
-            
-            except self.InvalidFrameError:
-                
-                # The first packet that we receive over the Diag input may
-                # be partial
+            if not data_read: # The read timed out
                 
                 continue
             
-            finally:
-                
-                self.received_first_packet = True
+            # Decapsulate and dispatch
             
-            self.dispatch_received_diag_packet(unframed_message)
-
-
+            self.dispatch_hdlc_data(data_read)
+    
+    def on_empty_hdlc_frame(self):
+        
+        error('The modem seems to be unavailable.')
+        
+        exit()
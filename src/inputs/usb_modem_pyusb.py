@@ -7,19 +7,69 @@ from ._hdlc_mixin import HdlcMixin
 from ._base_input import BaseInput
 
 from usb.util import dispose_resources
+from queue import Queue, Full
+from threading import Thread, Event
 from traceback import format_exc
-from usb.core import USBError
+from usb.core import USBError, USBTimeoutError
 from typing import Optional
-from time import sleep
+
+"""
+    This class implements reading Qualcomm DIAG data from an USB modem
+    exposing a Diag bulk interface, through libusb.
+    
+    Reads are performed by a dedicated reader thread, which keeps issuing
+    large bulk-IN transfers (that the USB stack splits into many in-flight
+    packets) and hands the completed buffers to the read loop through a
+    bounded queue, so that the endpoint is kept drained while the read loop
+    is busy dispatching frames to modules.
+    
+    When the queue is full, the reader thread waits for room before issuing
+    the next transfer, so that the data stays buffered by the device rather
+    than being dropped (packets may only be dropped by the dispatch queue,
+    see BaseInput.enable_dispatch_pipeline).
+    
+    Transfers are issued with a timeout, so that the reader thread can be
+    stopped when the input is disposed of.
+"""
+
+DEFAULT_USB_TRANSFER_SIZE = 0x4000
+DEFAULT_USB_QUEUE_DEPTH = 64
+
+USB_READ_TIMEOUT = 1000 # In milliseconds
 
 class UsbModemPyusbConnector(HdlcMixin, BaseInput):
 
     dev_intf : Optional[PyusbDevInterface] = None
 
-    def __init__(self, dev_intf : PyusbDevInterface):
+    """
+        :param dev_intf: The Diag interface found for the device
+        :param transfer_size (int): Size of each bulk-IN transfer, rounded up
+            to a multiple of the endpoint's wMaxPacketSize
+        :param queue_depth (int): Number of completed transfers that may be
+            pending dispatch before the endpoint stops being read
+    """
+
+    def __init__(self, dev_intf : PyusbDevInterface, transfer_size = DEFAULT_USB_TRANSFER_SIZE, queue_depth = DEFAULT_USB_QUEUE_DEPTH):
 
         self.dev_intf = dev_intf
 
+        max_packet_size = self.dev_intf.read_endpoint.wMaxPacketSize or 0x200
+
+        self.transfer_size = max(max_packet_size, -(-transfer_size // max_packet_size) * max_packet_size)
+
+        self.completed_transfers = Queue(maxsize = queue_depth)
+
+        self.reader_thread : Optional[Thread] = None
+        self.stop_reading = Event()
+
+        self._disposed = False
+
+        # Statistics about the reader thread
+
+        self.num_transfers = 0
+        self.num_short_transfers = 0
+        self.num_full_queue_waits = 0 # Times the read loop fell behind
+
         try:
             status = self.dev_intf.device.is_kernel_driver_active(self.dev_intf.interface.index)
         except Exception:
@@ -39,18 +89,43 @@ class UsbModemPyusbConnector(HdlcMixin, BaseInput):
         except USBError:
             pass
 
-        self.received_first_packet = False
-
         super().__init__()
 
+    def dispose(self, disposing = True):
+
+        if not self._disposed:
+
+            self._disposed = True
+
+            # Stop the reader thread, which notices it after its current
+            # transfer completes or times out
+
+            self.stop_reading.set()
+
+            if self.reader_thread:
+                self.reader_thread.join(2 * USB_READ_TIMEOUT / 1000)
+
+            debug('USB read statistics: %d transfers, %d short transfers, %d waits for the read loop' % (
+                self.num_transfers, self.num_short_transfers, self.num_full_queue_waits))
+
     def __del__(self):
         
+        super().__del__() # Stops the reader thread before its resources are released
+        
         if self.dev_intf and self.dev_intf.device:
             dispose_resources(self.dev_intf.device)
 
+    def on_too_short_hdlc_frame(self):
+        
+        warning('(Received a too short diag frame)')
+
     def send_request(self, packet_type, packet_payload):
         
-        raw_payload = self.hdlc_encapsulate(bytes([packet_type]) + packet_payload)
+        self.send_requests([(packet_type, packet_payload)])
+
+    def send_requests(self, requests):
+        
+        raw_payload = self.hdlc_encapsulate_batch(requests)
         
         try:
             self.dev_intf.write_endpoint.write(raw_payload)
@@ -59,71 +134,77 @@ class UsbModemPyusbConnector(HdlcMixin, BaseInput):
                 "root/administrator privileges, or that the device was unplugged? " + format_exc())
 
     def read_loop(self):
-        
-        read_buffer = b''
 
-        num_reconnect_retries = 0
+        self.reader_thread = Thread(target = self._usb_reader_thread, daemon = True)
+        self.reader_thread.start()
 
         while True:
-                
-            # Read more bytes until a trailer character is found
 
-            read_size = self.dev_intf.read_endpoint.wMaxPacketSize or 0x200
+            data_read = self.completed_transfers.get()
+
+            if data_read is None: # The reader thread lost the USB link
+                error('Connection to the USB link lost despite retries')
+                exit()
             
-            while self.TRAILER_CHAR not in read_buffer:
-                
-                try:
-                    data_read = bytes(self.dev_intf.read_endpoint.read(read_size, timeout = 0x7fffffff))
-                    assert data_read
-                
-                except Exception:
+            # Decapsulate and dispatch
+            
+            self.dispatch_hdlc_data(data_read)
 
-                    info('Connection from the USB link closed')
-                    debug('Reason for closing the link: ' + format_exc())
+    """
+        Keep issuing bulk-IN transfers on the read endpoint, and queue their
+        contents for the read loop, until the input is disposed of. A None
+        item is queued when the USB link is lost.
+    """
 
-                    # Retry loop.
+    def _usb_reader_thread(self):
 
-                    if num_reconnect_retries >= 3:
-                        error('Connection to the USB link lost despite retries')
-                        exit()
-                    sleep(2)
-                    num_reconnect_retries += 1
+        num_reconnect_retries = 0
 
-                else:
-                    num_reconnect_retries = 0
+        while not self.stop_reading.is_set():
                 
-                read_buffer += data_read
+            # Read more bytes from the endpoint
             
-            # Decapsulate and dispatch
+            try:
+                data_read = self.dev_intf.read_endpoint.read(self.transfer_size, timeout = USB_READ_TIMEOUT)
+                assert data_read
             
-            while self.TRAILER_CHAR in read_buffer:
+            except USBTimeoutError:
 
-                end_pos = read_buffer.index(self.TRAILER_CHAR) + 1
-                raw_payload = read_buffer[:end_pos]
-                read_buffer = read_buffer[end_pos:]
+                continue # No data received meanwhile
 
-                if raw_payload == self.TRAILER_CHAR:
-                    warning('(Received an empty diag frame)')
-                elif len(raw_payload) < 3:
-                    warning('(Received a too short diag frame)')
-                
-                else:
-                    
-                    try:
-                    
-                        unframed_message = self.hdlc_decapsulate(
-                            payload = raw_payload
-                        )
-                    
-                    except self.InvalidFrameError:
-                        
-                        # The first packet that we receive over the Diag input may
-                        # be partial
-                        
-                        continue
-                    
-                    finally:
-                        
-                        self.received_first_packet = True
-                    
-                    self.dispatch_received_diag_packet(unframed_message)
+            except Exception:
+
+                info('Connection from the USB link closed')
+                debug('Reason for closing the link: ' + format_exc())
+
+                # Retry loop.
+
+                if num_reconnect_retries >= 3:
+                    self.completed_transfers.put(None)
+                    return
+                self.stop_reading.wait(2)
+                num_reconnect_retries += 1
+
+                continue
+
+            num_reconnect_retries = 0
+
+            self.num_transfers += 1
+
+            if len(data_read) < self.transfer_size:
+                self.num_short_transfers += 1
+
+            # Wait for the read loop when it falls behind, so that the device
+            # holds the data meanwhile
+
+            if self.completed_transfers.full():
+                self.num_full_queue_waits += 1
+
+            while not self.stop_reading.is_set():
+
+                try:
+                    self.completed_transfers.put(data_read, timeout = USB_READ_TIMEOUT / 1000)
+                    break
+
+                except Full:
+                    pass
@@ -4,6 +4,7 @@
 from logging import DEBUG, INFO, basicConfig, error, info, debug, warning
 from argparse import RawTextHelpFormatter
 from argparse import ArgumentParser
+from datetime import datetime
 from os.path import expanduser
 from pathlib import Path
 from sys import stderr
@@ -14,16 +15,31 @@ from .modules.cli import CommandLineInterface
 from .modules.dlf_dump import DlfDumper
 from .modules.info import InfoRetriever
 from .modules._utils import FileType
+from .modules._buffered_writer import DEFAULT_FLUSH_INTERVAL, LOW_LATENCY_FLUSH_INTERVAL
 
 from .inputs.json_geo_read import JsonGeoReader
-from .inputs.usb_modem_pyserial import UsbModemPyserialConnector
-from .inputs.usb_modem_pyusb import UsbModemPyusbConnector
+from .inputs.usb_modem_pyserial import UsbModemPyserialConnector, DEFAULT_SERIAL_READ_SIZE, DEFAULT_SERIAL_READ_LATENCY
+from .inputs.usb_modem_pyusb import UsbModemPyusbConnector, DEFAULT_USB_TRANSFER_SIZE, DEFAULT_USB_QUEUE_DEPTH
 from .inputs.usb_modem_pyusb_devfinder import PyusbDevInterface, PyusbDevNotFoundReason
 from .inputs.usb_modem_argparser import UsbModemArgParser, UsbModemArgType
 from .inputs.dlf_read import DlfReader
 from .inputs.adb import AdbConnector
 from .inputs.adb_wsl2 import AdbWsl2Connector
 from .inputs.tcp_connector import TcpConnector
+from .inputs._dispatch_queue import DISPATCH_POLICIES, DISPATCH_POLICY_BLOCK
+from .inputs._diag_requests import DEFAULT_DIAG_REQUEST_WINDOW
+from .modules.efs_shell_commands._efs_cache import DEFAULT_EFS_CACHE_TTL
+
+"""
+    Parse a time passed on the command line, either as an UNIX timestamp or
+    as an ISO 8601 date, into an UNIX timestamp.
+"""
+
+def parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
 
 def main():
 
@@ -59,6 +75,7 @@ def main():
         '    bInterfaceNumber) format in decimal: e.g "001:003" or "001:003:0:3" (bus and addr are\n' +
         '    three zero-padded digits, cfg and intf are canonical values from the USB descriptor)')
     input_mode.add_argument('--dlf-read', metavar = 'DLF_FILE', type = FileType('rb'), help = 'Read a DLF file generated by QCSuper or QXDM, enabling interoperability with vendor software.')
+    input_mode.add_argument('--dlf-batch', metavar = 'DLF_PATH', help = 'Convert a DLF file, or a directory of DLF files, to the PCAP file passed to --pcap-dump, using all CPU cores (offline).')
     input_mode.add_argument('--json-geo-read', metavar = 'JSON_FILE', type = FileType('r'), help = 'Read a JSON file generated using --json-geo-dump.')
 
     modules = parser.add_argument_group(title = 'Modules', description = 'Modules writing to a file will append when it already exists, and consider it Gzipped if their name contains ".gz".')
@@ -66,7 +83,8 @@ def main():
     modules.add_argument('--info', action = 'store_true', help = 'Read generic information about the baseband device.')
     modules.add_argument('--pcap-dump', metavar = 'PCAP_FILE', type = FileType('ab'), help = 'Generate a PCAP file containing GSMTAP frames for 2G/3G/4G, to be loaded using Wireshark.')
     modules.add_argument('--wireshark-live', action = 'store_true', help = 'Same as --pcap-dump, but directly spawn a Wireshark instance.')
-    # modules.add_argument('--efs-dump', metavar = 'OUTPUT_DIR', help = 'Dump the internal EFS filesystem of the device.')
+    modules.add_argument('--efs-dump', metavar = 'OUTPUT_DIR', help = 'Dump the internal EFS filesystem of the device. When dumping again to the same directory, only the files which changed are downloaded.')
+    modules.add_argument('--efs-tar', metavar = 'ARCHIVE', help = 'Stream the EFS filesystem of the device, or the directory passed to --efs-path, to a tar archive (compressed if its name ends with ".tar.gz", ".tgz", ".tar.bz2" or ".tar.xz", "-" for the standard output).')
     modules.add_argument('--memory-dump', metavar = 'OUTPUT_DIR', help = 'Dump the memory of the device (may not or partially work with recent devices).')
     modules.add_argument('--dlf-dump', metavar = 'DLF_FILE', type = FileType('ab'), help = 'Generate a DLF file to be loaded using QCSuper or QXDM, with network protocols logging.')
     modules.add_argument('--json-geo-dump', metavar = 'JSON_FILE', type = FileType('a'), help = 'Generate a JSON file containing both raw log frames and GPS coordinates, for further reprocessing. ' +
@@ -79,6 +97,47 @@ def main():
     pcap_options.add_argument('--decrypt-nas', action = 'store_true', help = 'Include unencrypted LTE NAS as supplementary frames, also embedded ciphered in RRC frames.')
     pcap_options.add_argument('--include-ip-traffic', action = 'store_true', help = 'Include unframed IP traffic from the UE.')
 
+    output_options = parser.add_argument_group(title = 'Output options', description = 'To be used along with --pcap-dump, --wireshark-live or --dlf-dump.')
+
+    output_options.add_argument('--flush-interval', metavar = 'SECONDS', type = float, help = 'Maximal time during which captured frames are kept in memory before being written at once, by default %g for files and %g for pipes (such as --wireshark-live). Use 0 to write each frame at once.' % (DEFAULT_FLUSH_INTERVAL, LOW_LATENCY_FLUSH_INTERVAL))
+    output_options.add_argument('--fsync-interval', metavar = 'SECONDS', type = float, help = 'Synchronize the written frames to the disk at most every this number of seconds, for not losing them if the system crashes.')
+
+    dlf_read_options = parser.add_argument_group(title = 'DLF reading options', description = 'To be used along with --dlf-read. Times are either UNIX timestamps or ISO 8601 dates (e.g. "2024-03-01T12:00:00").')
+
+    dlf_read_options.add_argument('--dlf-index', action = 'store_true', help = 'Load or build an index of the DLF file, stored next to it with an ".idx" suffix, so that only the selected records are read.')
+    dlf_read_options.add_argument('--dlf-start', metavar = 'TIME', type = parse_time, help = 'Skip the records logged before this time.')
+    dlf_read_options.add_argument('--dlf-stop', metavar = 'TIME', type = parse_time, help = 'Skip the records logged after this time.')
+    dlf_read_options.add_argument('--dlf-logs', metavar = 'LOG_CODES', help = 'Comma-separated list of log codes (hex numbers, e.g. "b0c0,11eb") to read, by default all of them.')
+    dlf_read_options.add_argument('--dlf-jobs', metavar = 'NUM_PROCESSES', type = int, help = 'Number of processes used by --dlf-batch, by default the number of CPU cores.')
+
+    usb_modem_options = parser.add_argument_group(title = 'USB modem options', description = 'To be used along with --usb-modem or --adb, when the Diag port is reached directly over USB.')
+
+    usb_modem_options.add_argument('--usb-transfer-size', metavar = 'BYTES', type = int, default = DEFAULT_USB_TRANSFER_SIZE, help = 'Size of each bulk transfer queued on a Diag USB endpoint, by default %d.' % DEFAULT_USB_TRANSFER_SIZE)
+    usb_modem_options.add_argument('--usb-queue-depth', metavar = 'TRANSFERS', type = int, default = DEFAULT_USB_QUEUE_DEPTH, help = 'Number of completed bulk transfers that may wait for processing before further ones are dropped, by default %d.' % DEFAULT_USB_QUEUE_DEPTH)
+    usb_modem_options.add_argument('--serial-read-size', metavar = 'BYTES', type = int, default = DEFAULT_SERIAL_READ_SIZE, help = 'Maximal number of bytes read at once from a Diag pseudo-serial port, by default %d.' % DEFAULT_SERIAL_READ_SIZE)
+    usb_modem_options.add_argument('--serial-read-latency', metavar = 'MILLISECONDS', type = float, default = DEFAULT_SERIAL_READ_LATENCY * 1000, help = 'Maximal time waited for more bytes before processing the bytes read from a Diag pseudo-serial port, by default %d.' % (DEFAULT_SERIAL_READ_LATENCY * 1000))
+
+    dispatch_options = parser.add_argument_group(title = 'Dispatch options', description = 'Decouple reading from the Diag input and processing by modules.')
+
+    dispatch_options.add_argument('--dispatch-queue', metavar = 'NUM_PACKETS', type = int, help = 'Pass logs and messages to modules from a separate thread, through a queue holding at most this number of packets.')
+    dispatch_options.add_argument('--dispatch-policy', choices = DISPATCH_POLICIES, default = DISPATCH_POLICY_BLOCK, help = 'What to do when the dispatch queue is full: block reads from the input, or drop the oldest or newest packets, by default "%s".' % DISPATCH_POLICY_BLOCK)
+    dispatch_options.add_argument('--droppable-logs', metavar = 'LOG_CODES', help = 'Comma-separated list of log codes (hex numbers, e.g. "b0c0,11eb") which may be dropped when the dispatch queue is full, by default all logs and messages.')
+
+    request_options = parser.add_argument_group(title = 'Diag request options', description = 'To be used when sending requests to a Diag device.')
+
+    request_options.add_argument('--diag-window', metavar = 'NUM_REQUESTS', type = int, default = DEFAULT_DIAG_REQUEST_WINDOW, help = 'Maximal number of Diag requests in flight during bulk operations (EFS transfers, memory dumps), by default %d. Use 1 for devices which do not cope with pipelined requests.' % DEFAULT_DIAG_REQUEST_WINDOW)
+
+    tracing_options = parser.add_argument_group(title = 'Tracing options', description = 'Trace each sent or received Diag packet, to be used along with -v or --trace-file.')
+
+    tracing_options.add_argument('--trace-logs', metavar = 'LOG_CODES', help = 'Comma-separated list of log codes (hex numbers, e.g. "b0c0,11eb") to which tracing is narrowed.')
+    tracing_options.add_argument('--trace-opcodes', metavar = 'OPCODES', help = 'Comma-separated list of opcodes (hex numbers, e.g. "4b,79") to which tracing of requests, responses and messages is narrowed.')
+    tracing_options.add_argument('--trace-file', metavar = 'TRACE_FILE', type = FileType('ab'), help = 'Write traces to this binary file rather than to the standard error output, see "src/inputs/_diag_tracer.py" for the format.')
+
+    efs_options = parser.add_argument_group(title = 'EFS options', description = 'To be used along with --efs-shell or --efs-tar.')
+
+    efs_options.add_argument('--efs-path', metavar = 'REMOTE_DIR', default = '/', help = 'Directory of the EFS to archive with --efs-tar, by default /.')
+    efs_options.add_argument('--efs-cache-ttl', metavar = 'SECONDS', type = float, default = DEFAULT_EFS_CACHE_TTL, help = 'Number of seconds during which the EFS shell reuses directory listings and file metadata, invalidated by the commands modifying them, by default %d. Use 0 to always query the device.' % DEFAULT_EFS_CACHE_TTL)
+
     memory_options = parser.add_argument_group(title = 'Memory dumping options', description = 'To be used along with --memory-dump.')
 
     memory_options.add_argument('--start', metavar = 'MEMORY_START', default = '00000000', help = 'Offset at which to start to dump memory (hex number), by default 00000000.')
@@ -90,8 +149,29 @@ def main():
                 format='[%(asctime)s | %(levelname)s @ %(filename)s:%(lineno)d ] %(message)s',
                 force = True, datefmt = '%H:%M:%S')
 
+    if args.dlf_batch:
+        if not args.pcap_dump:
+            parser.print_usage()
+            error('--dlf-batch must be used along with --pcap-dump')
+            exit()
+        from .modules.pcap_batch import convert_dlf_to_pcap
+        convert_dlf_to_pcap(expanduser(args.dlf_batch), args.pcap_dump, args.reassemble_sibs, args.decrypt_nas, args.include_ip_traffic, args.dlf_jobs)
+        args.pcap_dump.close()
+        return 0
+
+    pyusb_options = dict(
+        transfer_size = args.usb_transfer_size,
+        queue_depth = args.usb_queue_depth
+    )
+
+    pyserial_options = dict(
+        read_size = args.serial_read_size,
+        read_latency = args.serial_read_latency / 1000
+    )
+
     if args.dlf_read:
-        diag_input = DlfReader(args.dlf_read)
+        diag_input = DlfReader(args.dlf_read, args.dlf_index, args.dlf_start, args.dlf_stop,
+            {int(log_code, 16) for log_code in args.dlf_logs.split(',')} if args.dlf_logs else None)
     elif args.adb_wsl2:
         win_adb_path = Path(args.adb_wsl2).resolve()
         if not win_adb_path.is_file():
@@ -101,17 +181,17 @@ def main():
         if diag_input.usb_modem and not diag_input.usb_modem.not_found_reason:
             usb_modem : PyusbDevInterface = diag_input.usb_modem
             if usb_modem.chardev_if_mounted:
-                diag_input = UsbModemPyserialConnector(usb_modem.chardev_if_mounted)
+                diag_input = UsbModemPyserialConnector(usb_modem.chardev_if_mounted, **pyserial_options)
             else:
-                diag_input = UsbModemPyusbConnector(usb_modem)
+                diag_input = UsbModemPyusbConnector(usb_modem, **pyusb_options)
     elif args.adb:
         diag_input = AdbConnector()
         if diag_input.usb_modem and not diag_input.usb_modem.not_found_reason:
             usb_modem : PyusbDevInterface = diag_input.usb_modem
             if usb_modem.chardev_if_mounted:
-                diag_input = UsbModemPyserialConnector(usb_modem.chardev_if_mounted)
+                diag_input = UsbModemPyserialConnector(usb_modem.chardev_if_mounted, **pyserial_options)
             else:
-                diag_input = UsbModemPyusbConnector(usb_modem)
+                diag_input = UsbModemPyusbConnector(usb_modem, **pyusb_options)
     elif args.tcp:
         diag_input = TcpConnector(args.tcp)
     elif args.usb_modem:
@@ -122,7 +202,7 @@ def main():
                     "--help for further details.")
             exit()
         elif usb_arg.arg_type == UsbModemArgType.pyserial_dev:
-            diag_input = UsbModemPyserialConnector(usb_arg.pyserial_device)
+            diag_input = UsbModemPyserialConnector(usb_arg.pyserial_device, **pyserial_options)
         else:
             dev_intf = PyusbDevInterface.from_arg(usb_arg)
             if dev_intf.not_found_reason:
@@ -131,15 +211,32 @@ def main():
                 exit()
                 # TODO: Print a more user-friendly message here?
             elif dev_intf.chardev_if_mounted:
-                diag_input = UsbModemPyserialConnector(dev_intf.chardev_if_mounted)
+                diag_input = UsbModemPyserialConnector(dev_intf.chardev_if_mounted, **pyserial_options)
             else:
-                diag_input = UsbModemPyusbConnector(dev_intf)
+                diag_input = UsbModemPyusbConnector(dev_intf, **pyusb_options)
         
     elif args.json_geo_read:
         diag_input = JsonGeoReader(args.json_geo_read)
     else:
         raise NotImplementedError
 
+    if args.dispatch_queue:
+        diag_input.enable_dispatch_pipeline(args.dispatch_queue, args.dispatch_policy,
+            {int(log_code, 16) for log_code in args.droppable_logs.split(',')} if args.droppable_logs else None)
+
+    diag_input.set_diag_request_window(max(args.diag_window, 1))
+
+    # When tracing is narrowed to some log codes or opcodes, packets of the
+    # other kind are not traced at all
+
+    if args.trace_logs or args.trace_opcodes:
+        diag_input.enable_diag_tracing(
+            {int(log_code, 16) for log_code in args.trace_logs.split(',')} if args.trace_logs else set(),
+            {int(opcode, 16) for opcode in args.trace_opcodes.split(',')} if args.trace_opcodes else set(),
+            args.trace_file)
+    else:
+        diag_input.enable_diag_tracing(trace_file = args.trace_file)
+
     """
         The classes implementing the modules are instancied below.
     """
@@ -150,10 +247,11 @@ def main():
             diag_input.add_module(MemoryDumper(diag_input, expanduser(args.memory_dump), int(args.start, 16), int(args.stop, 16)))
         if args.pcap_dump:
             from .modules.pcap_dump import PcapDumper
-            diag_input.add_module(PcapDumper(diag_input, args.pcap_dump, args.reassemble_sibs, args.decrypt_nas, args.include_ip_traffic))
+            diag_input.add_module(PcapDumper(diag_input, args.pcap_dump, args.reassemble_sibs, args.decrypt_nas, args.include_ip_traffic,
+                args.flush_interval, args.fsync_interval))
         if args.wireshark_live:
             from .modules.pcap_dump import WiresharkLive
-            diag_input.add_module(WiresharkLive(diag_input, args.reassemble_sibs, args.decrypt_nas, args.include_ip_traffic))
+            diag_input.add_module(WiresharkLive(diag_input, args.reassemble_sibs, args.decrypt_nas, args.include_ip_traffic, args.flush_interval))
         if args.json_geo_dump:
             diag_input.add_module(JsonGeoDumper(diag_input, args.json_geo_dump))
         if args.decoded_sibs_dump:
@@ -162,10 +260,13 @@ def main():
         if args.info:
             diag_input.add_module(InfoRetriever(diag_input))
         if args.dlf_dump:
-            diag_input.add_module(DlfDumper(diag_input, args.dlf_dump))
-
-    # if args.efs_dump:
-    #     raise NotImplementedError
+            diag_input.add_module(DlfDumper(diag_input, args.dlf_dump, args.flush_interval, args.fsync_interval))
+        if args.efs_dump:
+            from .modules.efs_dump import EfsDumper
+            diag_input.add_module(EfsDumper(diag_input, expanduser(args.efs_dump)))
+        if args.efs_tar:
+            from .modules.efs_tar import EfsTarExporter
+            diag_input.add_module(EfsTarExporter(diag_input, args.efs_tar if args.efs_tar == '-' else expanduser(args.efs_tar), args.efs_path))
 
     parse_modules_args(args)
 
@@ -184,7 +285,7 @@ def main():
             exit()
             
         from .modules.efs_shell import EfsShell
-        diag_input.add_module(EfsShell(diag_input))
+        diag_input.add_module(EfsShell(diag_input, args.efs_cache_ttl))
             
 
 
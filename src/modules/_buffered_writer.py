@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from threading import Condition, Thread
+from os import fstat, fsync
+from stat import S_ISREG
+from typing import Optional
+from weakref import WeakSet
+from time import monotonic, sleep
+import atexit
+
+"""
+    This file implements the writer layer behind the modules writing records
+    to a file (PCAP and DLF dumps), so that the records of the captured frames
+    are batched in memory rather than written to the file one by one (which is
+    a system call for each frame when the file is not buffered, e.g. the pipe
+    to a Wireshark process).
+    
+    Pending records are written at once when they exceed a size, when the
+    oldest of them exceeds an age (checked from a background thread, so that
+    records don't stay pending when no more frames are received), and when
+    the file is closed or the program terminates.
+"""
+
+DEFAULT_FLUSH_SIZE = 1024 * 1024 # In bytes
+
+DEFAULT_FLUSH_INTERVAL = 1 # In seconds, for regular files
+
+LOW_LATENCY_FLUSH_INTERVAL = 0.02 # In seconds, for pipes and terminals (e.g. --wireshark-live)
+
+WRITE_RETRY_DELAY = 0.005 # In seconds, when a non-blocking file can't be written to
+
+_open_writers = WeakSet() # Writers whose pending records are written at exit
+
+"""
+    :param file: A file object
+    
+    :returns Whether the file object is backed by a regular file on the disk
+        (rather than a pipe, a terminal or an in-memory file)
+"""
+
+def is_regular_file(file) -> bool:
+    
+    try:
+        
+        return S_ISREG(fstat(file.fileno()).st_mode)
+    
+    except (OSError, ValueError): # Including io.UnsupportedOperation
+        
+        return False
+
+class BufferedRecordWriter:
+    
+    """
+        :param file: A file object opened in binary mode, which is closed
+            along with the writer
+        :param flush_interval: Maximal time during which records may stay
+            pending, in seconds, 0 meaning that records are written at once,
+            by default LOW_LATENCY_FLUSH_INTERVAL for pipes and terminals, and
+            DEFAULT_FLUSH_INTERVAL for other files
+        :param flush_size: Size from which pending records are written at once
+        :param fsync_interval: When set, minimal time between two calls to
+            fsync() after records were written to a regular file, for not
+            losing the records already written if the system crashes
+    """
+    
+    def __init__(self, file, flush_interval : Optional[float] = None,
+        flush_size : int = DEFAULT_FLUSH_SIZE, fsync_interval : Optional[float] = None):
+        
+        self.file = file
+        
+        self.appending_to_file = getattr(file, 'appending_to_file', False)
+        
+        self.can_fsync = is_regular_file(file)
+        
+        if flush_interval is None:
+            
+            flush_interval = DEFAULT_FLUSH_INTERVAL if self.can_fsync else LOW_LATENCY_FLUSH_INTERVAL
+        
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.fsync_interval = fsync_interval
+        
+        self.buffer = bytearray() # Pending records
+        
+        self.pending_since : Optional[float] = None # Time of the oldest pending record
+        
+        self.last_fsync_time = monotonic()
+        
+        self.flush_error : Optional[Exception] = None # Raised from the next call to write()
+        
+        self.closed = False
+        
+        self.condition = Condition()
+        
+        if self.flush_interval > 0:
+            
+            Thread(target = self._flush_thread, daemon = True).start()
+        
+        _open_writers.add(self)
+    
+    """
+        Append records (a bytes-like object) to the pending ones.
+        
+        May raise the error (e.g. BrokenPipeError) which occured when writing
+        previously pending records from the background thread.
+    """
+    
+    def write(self, data) -> int:
+        
+        with self.condition:
+            
+            if self.closed:
+                
+                raise ValueError('Write to a closed writer')
+            
+            if self.flush_error:
+                
+                flush_error, self.flush_error = self.flush_error, None
+                
+                raise flush_error
+            
+            if not self.buffer:
+                
+                self.pending_since = monotonic()
+                
+                self.condition.notify() # Wake up the background thread
+            
+            self.buffer += data
+            
+            if len(self.buffer) >= self.flush_size or not self.flush_interval:
+                
+                self._flush()
+        
+        return len(data)
+    
+    """
+        Write the pending records to the file.
+    """
+    
+    def flush(self):
+        
+        with self.condition:
+            
+            if not self.closed:
+                
+                self._flush()
+    
+    """
+        Write the pending records, then close the file (may be called more
+        than once).
+    """
+    
+    def close(self):
+        
+        with self.condition:
+            
+            if self.closed:
+                
+                return
+            
+            self.closed = True
+            
+            self.condition.notify() # Stop the background thread
+            
+            _open_writers.discard(self)
+            
+            try:
+                
+                self._flush(force_fsync = True)
+            
+            finally:
+                
+                self.file.close()
+    
+    """
+        Must be called with self.condition held.
+    """
+    
+    def _flush(self, force_fsync : bool = False):
+        
+        if self.buffer:
+            
+            try:
+                
+                # Unbuffered files (pipes) may write less than requested when
+                # interrupted by a signal, or nothing (None) when non-blocking
+                
+                with memoryview(self.buffer) as buffer_view:
+                    
+                    num_bytes_written = 0
+                    
+                    while num_bytes_written < len(buffer_view):
+                        
+                        try:
+                            
+                            # Released explicitly, as the buffer can't be
+                            # cleared while a view over it is alive
+                            
+                            with buffer_view[num_bytes_written:] as remaining_view:
+                                
+                                num_bytes = self.file.write(remaining_view)
+                        
+                        except BlockingIOError as blocking_error:
+                            
+                            num_bytes = blocking_error.characters_written
+                        
+                        if not num_bytes:
+                            
+                            sleep(WRITE_RETRY_DELAY)
+                            
+                            continue
+                        
+                        num_bytes_written += num_bytes
+                
+                self.file.flush()
+            
+            finally:
+                
+                # Records which could not be written (e.g. when Wireshark
+                # was closed) are dropped rather than retried
+                
+                self.buffer.clear()
+                
+                self.pending_since = None
+            
+            if self.fsync_interval is not None and self.can_fsync and (force_fsync or
+                monotonic() - self.last_fsync_time >= self.fsync_interval):
+                
+                fsync(self.file.fileno())
+                
+                self.last_fsync_time = monotonic()
+    
+    def _flush_thread(self):
+        
+        with self.condition:
+            
+            while not self.closed:
+                
+                if self.pending_since is None:
+                    
+                    self.condition.wait()
+                
+                else:
+                    
+                    remaining_time = self.pending_since + self.flush_interval - monotonic()
+                    
+                    if remaining_time > 0:
+                        
+                        self.condition.wait(remaining_time)
+                    
+                    else:
+                        
+                        try:
+                            
+                            self._flush()
+                        
+                        except Exception as error:
+                            
+                            self.flush_error = error
+
+"""
+    Write the records still pending when the program terminates, including
+    those of the modules which were not removed (e.g. when the input reached
+    its end).
+"""
+
+@atexit.register
+def _flush_open_writers():
+    
+    for writer in list(_open_writers):
+        
+        try:
+            
+            writer.flush()
+        
+        except Exception:
+            
+            pass
@@ -1,10 +1,6 @@
 #!/usr/bin/python3
 #-*- encoding: Utf-8 -*-
-from struct import pack, unpack_from, calcsize
-from logging import warning, info
 from ..protocol.log_types import *
-from ..protocol.messages import *
-from time import sleep
 
 """
     This module exposes a class from which a module may inherit in order to
@@ -29,11 +25,6 @@ from time import sleep
     is what this module does.
 """
 
-LOG_CONFIG_RETRIEVE_ID_RANGES_OP = 1
-LOG_CONFIG_SET_MASK_OP = 3
-
-LOG_CONFIG_SUCCESS_S = 0
-
 """
     The following list enumerate log types used by the --pcap-dump and
     --json-geo-dump modules, and is used to restrict the quantity of logs
@@ -74,114 +65,21 @@ TYPES_FOR_RAW_PACKET_LOGGING = [
 
 class EnableLogMixin:
     
-    def on_init(self):
-        
-        self.log_type_to_mask_bitsize = {}
-        
-        # Send the message for receiving the highest valid log code for
-        # each existing log type (see defintions above).
-        
-        opcode, payload = self.diag_input.send_recv(DIAG_LOG_CONFIG_F, pack('<3xI', LOG_CONFIG_RETRIEVE_ID_RANGES_OP))
-        
-        header_spec = '<3xII'
-        operation, status = unpack_from(header_spec, payload)
-        
-        assert operation == LOG_CONFIG_RETRIEVE_ID_RANGES_OP
-        
-        if status != LOG_CONFIG_SUCCESS_S:
-            
-            warning('Warning: log operation %d resulted in status %d' % (operation, status))
-        
-        log_masks = unpack_from('<16I', payload, calcsize(header_spec))
-        
-        # Iterate on information contained in the packet for each log type
-        
-        log_types = {
-            0x1: '1X',
-            0x4: 'WCDMA',
-            0x5: 'GSM',
-            0x6: 'LBS',
-            0x7: 'UMTS',
-            0x8: 'TDMA',
-            0xA: 'DTV',
-            0xB: 'APPS/LTE/WIMAX',
-            0xC: 'DSP',
-            0xD: 'TDSCDMA',
-            0xF: 'TOOLS'
-        }
-        
-        information_string = 'Enabled logging for: '
-        
-        for log_type, log_mask_bitsize in enumerate(log_masks):
-            
-            # Register logging for each supported log type
-            
-            if log_mask_bitsize:
-                
-                self.log_type_to_mask_bitsize[log_type] = log_mask_bitsize
-                
-                log_mask = self._fill_log_mask(log_type, log_mask_bitsize)
-                
-                opcode, payload = self.diag_input.send_recv(DIAG_LOG_CONFIG_F, pack('<3xIII',
-                    LOG_CONFIG_SET_MASK_OP,
-                    log_type,
-                    log_mask_bitsize
-                ) + log_mask)
-
-                operation, status = unpack_from(header_spec, payload)
-                
-                assert operation == LOG_CONFIG_SET_MASK_OP
-                
-                if status != LOG_CONFIG_SUCCESS_S:
-                    
-                    warning('Warning: log operation %d resulted in status %d' % (operation, status))
-                
-                information_string += '%s (%d), ' % (log_types.get(log_type, 'UNKNOWN'), log_type)
-        
-        info(information_string.strip(', '))
+    """
+        Register interest for the logs of the module through the log mask
+        manager of the input (see "src/inputs/_log_mask_manager.py"), which
+        merges it with the interest of the other running modules.
+    """
     
-    def _fill_log_mask(self, log_type, num_bits, bit_value = 1):
-        
-        log_mask = b''
-        
-        current_byte = 0
-        num_bits_written = 0
+    def on_init(self):
         
-        for i in range(num_bits):
-            
-            enable_this_log_type = True
-            
-            # limit_registered_logs: When set by a module inheriting this
-            # class, this attribute may instruct to limit the logs to register
-            # interest for a restricted set of log codes, in order to limit the
-            # bulk of data sent from the device to the Diag client.
-            
-            if (hasattr(self, 'limit_registered_logs') and
-                ((log_type << 12) | i) not in self.limit_registered_logs):
-                
-                enable_this_log_type = False
-            
-            current_byte |= (bit_value & enable_this_log_type) << num_bits_written
-            num_bits_written += 1
-            
-            if num_bits_written == 8 or i == num_bits - 1:
-                
-                log_mask += bytes([current_byte])
-                
-                current_byte = 0
-                num_bits_written = 0
+        # limit_registered_logs: When set by a module inheriting this
+        # class, this attribute may instruct to limit the logs to register
+        # interest for a restricted set of log codes, in order to limit the
+        # bulk of data sent from the device to the Diag client.
         
-        return log_mask
+        self.diag_input.log_mask_manager.subscribe(self, getattr(self, 'limit_registered_logs', None))
     
     def on_deinit(self):
         
-        for log_type, log_mask_bitsize in getattr(self, 'log_type_to_mask_bitsize', {}).items():
-            
-            log_mask = self._fill_log_mask(log_type, log_mask_bitsize, bit_value = 0)
-            
-            self.diag_input.send_recv(DIAG_LOG_CONFIG_F, pack('<3xIII',
-                LOG_CONFIG_SET_MASK_OP,
-                log_type,
-                log_mask_bitsize
-            ) + log_mask)
-
+        self.diag_input.log_mask_manager.unsubscribe(self)
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from typing import List, Tuple, Optional
+from os import replace
+from bisect import bisect_right
+import json
+
+"""
+    This file implements a sparse map of the memory of the device, recording
+    which address ranges are known to be readable or unreadable through the
+    DIAG_PEEK* commands. Addresses absent from the map are unknown.
+    
+    It is saved along with the memory dump (MEMORY_MAP_FILE_NAME), in the
+    following format, addresses being hexadecimal strings:
+    
+    {"build_id": "...", "readable": [["00000000", "00200000"], ...], "unreadable": [...]}
+    
+    It is only reused when the firmware build ID of the device is the same,
+    so that dumping again the same firmware skips probing the memory.
+"""
+
+MEMORY_MAP_FILE_NAME = '.memory_map.json'
+
+class MemoryMap:
+    
+    """
+        :param build_id: Firmware build ID of the device the map describes,
+            if known
+    """
+    
+    def __init__(self, build_id : Optional[str] = None):
+        
+        self.build_id = build_id
+        
+        # Sorted, non-overlapping (start, end, is_readable) tuples, adjacent
+        # ranges with the same status being merged. The list is replaced
+        # rather than modified, so that it can be saved from another thread.
+        
+        self.ranges : List[Tuple[int, int, bool]] = []
+    
+    """
+        Record the status of the [start, end) address range, overriding what
+        was known about it.
+    """
+    
+    def mark(self, start : int, end : int, is_readable : bool):
+        
+        self.ranges = self._merge(self._cut(start, end) + [(start, end, is_readable)])
+    
+    """
+        Forget what was known about the [start, end) address range.
+    """
+    
+    def forget(self, start : int, end : int):
+        
+        self.ranges = self._cut(start, end)
+    
+    def _cut(self, start : int, end : int) -> List[Tuple[int, int, bool]]:
+        
+        ranges = []
+        
+        for range_start, range_end, is_readable in self.ranges:
+            
+            if range_end <= start or range_start >= end:
+                ranges.append((range_start, range_end, is_readable))
+                continue
+            
+            if range_start < start:
+                ranges.append((range_start, start, is_readable))
+            
+            if range_end > end:
+                ranges.append((end, range_end, is_readable))
+        
+        return ranges
+    
+    def _merge(self, ranges : List[Tuple[int, int, bool]]) -> List[Tuple[int, int, bool]]:
+        
+        merged_ranges = []
+        
+        for range_start, range_end, is_readable in sorted(ranges):
+            
+            if range_start >= range_end:
+                continue
+            
+            if merged_ranges and merged_ranges[-1][1] == range_start and merged_ranges[-1][2] == is_readable:
+                merged_ranges[-1] = (merged_ranges[-1][0], range_end, is_readable)
+            else:
+                merged_ranges.append((range_start, range_end, is_readable))
+        
+        return merged_ranges
+    
+    """
+        :returns Whether an address is readable, or None if unknown
+    """
+    
+    def get_status(self, address : int) -> Optional[bool]:
+        
+        ranges = self.ranges
+        
+        index = bisect_right(ranges, (address, float('inf'), True)) - 1
+        
+        if index >= 0 and ranges[index][0] <= address < ranges[index][1]:
+            return ranges[index][2]
+        
+        return None
+    
+    """
+        :returns The (start, end) address ranges of the given status within
+            the [start, end) range, clipped to it
+    """
+    
+    def get_ranges(self, start : int, end : int, is_readable : bool) -> List[Tuple[int, int]]:
+        
+        return [(max(range_start, start), min(range_end, end))
+            for range_start, range_end, range_is_readable in self.ranges
+            if range_is_readable == is_readable and range_end > start and range_start < end]
+    
+    """
+        :returns The (start, end) address ranges of unknown status within the
+            [start, end) range
+    """
+    
+    def get_unknown_ranges(self, start : int, end : int) -> List[Tuple[int, int]]:
+        
+        unknown_ranges = []
+        
+        for range_start, range_end, is_readable in self.ranges:
+            
+            if range_end <= start or range_start >= end:
+                continue
+            
+            if range_start > start:
+                unknown_ranges.append((start, range_start))
+            
+            start = max(start, range_end)
+        
+        if start < end:
+            unknown_ranges.append((start, end))
+        
+        return unknown_ranges
+    
+    """
+        Write the map to the disk, through a temporary file so that an
+        interrupted save does not leave a truncated map.
+    """
+    
+    def save(self, path : str):
+        
+        ranges = self.ranges
+        
+        with open(path + '.tmp', 'w') as map_file:
+            
+            json.dump({
+                'build_id': self.build_id,
+                'readable': [['%08x' % range_start, '%08x' % range_end]
+                    for range_start, range_end, is_readable in ranges if is_readable],
+                'unreadable': [['%08x' % range_start, '%08x' % range_end]
+                    for range_start, range_end, is_readable in ranges if not is_readable]
+            }, map_file, indent = 4)
+        
+        replace(path + '.tmp', path)
+    
+    """
+        :returns The map saved at the given path, or an empty map if it does
+            not exist, can't be read or was made for another firmware
+    """
+    
+    @classmethod
+    def load(cls, path : str, build_id : Optional[str] = None) -> 'MemoryMap':
+        
+        memory_map = cls(build_id)
+        
+        try:
+            
+            with open(path) as map_file:
+                
+                saved_map = json.load(map_file)
+            
+            if saved_map.get('build_id') == build_id:
+                
+                memory_map.ranges = memory_map._merge(
+                    [(int(range_start, 16), int(range_end, 16), True) for range_start, range_end in saved_map['readable']] +
+                    [(int(range_start, 16), int(range_end, 16), False) for range_start, range_end in saved_map['unreadable']])
+        
+        except (OSError, ValueError, KeyError, TypeError):
+            
+            pass
+        
+        return memory_map
@@ -4,8 +4,8 @@ from pycrate_core.utils import pack_val, TYPE_UINT
 from collections import defaultdict, namedtuple
 from pycrate_asn1dir import RRC3G
 from ..protocol.log_types import *
+from ..protocol.headers import WCDMA_SIGNALLING_HEADER
 from traceback import format_exc
-from struct import pack, unpack
 from logging import warning
 from time import time
 
@@ -179,6 +179,8 @@ def print_sib_decoding_error(decoding_error):
 
 class DecodedSibsDumper(EnableLogMixin):
     
+    accepts_memoryviews = True # See BaseInput.dispatch_received_diag_packet
+    
     def __init__(self, diag_input,
         on_decoded_sib = print_decoded_sib,
         on_sib_decoding_error = print_sib_decoding_error
@@ -194,9 +196,9 @@ class DecodedSibsDumper(EnableLogMixin):
         
         if log_type == WCDMA_SIGNALLING_MESSAGE: # 0x412f
             
-            (channel_type, radio_bearer, length), signalling_message = unpack('<BBH', log_payload[:4]), log_payload[4:]
+            (channel_type, radio_bearer, length), signalling_message = WCDMA_SIGNALLING_HEADER.unpack_from(log_payload), log_payload[WCDMA_SIGNALLING_HEADER.size:]
             
-            packet = signalling_message[:length]
+            packet = bytes(signalling_message[:length]) # Copied for pycrate
             
             if channel_type == 254:
                 return # Master Information Block, duplicated from the RRCLOG_SIG_DL_BCCH_BCH that was just logged
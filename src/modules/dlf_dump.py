@@ -1,9 +1,10 @@
 #!/usr/bin/python3
 #-*- encoding: Utf-8 -*-
 from ..modules._enable_log_mixin import EnableLogMixin
+from ..modules._buffered_writer import BufferedRecordWriter
 from ..protocol.gsmtap import build_gsmtap_ip
 from ..protocol.log_types import *
-from struct import pack, unpack
+from ..protocol.headers import LOG_HEADER
 from logging import warn
 
 """
@@ -13,24 +14,37 @@ from logging import warn
 
 class DlfDumper(EnableLogMixin):
     
-    def __init__(self, diag_input, dlf_file):
+    accepts_memoryviews = True # See BaseInput.dispatch_received_diag_packet
+    
+    """
+        :param flush_interval: See BufferedRecordWriter
+        :param fsync_interval: See BufferedRecordWriter
+    """
+    
+    def __init__(self, diag_input, dlf_file, flush_interval = None, fsync_interval = None):
         
         super().__init__()
         
-        self.dlf_file = dlf_file
+        # Logs are batched in memory rather than written one by one, see
+        # "_buffered_writer.py"
+        
+        self.dlf_file = BufferedRecordWriter(dlf_file, flush_interval, fsync_interval = fsync_interval)
         
         self.diag_input = diag_input
     
     def on_log(self, log_type, log_payload, log_header, timestamp = 0):
         
         #print('X', hex(log_type), log_payload, log_header, timestamp)
-        if unpack('<H', log_header[:2])[0] != len(log_header + log_payload):
+        log_length = LOG_HEADER.unpack_from(log_header)[0]
+        
+        if log_length != len(log_header) + len(log_payload):
             warn('Dismissing log type 0x%04x, indicating size %d instead of %d' % (log_type,
-                unpack('<H', log_header[:2])[0],
-                len(log_header + log_payload)
+                log_length,
+                len(log_header) + len(log_payload)
             ))
         
-        self.dlf_file.write(log_header + log_payload)
+        self.dlf_file.write(log_header)
+        self.dlf_file.write(log_payload)
     
     def __del__(self):
         
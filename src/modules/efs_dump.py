@@ -0,0 +1,312 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from os.path import join, exists, getsize
+from os import makedirs, replace, remove, utime
+from logging import warning
+from threading import Thread, Lock
+from collections import deque
+from typing import Dict
+from queue import Queue
+from time import time
+import json
+
+from .efs_shell_commands._efs_transfer import send_efs_handshake, list_efs_directory, read_efs_link, \
+    open_efs_file, close_efs_file, get_efs_file_size, read_efs_file, format_throughput, \
+    EfsWindows, EfsTransferError, DEFAULT_EFS_CHUNK_SIZE, S_IFMT, S_IFDIR, S_IFREG, S_IFLNK, S_IFITM
+
+"""
+    This module dumps the whole EFS of the device into a local directory,
+    mirroring its tree.
+    
+    The tree is walked from the root by a thread listing directories, while
+    up to EFS_DUMP_WORKERS threads download the files found, so that the
+    requests of both are in flight at the same time. The windows negotiated
+    with the device bound the requests in flight for the whole device, and
+    are hence split between the workers.
+    
+    A manifest (MANIFEST_FILE_NAME, at the root of the output directory)
+    records the path, size, modification time and mode of each entry, along
+    with the target of symbolic links:
+    
+    {"/nv/item_files/...": {"size": 4, "mtime": 1262304000, "mode": 33206}, ...}
+    
+    When dumping again to the same directory, files whose size, modification
+    time and mode are unchanged since the previous manifest are not
+    downloaded again, and local files whose EFS counterpart was removed are
+    deleted.
+"""
+
+MANIFEST_FILE_NAME = '.efs_manifest.json'
+
+EFS_DUMP_WORKERS = 4
+
+"""
+    :returns A (number of workers, windows of each worker) tuple, so that the
+        reads of all the workers stay within the negotiated windows
+"""
+
+def split_efs_windows(efs_windows : EfsWindows, max_workers : int = EFS_DUMP_WORKERS):
+    
+    num_workers = max(1, min(max_workers, efs_windows.targ_pkt_window,
+        efs_windows.targ_byte_window // DEFAULT_EFS_CHUNK_SIZE))
+    
+    return num_workers, efs_windows._replace(
+        targ_pkt_window = efs_windows.targ_pkt_window // num_workers,
+        targ_byte_window = efs_windows.targ_byte_window // num_workers)
+
+class EfsDumper:
+    
+    def __init__(self, diag_input, output_dir):
+        
+        self.diag_input = diag_input
+        
+        self.output_dir = output_dir
+        
+        makedirs(self.output_dir, exist_ok = True)
+        
+        self.manifest_path = join(self.output_dir, MANIFEST_FILE_NAME)
+        
+        self.previous_manifest : Dict[str, dict] = {}
+        
+        try:
+            
+            with open(self.manifest_path) as manifest_file:
+                
+                self.previous_manifest = json.load(manifest_file)
+        
+        except (OSError, ValueError):
+            
+            pass
+        
+        self.manifest : Dict[str, dict] = {}
+        
+        self.manifest_lock = Lock()
+        
+        self.num_files_downloaded = 0
+        self.num_files_unchanged = 0
+        self.num_files_failed = 0
+        self.num_bytes_downloaded = 0
+    
+    def on_init(self):
+        
+        print()
+        
+        num_workers, self.efs_windows = split_efs_windows(send_efs_handshake(self.diag_input))
+        
+        start_time = time()
+        
+        file_queue = Queue(num_workers * 4)
+        
+        workers = [Thread(target = self.download_files, args = (file_queue,), daemon = True)
+            for worker_index in range(num_workers)]
+        
+        for worker in workers:
+            worker.start()
+        
+        try:
+            
+            unlisted_directories = self.walk_tree(file_queue)
+        
+        finally:
+            
+            for worker in workers:
+                file_queue.put(None)
+            
+            for worker in workers:
+                worker.join()
+        
+        self.remove_deleted_files(unlisted_directories)
+        
+        self.save_manifest()
+        
+        print('Dumped the EFS to %s: %d files downloaded (%s), %d unchanged, %d failed' % (
+            self.output_dir, self.num_files_downloaded,
+            format_throughput(self.num_bytes_downloaded, time() - start_time),
+            self.num_files_unchanged, self.num_files_failed))
+    
+    """
+        List the EFS tree breadth-first, queueing the files to download.
+        
+        :returns The set of paths of the directories which could not be
+            listed
+    """
+    
+    def walk_tree(self, file_queue : Queue) -> set:
+        
+        unlisted_directories = set()
+        
+        directories = deque([b''])
+        
+        while directories:
+            
+            directory = directories.popleft()
+            
+            try:
+                
+                entries = list_efs_directory(self.diag_input, directory or b'/')
+            
+            except EfsTransferError as transfer_error:
+                
+                warning('%s: %s' % (directory.decode('latin1') or '/', transfer_error))
+                
+                unlisted_directories.add(directory.decode('latin1'))
+                
+                continue
+            
+            for entry in entries:
+                
+                if entry.name in (b'.', b'..'):
+                    continue
+                
+                encoded_path = directory + b'/' + entry.name
+                path = encoded_path.decode('latin1')
+                
+                manifest_entry = {'size': entry.size, 'mtime': entry.mtime, 'mode': entry.mode}
+                
+                file_type = entry.mode & S_IFMT
+                
+                if file_type == S_IFDIR:
+                    
+                    makedirs(self.get_local_path(path), exist_ok = True)
+                    
+                    directories.append(encoded_path)
+                
+                elif file_type == S_IFLNK:
+                    
+                    try:
+                        manifest_entry['target'] = read_efs_link(self.diag_input, encoded_path).decode('latin1')
+                    
+                    except EfsTransferError as transfer_error:
+                        warning('%s: %s' % (path, transfer_error))
+                
+                elif file_type in (S_IFREG, S_IFITM):
+                    
+                    previous_entry = self.previous_manifest.get(path)
+                    
+                    local_path = self.get_local_path(path)
+                    
+                    if (previous_entry == manifest_entry and exists(local_path) and
+                        getsize(local_path) == entry.size):
+                        
+                        self.num_files_unchanged += 1
+                    
+                    else:
+                        
+                        file_queue.put((encoded_path, manifest_entry))
+                        
+                        continue # Added to the manifest once downloaded
+                
+                with self.manifest_lock:
+                    
+                    self.manifest[path] = manifest_entry
+        
+        return unlisted_directories
+    
+    def download_files(self, file_queue : Queue):
+        
+        while True:
+            
+            item = file_queue.get()
+            
+            if item is None:
+                break
+            
+            encoded_path, manifest_entry = item
+            path = encoded_path.decode('latin1')
+            
+            local_path = self.get_local_path(path)
+            
+            try:
+                
+                num_bytes = self.download_file(encoded_path, local_path)
+            
+            except (EfsTransferError, OSError) as transfer_error:
+                
+                warning('%s: %s' % (path, transfer_error))
+                
+                if exists(local_path + '.part'):
+                    remove(local_path + '.part')
+                
+                with self.manifest_lock:
+                    
+                    self.num_files_failed += 1
+                    
+                    # The previous local copy, if any, was left untouched
+                    
+                    if path in self.previous_manifest and exists(local_path):
+                        
+                        self.manifest[path] = self.previous_manifest[path]
+                
+                continue
+            
+            utime(local_path, (manifest_entry['mtime'], manifest_entry['mtime']))
+            
+            with self.manifest_lock:
+                
+                self.manifest[path] = dict(manifest_entry, size = num_bytes)
+                
+                self.num_files_downloaded += 1
+                self.num_bytes_downloaded += num_bytes
+    
+    """
+        :returns The number of bytes downloaded
+    """
+    
+    def download_file(self, encoded_path : bytes, local_path : str) -> int:
+        
+        file_fd = open_efs_file(self.diag_input, encoded_path)
+        
+        try:
+            
+            file_size = get_efs_file_size(self.diag_input, file_fd)
+            
+            with open(local_path + '.part', 'wb') as output_file:
+                
+                num_bytes = read_efs_file(self.diag_input, file_fd, output_file, file_size, self.efs_windows)
+            
+            replace(local_path + '.part', local_path)
+        
+        finally:
+            
+            close_efs_file(self.diag_input, file_fd)
+        
+        return num_bytes
+    
+    """
+        Delete the local files recorded in the previous manifest which are
+        not present in the EFS anymore.
+        
+        :param unlisted_directories: Directories which could not be listed,
+            the entries of which are carried over from the previous manifest
+    """
+    
+    def remove_deleted_files(self, unlisted_directories : set):
+        
+        for path, previous_entry in self.previous_manifest.items():
+            
+            if path in self.manifest:
+                continue
+            
+            if any(path.startswith(directory + '/') for directory in unlisted_directories):
+                
+                self.manifest[path] = previous_entry
+            
+            elif previous_entry['mode'] & S_IFMT in (S_IFREG, S_IFITM):
+                
+                try:
+                    remove(self.get_local_path(path))
+                
+                except OSError:
+                    pass
+    
+    def save_manifest(self):
+        
+        with open(self.manifest_path + '.tmp', 'w') as manifest_file:
+            
+            json.dump(self.manifest, manifest_file, indent = 4, sort_keys = True)
+        
+        replace(self.manifest_path + '.tmp', self.manifest_path)
+    
+    def get_local_path(self, path : str) -> str:
+        
+        return join(self.output_dir, path.lstrip('/'))
@@ -15,6 +15,8 @@ from ..protocol.messages import *
 from ..protocol.efs2 import *
 
 from .efs_shell_commands._base_efs_shell_command import BaseEfsShellCommand
+from .efs_shell_commands._efs_transfer import EfsWindows, DEFAULT_EFS_WINDOWS, send_efs_handshake, EfsTransferError
+from .efs_shell_commands._efs_cache import EfsMetadataCache, DEFAULT_EFS_CACHE_TTL
 from .efs_shell_commands.device_info import DeviceInfoCommand
 from .efs_shell_commands.md5sum import Md5sumCommand
 from .efs_shell_commands.chmod import ChmodCommand
@@ -22,19 +24,20 @@ from .efs_shell_commands.mkdir import MkdirCommand
 from .efs_shell_commands.stat import StatCommand
 from .efs_shell_commands.get import GetCommand
 from .efs_shell_commands.put import PutCommand
+from .efs_shell_commands.tar import TarCommand
 from .efs_shell_commands.cat import CatCommand
 from .efs_shell_commands.mv import MvCommand
 from .efs_shell_commands.ln import LnCommand
 from .efs_shell_commands.rm import RmCommand
 from .efs_shell_commands.ls import LsCommand
 
-ALL_COMMAND_CLASSES = [CatCommand, LsCommand, GetCommand, PutCommand, RmCommand, ChmodCommand, MkdirCommand, MvCommand, LnCommand,
+ALL_COMMAND_CLASSES = [CatCommand, LsCommand, GetCommand, PutCommand, TarCommand, RmCommand, ChmodCommand, MkdirCommand, MvCommand, LnCommand,
     DeviceInfoCommand, StatCommand]
 # "Md5sumCommand" is currently not used, it returns an invalid packet on my device
 
 class EfsShell:
     
-    def __init__(self, diag_input : BaseInput):
+    def __init__(self, diag_input : BaseInput, cache_ttl : float = DEFAULT_EFS_CACHE_TTL):
         
         self.diag_input : BaseInput = diag_input
         
@@ -44,6 +47,16 @@ class EfsShell:
         
         self.sub_parser_command_name_to_command_object : Dict[str, BaseEfsShellCommand] = {}
         
+        # Windows negotiated with the device through EFS2_DIAG_HELLO, used
+        # by the commands transferring files
+        
+        self.efs_windows : EfsWindows = DEFAULT_EFS_WINDOWS
+        
+        # Directory listings and STAT responses of the session, reused by
+        # the commands and the completion of paths for "cache_ttl" seconds
+        
+        self.efs_cache : EfsMetadataCache = EfsMetadataCache(cache_ttl)
+        
         for command_class in ALL_COMMAND_CLASSES:
             
             command_object = command_class()
@@ -116,6 +129,9 @@ class EfsShell:
                             
                             self.send_efs_handshake()
                             
+                            command_object.efs_windows = self.efs_windows
+                            command_object.efs_cache = self.efs_cache
+                            
                             try:
                             
                                 command_object.execute_command(self.diag_input, parsed_args)
@@ -123,6 +139,10 @@ class EfsShell:
                             except SystemExit:
                                 
                                 pass
+                            
+                            finally:
+                                
+                                self.invalidate_modified_paths(command_object, parsed_args)
                     
                     else:
                         
@@ -130,35 +150,26 @@ class EfsShell:
     
     def send_efs_handshake(self):
         
-        opcode, payload = self.diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BH6I3II',
-            DIAG_SUBSYS_FS, # Command subsystem number
-            EFS2_DIAG_HELLO, # Command code
-            0x100000, # Put all the windows size to high values, let the device negociate these down
-            0x100000,
-            0x100000,
-            0x100000,
-            0x100000,
-            0x100000,
-            1, # We are version 1, we support min version 1 up to max version 1
-            1,
-            1,
-            0xffffffff # Set all the feature bits
-        ), accept_error = False)
-        
-        (cmd_subsystem_id, subcommand_code,
-            targ_pkt_window, targ_byte_window,
-            host_pkt_window, host_byte_window,
-            iter_pkt_window, iter_byte_window,
-            version, min_version, max_version,
-            feature_bits) = unpack('<BH6I3II', payload)
-        
-        if version != 1:
-            
-            error('EFS version unsupported')
-            exit()
+        self.efs_windows = send_efs_handshake(self.diag_input)
 
     """
-        Enable using the direction for the command line.
+        Forget the cached metadata of the paths which a command may have
+        modified on the device, even partially when it failed.
+    """
+    
+    def invalidate_modified_paths(self, command_object : BaseEfsShellCommand, parsed_args : Namespace):
+        
+        for argument_name in command_object.modified_path_arguments:
+            
+            path : Optional[str] = getattr(parsed_args, argument_name, None)
+            
+            if path:
+                
+                self.efs_cache.invalidate(path.encode('latin1').decode('unicode_escape').encode('latin1'))
+    
+    """
+        Enable using the direction for the command line, and completing
+        command names and EFS paths with the Tab key.
     """
     
     def setup_readline(self):
@@ -170,6 +181,43 @@ class EfsShell:
         except ImportError:
             
             pass
+        
+        else:
+            
+            set_completer_delims(' \t\n')
+            
+            parse_and_bind('tab: complete')
+            
+            set_completer(self.complete)
+    
+    """
+        Readline completer: the first word of the line is completed with the
+        name of a command, and the following ones with the paths of the EFS,
+        which are served from the cache of directory listings.
+    """
+    
+    def complete(self, text : str, state : int) -> Optional[str]:
+        
+        from readline import get_line_buffer, get_begidx
+        
+        if state == 0:
+            
+            if not get_line_buffer()[:get_begidx()].strip():
+                
+                self.completions : List[str] = sorted(name + ' ' for name in self.sub_parsers._name_parser_map
+                    if name.startswith(text))
+            
+            else:
+                
+                try:
+                    
+                    self.completions = self.efs_cache.complete_path(self.diag_input, text or '/')
+                
+                except EfsTransferError:
+                    
+                    self.completions = []
+        
+        return self.completions[state] if state < len(self.completions) else None
     
     
     """
@@ -1,8 +1,21 @@
 
 from argparse import ArgumentParser, _SubParsersAction, Namespace
+from typing import List
+
+from ._efs_transfer import EfsWindows, DEFAULT_EFS_WINDOWS
+from ._efs_cache import EfsMetadataCache
 
 class BaseEfsShellCommand:
     
+    efs_windows : EfsWindows = DEFAULT_EFS_WINDOWS # Set by the shell after the EFS2_DIAG_HELLO handshake
+    
+    efs_cache : EfsMetadataCache = EfsMetadataCache(ttl = 0) # Set by the shell, disabled otherwise
+    
+    # Names of the arguments holding EFS paths modified by the command,
+    # which are invalidated in the cache once it has run
+    
+    modified_path_arguments : List[str] = []
+    
     def get_argument_parser(self, subparsers_object : _SubParsersAction) -> ArgumentParser:
         
         pass
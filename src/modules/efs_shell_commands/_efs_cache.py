@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+
+from posixpath import normpath, dirname, basename
+from typing import List, Dict, Tuple, Optional
+from struct import pack
+from time import time
+
+from ._efs_transfer import list_efs_directory, read_efs_link, EfsDirEntry, FS_DIAG_FTYPE_DIR, S_IFMT, S_IFDIR, S_IFLNK
+from ...protocol.subsystems import *
+from ...protocol.messages import *
+from ...protocol.efs2 import *
+from ...protocol.headers import EFS2_RESPONSE_HEADER, EFS2_STAT_RESPONSE
+
+"""
+    This file implements a cache of the metadata of the EFS (directory
+    listings, STAT responses and symbolic link targets), held by the EFS
+    shell for the duration of a session, so that browsing and completing
+    paths does not go to the device each time.
+    
+    Entries expire after a TTL, so that changes made on the device side are
+    eventually seen, and are invalidated when a command of the shell
+    modifies the corresponding path (see BaseEfsShellCommand.
+    modified_path_arguments).
+    
+    A TTL of 0 disables the cache.
+"""
+
+DEFAULT_EFS_CACHE_TTL = 30 # In seconds
+
+
+"""
+    :returns The absolute form of an EFS path, as bytes, without trailing
+        slash nor "." or ".." components
+"""
+
+def normalize_efs_path(encoded_path : bytes) -> bytes:
+    
+    return normpath(b'/' + encoded_path.strip(b'/'))
+
+class EfsMetadataCache:
+    
+    def __init__(self, ttl : float = DEFAULT_EFS_CACHE_TTL):
+        
+        self.ttl = ttl
+        
+        self.path_to_listing : Dict[bytes, Tuple[float, List[EfsDirEntry]]] = {}
+        self.path_to_stat : Dict[bytes, Tuple[float, Tuple[int, bytes]]] = {}
+        self.path_to_link_target : Dict[bytes, Tuple[float, bytes]] = {}
+    
+    def _get(self, cache : dict, path : bytes):
+        
+        cached = cache.get(path)
+        
+        if cached and time() - cached[0] < self.ttl:
+            
+            return cached[1]
+        
+        return None
+    
+    def _set(self, cache : dict, path : bytes, value):
+        
+        if self.ttl > 0:
+            
+            cache[path] = (time(), value)
+    
+    """
+        :returns The list of EfsDirEntry of a directory (see
+            list_efs_directory, which may raise EfsTransferError)
+    """
+    
+    def list_directory(self, diag_input, encoded_path : bytes) -> List[EfsDirEntry]:
+        
+        path = normalize_efs_path(encoded_path)
+        
+        entries = self._get(self.path_to_listing, path)
+        
+        if entries is None:
+            
+            entries = list_efs_directory(diag_input, encoded_path)
+            
+            self._set(self.path_to_listing, path, entries)
+        
+        return entries
+    
+    """
+        :returns The (opcode, payload) tuple of the EFS2_DIAG_STAT response
+            for a path. Only successful responses are cached.
+    """
+    
+    def stat(self, diag_input, encoded_path : bytes) -> Tuple[int, bytes]:
+        
+        path = normalize_efs_path(encoded_path)
+        
+        response = self._get(self.path_to_stat, path)
+        
+        if response is None:
+            
+            response = diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BH',
+                DIAG_SUBSYS_FS, # Command subsystem number
+                EFS2_DIAG_STAT,
+            ) + encoded_path + b'\x00', accept_error = True)
+            
+            opcode, payload = response
+            
+            if opcode == DIAG_SUBSYS_CMD_F and len(payload) >= EFS2_RESPONSE_HEADER.size and not EFS2_RESPONSE_HEADER.parse(payload).errno:
+                
+                self._set(self.path_to_stat, path, response)
+        
+        return response
+    
+    """
+        :returns The target of a symbolic link (see read_efs_link, which may
+            raise EfsTransferError)
+    """
+    
+    def read_link(self, diag_input, encoded_path : bytes) -> bytes:
+        
+        path = normalize_efs_path(encoded_path)
+        
+        target = self._get(self.path_to_link_target, path)
+        
+        if target is None:
+            
+            target = read_efs_link(diag_input, encoded_path)
+            
+            self._set(self.path_to_link_target, path, target)
+        
+        return target
+    
+    """
+        :returns An EfsDirEntry describing a path, or None if it does not
+            exist. It is taken from the cached listing of the parent
+            directory when available, or else from a STAT request.
+            Symbolic links are followed.
+    """
+    
+    def get_entry(self, diag_input, encoded_path : bytes) -> Optional[EfsDirEntry]:
+        
+        path = normalize_efs_path(encoded_path)
+        
+        entries = self._get(self.path_to_listing, dirname(path))
+        
+        if entries is not None and path != b'/':
+            
+            entry = next((entry for entry in entries if entry.name == basename(path)), None)
+            
+            # Listings describe symbolic links themselves, like lstat(), while
+            # EFS2_DIAG_STAT describes their target
+            
+            if entry is None or entry.mode & S_IFMT != S_IFLNK:
+                
+                return entry
+        
+        opcode, payload = self.stat(diag_input, encoded_path)
+        
+        if opcode != DIAG_SUBSYS_CMD_F or len(payload) < EFS2_STAT_RESPONSE.size:
+            return None
+        
+        (cmd_subsystem_id, subcommand_code,
+            errno, mode, size, num_links,
+            atime, mtime, ctime) = EFS2_STAT_RESPONSE.unpack_from(payload)
+        
+        if errno:
+            return None
+        
+        return EfsDirEntry(basename(path), FS_DIAG_FTYPE_DIR if mode & S_IFMT == S_IFDIR else 0, mode, size, atime, mtime, ctime)
+    
+    """
+        :returns The mode of a path, or None if it does not exist (see
+            get_entry)
+    """
+    
+    def get_mode(self, diag_input, encoded_path : bytes) -> Optional[int]:
+        
+        entry = self.get_entry(diag_input, encoded_path)
+        
+        return entry.mode if entry else None
+    
+    """
+        Forget the metadata of a path modified on the device, of the entries
+        below it and of the listing of its parent directory.
+    """
+    
+    def invalidate(self, encoded_path : bytes):
+        
+        path = normalize_efs_path(encoded_path)
+        
+        for cache in (self.path_to_listing, self.path_to_stat, self.path_to_link_target):
+            
+            for cached_path in list(cache):
+                
+                if cached_path == path or cached_path.startswith(path.rstrip(b'/') + b'/'):
+                    
+                    del cache[cached_path]
+        
+        self.path_to_listing.pop(dirname(path), None)
+    
+    """
+        :param text: Beginning of an absolute path, as typed by the user
+        :returns The paths of the directory typed completing it, directories
+            being suffixed with a slash
+    """
+    
+    def complete_path(self, diag_input, text : str) -> List[str]:
+        
+        directory, prefix = text[:text.rfind('/') + 1], text[text.rfind('/') + 1:]
+        
+        entries = self.list_directory(diag_input, directory.encode('latin1') or b'/')
+        
+        return sorted(
+            directory + entry.name.decode('latin1') + ('/' if entry.mode & S_IFMT == S_IFDIR else '')
+            for entry in entries
+            if entry.name not in (b'.', b'..') and entry.name.decode('latin1').startswith(prefix)
+        )
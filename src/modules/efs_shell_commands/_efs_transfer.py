@@ -0,0 +1,629 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+
+from struct import pack, unpack, calcsize
+from typing import List, Optional, Callable
+from random import randint
+from collections import deque, namedtuple
+from logging import error, debug, warning
+from os import strerror
+
+from ...inputs._base_input import message_id_to_name
+from ...protocol.subsystems import *
+from ...protocol.messages import *
+from ...protocol.efs2 import *
+from ...protocol.headers import EFS2_HELLO_PARAMETERS, EFS2_RESPONSE_HEADER, EFS2_OPEN_RESPONSE, EFS2_READ_RESPONSE, \
+    EFS2_WRITE_RESPONSE, EFS2_STAT_RESPONSE, EFS2_READDIR_RESPONSE, EFS2_MD5SUM_RESPONSE
+
+"""
+    This file implements the EFS operations shared by the commands of the
+    EFS shell and by the modules dumping the EFS: handshake, directory
+    listing, transfer of file contents to and from the EFS, and comparison
+    of EFS files with local files.
+    
+    Files are moved through EFS2_DIAG_READ and EFS2_DIAG_WRITE requests at
+    computed offsets, several of which are kept in flight (see
+    BaseInput.send_recv_async), within the windows negotiated through
+    EFS2_DIAG_HELLO:
+    
+    * "targ_pkt_window" and "targ_byte_window" bound the number of packets
+      and bytes the target sends without these being acknowledged (reads),
+    
+    * "host_pkt_window" and "host_byte_window" bound the same for the packets
+      sent by the host (writes),
+    
+    * "iter_pkt_window" and "iter_byte_window" bound directory iteration.
+    
+    The first request of a transfer is sent alone, with the largest chunk
+    size. When the device transfers fewer bytes than requested, the chunk
+    size is reduced to what it accepted, and when it rejects the request,
+    the transfer falls back to DEFAULT_EFS_CHUNK_SIZE.
+"""
+
+EfsWindows = namedtuple('EfsWindows', [
+    'targ_pkt_window', 'targ_byte_window',
+    'host_pkt_window', 'host_byte_window',
+    'iter_pkt_window', 'iter_byte_window'
+])
+
+DEFAULT_EFS_CHUNK_SIZE = 1024 # Accepted by all devices
+MAX_EFS_CHUNK_SIZE = 0x2000
+
+# Used when no EFS2_DIAG_HELLO handshake was done: one request of
+# DEFAULT_EFS_CHUNK_SIZE bytes at a time
+
+DEFAULT_EFS_WINDOWS = EfsWindows(*[1, DEFAULT_EFS_CHUNK_SIZE] * 3)
+
+"""
+    An entry returned by EFS2_DIAG_READDIR, the name being bytes.
+"""
+
+EfsDirEntry = namedtuple('EfsDirEntry', [
+    'name', 'entry_type', 'mode', 'size', 'atime', 'mtime', 'ctime'
+])
+
+FS_DIAG_FTYPE_DIR = 0x01
+
+S_IFMT = 0o170000
+S_IFDIR = 0o040000
+S_IFREG = 0o100000
+S_IFLNK = 0o120000
+S_IFITM = 0o160000
+
+"""
+    Raised when an EFS operation fails, with the message to display.
+"""
+
+class EfsTransferError(Exception):
+    
+    pass
+
+"""
+    Raised by compare_efs_file() as soon as the contents read back differ
+    from the local file, interrupting the read.
+"""
+
+class EfsContentMismatch(EfsTransferError):
+    
+    pass
+
+"""
+    Send an EFS2_DIAG_HELLO handshake, letting the device negotiate down the
+    windows proposed.
+    
+    :returns The negotiated EfsWindows
+"""
+
+def send_efs_handshake(diag_input) -> EfsWindows:
+    
+    opcode, payload = diag_input.send_recv(DIAG_SUBSYS_CMD_F, EFS2_HELLO_PARAMETERS.pack(
+        DIAG_SUBSYS_FS, # Command subsystem number
+        EFS2_DIAG_HELLO, # Command code
+        0x100000, # Put all the windows size to high values, let the device negociate these down
+        0x100000,
+        0x100000,
+        0x100000,
+        0x100000,
+        0x100000,
+        1, # We are version 1, we support min version 1 up to max version 1
+        1,
+        1,
+        0xffffffff # Set all the feature bits
+    ), accept_error = False)
+    
+    (cmd_subsystem_id, subcommand_code,
+        targ_pkt_window, targ_byte_window,
+        host_pkt_window, host_byte_window,
+        iter_pkt_window, iter_byte_window,
+        version, min_version, max_version,
+        feature_bits) = EFS2_HELLO_PARAMETERS.unpack(payload)
+    
+    if version != 1:
+        
+        error('EFS version unsupported')
+        exit()
+    
+    efs_windows = EfsWindows(
+        targ_pkt_window, targ_byte_window,
+        host_pkt_window, host_byte_window,
+        iter_pkt_window, iter_byte_window
+    )
+    
+    debug('Negotiated EFS windows: %s' % repr(efs_windows))
+    
+    return efs_windows
+
+"""
+    :param encoded_path: Path of the directory, as bytes
+    
+    :returns The list of EfsDirEntry of the directory
+"""
+
+def list_efs_directory(diag_input, encoded_path : bytes) -> List[EfsDirEntry]:
+    
+    opcode, payload = diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BH',
+        DIAG_SUBSYS_FS, # Command subsystem number
+        EFS2_DIAG_OPENDIR
+    ) + encoded_path + b'\x00', accept_error = True)
+    
+    if opcode != DIAG_SUBSYS_CMD_F:
+        raise EfsTransferError('Error executing OPENDIR: %s received with payload "%s"' % (
+            message_id_to_name.get(opcode, opcode), repr(payload)))
+    
+    (cmd_subsystem_id, subcommand_code,
+        dir_fd, errno) = EFS2_OPEN_RESPONSE.unpack(payload)
+    
+    if errno:
+        raise EfsTransferError('Error executing OPENDIR: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
+    
+    entries : List[EfsDirEntry] = []
+    
+    try: # Close the directory identifier in all cases using the "finally" block below
+        
+        sequence_number = 1 # For the protocol
+        
+        while True: # Iterate over directory files
+            
+            opcode, payload = diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BHIi',
+                DIAG_SUBSYS_FS, # Command subsystem number,
+                EFS2_DIAG_READDIR,
+                dir_fd, sequence_number), accept_error = True)
+            
+            if opcode != DIAG_SUBSYS_CMD_F:
+                raise EfsTransferError('Error executing READDIR: %s received with payload "%s"' % (
+                    message_id_to_name.get(opcode, opcode), repr(payload)))
+            
+            (cmd_subsystem_id, subcommand_code,
+                dir_fd, sequence_number, errno,
+                entry_type, mode, size,
+                atime, mtime, ctime) = EFS2_READDIR_RESPONSE.unpack_from(payload)
+            
+            if errno:
+                raise EfsTransferError('Error executing READDIR: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
+            
+            entry_name : bytes = payload[EFS2_READDIR_RESPONSE.size:].rstrip(b'\x00')
+            
+            if not entry_name: # End of directory reached
+                break
+            
+            entries.append(EfsDirEntry(entry_name, entry_type, mode, size, atime, mtime, ctime))
+            
+            sequence_number += 1
+    
+    finally:
+        
+        opcode, payload = diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BHi',
+            DIAG_SUBSYS_FS, # Command subsystem number
+            EFS2_DIAG_CLOSEDIR,
+            dir_fd
+        ), accept_error = True)
+        
+        if opcode != DIAG_SUBSYS_CMD_F or EFS2_RESPONSE_HEADER.parse(payload).errno:
+            warning('Could not close the EFS directory %s' % repr(encoded_path))
+    
+    return entries
+
+"""
+    :param encoded_path: Path of the symbolic link, as bytes
+    
+    :returns The target of the link, as bytes
+"""
+
+def read_efs_link(diag_input, encoded_path : bytes) -> bytes:
+    
+    opcode, payload = diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BH',
+        DIAG_SUBSYS_FS, # Command subsystem number,
+        EFS2_DIAG_READLINK) + encoded_path + b'\x00', accept_error = True)
+    
+    if opcode != DIAG_SUBSYS_CMD_F:
+        raise EfsTransferError('Error executing READLINK: %s received with payload "%s"' % (
+            message_id_to_name.get(opcode, opcode), repr(payload)))
+    
+    (cmd_subsystem_id, subcommand_code, errno) = EFS2_RESPONSE_HEADER.unpack_from(payload)
+    
+    if errno:
+        raise EfsTransferError('Error executing READLINK: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
+    
+    return payload[EFS2_RESPONSE_HEADER.size:].rstrip(b'\x00')
+
+"""
+    :param encoded_path: Path of the file, as bytes
+    :param oflag: Flags, as for open(2)
+    :param mode: Mode of the file if it is created
+    
+    :returns The EFS file descriptor, to be passed to close_efs_file()
+"""
+
+def open_efs_file(diag_input, encoded_path : bytes, oflag : int = 0x0, mode : int = 0) -> int:
+    
+    opcode, payload = diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BHii',
+        DIAG_SUBSYS_FS, # Command subsystem number
+        EFS2_DIAG_OPEN,
+        oflag,
+        mode
+    ) + encoded_path + b'\x00', accept_error = True)
+    
+    if opcode != DIAG_SUBSYS_CMD_F:
+        raise EfsTransferError('Error executing OPEN: %s received with payload "%s"' % (
+            message_id_to_name.get(opcode, opcode), repr(payload)))
+    
+    (cmd_subsystem_id, subcommand_code,
+        file_fd, errno) = EFS2_OPEN_RESPONSE.unpack(payload)
+    
+    if errno:
+        raise EfsTransferError('Error executing OPEN: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
+    
+    return file_fd
+
+def close_efs_file(diag_input, file_fd : int):
+    
+    opcode, payload = diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BHi',
+        DIAG_SUBSYS_FS, # Command subsystem number
+        EFS2_DIAG_CLOSE,
+        file_fd
+    ), accept_error = True)
+    
+    if opcode != DIAG_SUBSYS_CMD_F:
+        raise EfsTransferError('Error executing CLOSE: %s received with payload "%s"' % (
+            message_id_to_name.get(opcode, opcode), repr(payload)))
+    
+    (cmd_subsystem_id, subcommand_code, errno) = EFS2_RESPONSE_HEADER.unpack(payload)
+    
+    if errno:
+        raise EfsTransferError('Error executing CLOSE: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
+
+"""
+    :returns The size of an opened EFS file, or None if it could not be
+        obtained (EFS2_DIAG_FSTAT unsupported)
+"""
+
+def get_efs_file_size(diag_input, file_fd : int) -> Optional[int]:
+    
+    opcode, payload = diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BHi',
+        DIAG_SUBSYS_FS, # Command subsystem number
+        EFS2_DIAG_FSTAT,
+        file_fd
+    ), accept_error = True)
+    
+    if opcode != DIAG_SUBSYS_CMD_F or len(payload) < EFS2_STAT_RESPONSE.size:
+        return None
+    
+    (cmd_subsystem_id, subcommand_code,
+        errno, file_mode, file_size, num_links,
+        atime, mtime, ctime) = EFS2_STAT_RESPONSE.unpack_from(payload)
+    
+    return None if errno else file_size
+
+"""
+    Read the contents of an opened EFS file.
+    
+    :param file_fd: EFS file descriptor, opened for reading
+    :param output_file: File object to which the contents are written, in
+        order (it does not need to be seekable)
+    :param file_size: Size of the file (see get_efs_file_size). When None,
+        the file is read one request at a time until a short read.
+    :param efs_windows: The windows negotiated with EFS2_DIAG_HELLO
+    
+    :returns The number of bytes read
+"""
+
+def read_efs_file(diag_input, file_fd : int, output_file, file_size : Optional[int], efs_windows : EfsWindows) -> int:
+    
+    received_chunks = {} # {offset: data} received out of order
+    
+    written_size = 0
+    
+    def send_read(offset : int, size : int):
+        
+        return diag_input.send_recv_async(DIAG_SUBSYS_CMD_F, pack('<BHiII',
+            DIAG_SUBSYS_FS, # Command subsystem number
+            EFS2_DIAG_READ,
+            file_fd, # File descriptor to read from
+            size, # Bytes to read at once
+            offset # Offset where to read
+        ))
+    
+    def process_read(offset : int, size : int, opcode : int, payload : bytes) -> int:
+        
+        nonlocal written_size
+        
+        if opcode != DIAG_SUBSYS_CMD_F:
+            raise EfsTransferError('Error executing READ: %s received with payload "%s"' % (
+                message_id_to_name.get(opcode, opcode), repr(payload)))
+        
+        (cmd_subsystem_id, subcommand_code,
+            file_fd, read_offset, num_bytes_read,
+            errno) = EFS2_READ_RESPONSE.unpack_from(payload)
+        
+        if errno:
+            raise EfsTransferError('Error executing READ: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
+        
+        read_data : bytes = payload[EFS2_READ_RESPONSE.size:]
+        
+        # Write the data which follows what was already written
+        
+        received_chunks[offset] = read_data
+        
+        while received_chunks.get(written_size):
+            
+            chunk_data : bytes = received_chunks.pop(written_size)
+            
+            output_file.write(chunk_data)
+            written_size += len(chunk_data)
+        
+        return len(read_data)
+    
+    return _transfer_chunks(diag_input, file_size,
+        efs_windows.targ_pkt_window, efs_windows.targ_byte_window,
+        send_read, process_read)
+
+"""
+    Write contents to an opened EFS file.
+    
+    :param file_fd: EFS file descriptor, opened for writing
+    :param input_file: Seekable file object from which the contents are read
+    :param file_size: Number of bytes to write
+    :param efs_windows: The windows negotiated with EFS2_DIAG_HELLO
+    
+    :returns The number of bytes written
+"""
+
+def write_efs_file(diag_input, file_fd : int, input_file, file_size : int, efs_windows : EfsWindows) -> int:
+    
+    def send_write(offset : int, size : int):
+        
+        input_file.seek(offset)
+        
+        return diag_input.send_recv_async(DIAG_SUBSYS_CMD_F, pack('<BHiI',
+            DIAG_SUBSYS_FS, # Command subsystem number
+            EFS2_DIAG_WRITE,
+            file_fd, # File descriptor to write to
+            offset # File position to write at
+        ) + input_file.read(size))
+    
+    def process_write(offset : int, size : int, opcode : int, payload : bytes) -> int:
+        
+        if opcode != DIAG_SUBSYS_CMD_F:
+            raise EfsTransferError('Error executing WRITE: %s received with payload "%s"' % (
+                message_id_to_name.get(opcode, opcode), repr(payload)))
+        
+        (cmd_subsystem_id, subcommand_code,
+            file_fd, write_offset, num_bytes_written,
+            errno) = EFS2_WRITE_RESPONSE.unpack(payload)
+        
+        if errno:
+            raise EfsTransferError('Error executing WRITE: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
+        
+        if num_bytes_written <= 0:
+            raise EfsTransferError('Error executing WRITE: no byte was written at offset %d' % offset)
+        
+        return num_bytes_written
+    
+    return _transfer_chunks(diag_input, file_size,
+        efs_windows.host_pkt_window, efs_windows.host_byte_window,
+        send_write, process_write)
+
+"""
+    :param encoded_path: Path of the directory to create, as bytes
+"""
+
+def make_efs_directory(diag_input, encoded_path : bytes, mode : int = 0o777 | S_IFDIR):
+    
+    opcode, payload = diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BHh',
+        DIAG_SUBSYS_FS, # Command subsystem number
+        EFS2_DIAG_MKDIR,
+        mode
+    ) + encoded_path + b'\x00', accept_error = True)
+    
+    if opcode != DIAG_SUBSYS_CMD_F:
+        raise EfsTransferError('Error executing MKDIR: %s received with payload "%s"' % (
+            message_id_to_name.get(opcode, opcode), repr(payload)))
+    
+    (cmd_subsystem_id, subcommand_code, errno) = EFS2_RESPONSE_HEADER.unpack(payload)
+    
+    if errno:
+        raise EfsTransferError('Error executing MKDIR: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
+
+"""
+    Obtain the MD5 digest of an EFS file, computed by the device
+    (EFS2_DIAG_MD5SUM).
+    
+    :param encoded_path: Path of the file, as bytes
+    
+    :returns The 16-byte digest, or None if the device does not support
+        the request or could not hash the file
+"""
+
+def get_efs_md5sum(diag_input, encoded_path : bytes) -> Optional[bytes]:
+    
+    sequence_number = randint(0, 0xffff)
+    
+    opcode, payload = diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BHH',
+        DIAG_SUBSYS_FS, # Command subsystem number
+        EFS2_DIAG_MD5SUM,
+        sequence_number
+    ) + encoded_path + b'\x00', accept_error = True)
+    
+    if opcode != DIAG_SUBSYS_CMD_F or len(payload) != EFS2_MD5SUM_RESPONSE.size + 16:
+        return None
+    
+    (cmd_subsystem_id, subcommand_code,
+        response_sequence_number, errno) = EFS2_MD5SUM_RESPONSE.unpack_from(payload)
+    
+    if errno or response_sequence_number != sequence_number:
+        return None
+    
+    return payload[EFS2_MD5SUM_RESPONSE.size:]
+
+"""
+    Compare the contents of an opened EFS file with a local file, by reading
+    them back, stopping at the first difference.
+    
+    :param file_fd: EFS file descriptor, opened for reading
+    :param input_file: Seekable file object holding the local contents
+    :param file_size: Size of the local file, which the EFS file is known to
+        have
+    :param efs_windows: The windows negotiated with EFS2_DIAG_HELLO
+    
+    :returns Whether the contents are the same
+"""
+
+def compare_efs_file(diag_input, file_fd : int, input_file, file_size : int, efs_windows : EfsWindows) -> bool:
+    
+    comparator = _ContentComparator(input_file)
+    
+    try:
+        
+        num_bytes = read_efs_file(diag_input, file_fd, comparator, file_size, efs_windows)
+    
+    except EfsContentMismatch:
+        
+        return False
+    
+    return num_bytes == file_size
+
+class _ContentComparator:
+    
+    def __init__(self, input_file):
+        
+        self.input_file = input_file
+        
+        self.offset = 0
+    
+    def write(self, data : bytes):
+        
+        self.input_file.seek(self.offset)
+        
+        if self.input_file.read(len(data)) != data:
+            
+            raise EfsContentMismatch('The contents differ after offset %d' % self.offset)
+        
+        self.offset += len(data)
+
+"""
+    Transfer a file chunk by chunk, keeping as many requests in flight as
+    the windows allow.
+    
+    :param total_size: Number of bytes to transfer, or None for reading until
+        a short read
+    :param send_chunk: Function sending the request for a (offset, size)
+        chunk, returning its future
+    :param process_response: Function processing the response for a
+        (offset, size, opcode, payload) chunk, returning the number of bytes
+        transferred, or raising EfsTransferError
+    
+    :returns The number of bytes transferred
+"""
+
+def _transfer_chunks(diag_input, total_size : Optional[int], pkt_window : int, byte_window : int,
+    send_chunk : Callable, process_response : Callable) -> int:
+    
+    if total_size is None:
+        
+        chunk_size = DEFAULT_EFS_CHUNK_SIZE
+        end_offset = float('inf')
+    
+    else:
+        
+        chunk_size = max(DEFAULT_EFS_CHUNK_SIZE, min(MAX_EFS_CHUNK_SIZE, byte_window))
+        end_offset = total_size
+    
+    is_probing = chunk_size > DEFAULT_EFS_CHUNK_SIZE # Whether the first request is awaited alone
+    
+    pending_chunks = deque() # [(future, offset, size)], in the order requests were sent
+    
+    short_chunks = deque() # [(offset, size)] remainders of partially transferred chunks
+    
+    next_offset = 0
+    
+    try:
+        
+        while True:
+            
+            if is_probing or total_size is None:
+                num_in_flight = 1
+            else:
+                num_in_flight = max(1, min(pkt_window, byte_window // chunk_size,
+                    diag_input.diag_request_window.max_size))
+            
+            while len(pending_chunks) < num_in_flight:
+                
+                if short_chunks:
+                    offset, size = short_chunks.popleft()
+                    if size > chunk_size:
+                        short_chunks.appendleft((offset + chunk_size, size - chunk_size))
+                        size = chunk_size
+                elif next_offset < end_offset:
+                    offset, size = next_offset, int(min(chunk_size, end_offset - next_offset))
+                    next_offset += size
+                else:
+                    break
+                
+                pending_chunks.append((send_chunk(offset, size), offset, size))
+            
+            if not pending_chunks:
+                break
+            
+            future, offset, size = pending_chunks.popleft()
+            
+            opcode, payload = diag_input.wait_diag_response(future, accept_error = True)
+            
+            if offset >= end_offset:
+                continue # Read past the end of a file which was truncated meanwhile
+            
+            try:
+                
+                num_bytes = process_response(offset, size, opcode, payload)
+            
+            except EfsTransferError:
+                
+                if not is_probing:
+                    raise
+                
+                # The device may not accept chunks this large, start over with
+                # the default size
+                
+                chunk_size = DEFAULT_EFS_CHUNK_SIZE
+                next_offset = 0
+                is_probing = False
+                
+                continue
+            
+            is_probing = False
+            
+            if num_bytes < size:
+                
+                if num_bytes <= 0 or total_size is None:
+                    
+                    end_offset = offset + max(num_bytes, 0) # End of file reached
+                    
+                    short_chunks = deque((short_offset, short_size) for short_offset, short_size in short_chunks
+                        if short_offset < end_offset)
+                
+                else:
+                    
+                    chunk_size = min(chunk_size, num_bytes) # The device transfers at most this much at once
+                    
+                    short_chunks.append((offset + num_bytes, size - num_bytes))
+    
+    except EfsTransferError:
+        
+        # Wait for the requests still in flight, so that their responses are
+        # not mistaken for responses to further requests
+        
+        for future, offset, size in pending_chunks:
+            
+            diag_input.wait_diag_response(future, accept_error = True)
+        
+        raise
+    
+    return int(min(end_offset, next_offset))
+
+"""
+    :returns A description of the throughput of a transfer, to be displayed
+"""
+
+def format_throughput(num_bytes : int, duration : float) -> str:
+    
+    return '%d bytes in %.2f seconds (%.1f KiB/s)' % (num_bytes, duration,
+        num_bytes / max(duration, 0.001) / 1024)
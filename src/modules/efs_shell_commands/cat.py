@@ -12,6 +12,7 @@ from ...inputs._base_input import message_id_to_name
 from ...protocol.subsystems import *
 from ...protocol.messages import *
 from ...protocol.efs2 import *
+from ...protocol.headers import EFS2_RESPONSE_HEADER, EFS2_OPEN_RESPONSE, EFS2_READ_RESPONSE
 
 class CatCommand(BaseEfsShellCommand):
     
@@ -40,7 +41,7 @@ class CatCommand(BaseEfsShellCommand):
             return
         
         (cmd_subsystem_id, subcommand_code,
-            file_fd, errno) = unpack('<BHIi', payload)
+            file_fd, errno) = EFS2_OPEN_RESPONSE.unpack(payload)
         
         if errno:
             print('Error executing OPEN: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
@@ -62,13 +63,11 @@ class CatCommand(BaseEfsShellCommand):
                     len(bytes_read) # Offset where to read
                 ))
                 
-                read_struct = '<BHiIii'
-                
                 (cmd_subsystem_id, subcommand_code,
                         file_fd, offset, num_bytes_read,
-                        errno) = unpack(read_struct, payload[:calcsize(read_struct)])
+                        errno) = EFS2_READ_RESPONSE.unpack_from(payload)
                 
-                read_data : bytes = payload[calcsize(read_struct):]
+                read_data : bytes = payload[EFS2_READ_RESPONSE.size:]
                 
                 if errno:
                     print('Error executing READ: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
@@ -128,7 +127,7 @@ class CatCommand(BaseEfsShellCommand):
                 file_fd
             ))
             
-            (cmd_subsystem_id, subcommand_code, errno) = unpack('<BHi', payload)
+            (cmd_subsystem_id, subcommand_code, errno) = EFS2_RESPONSE_HEADER.unpack(payload)
             
             if errno:
                 print('Error executing CLOSE: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
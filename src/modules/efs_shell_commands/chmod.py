@@ -13,9 +13,12 @@ from ...inputs._base_input import message_id_to_name
 from ...protocol.subsystems import *
 from ...protocol.messages import *
 from ...protocol.efs2 import *
+from ...protocol.headers import EFS2_RESPONSE_HEADER, EFS2_STAT_RESPONSE
 
 class ChmodCommand(BaseEfsShellCommand):
     
+    modified_path_arguments = ['file_path']
+    
     def get_argument_parser(self, subparsers_object : _SubParsersAction) -> ArgumentParser:
         
         argument_parser = subparsers_object.add_parser('chmod',
@@ -46,10 +49,7 @@ class ChmodCommand(BaseEfsShellCommand):
         
         is_directory : bool = False
         
-        opcode, payload = diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BH',
-            DIAG_SUBSYS_FS, # Command subsystem number
-            EFS2_DIAG_STAT,
-        ) + args.file_path.encode('latin1').decode('unicode_escape').encode('latin1') + b'\x00', accept_error = True)
+        opcode, payload = self.efs_cache.stat(diag_input, args.file_path.encode('latin1').decode('unicode_escape').encode('latin1'))
         
         if opcode != DIAG_SUBSYS_CMD_F:
     
@@ -59,7 +59,7 @@ class ChmodCommand(BaseEfsShellCommand):
     
         (cmd_subsystem_id, subcommand_code,
             errno, file_mode, file_size, num_links,
-            atime, mtime, ctime) = unpack('<BH7i', payload)
+            atime, mtime, ctime) = EFS2_STAT_RESPONSE.unpack(payload)
         
         if errno:
             print('Error executing STAT: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
@@ -117,7 +117,7 @@ class ChmodCommand(BaseEfsShellCommand):
                 repr(payload)))
             return
         
-        (cmd_subsystem_id, subcommand_code, errno) = unpack('<BHi', payload)
+        (cmd_subsystem_id, subcommand_code, errno) = EFS2_RESPONSE_HEADER.unpack(payload)
         
         if errno:
             print('Error executing CHMOD: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
@@ -13,6 +13,7 @@ from ...inputs._base_input import message_id_to_name
 from ...protocol.subsystems import *
 from ...protocol.messages import *
 from ...protocol.efs2 import *
+from ...protocol.headers import EFS2_DEV_INFO_RESPONSE
 
 class DeviceInfoCommand(BaseEfsShellCommand):
     
@@ -39,14 +40,12 @@ class DeviceInfoCommand(BaseEfsShellCommand):
                 repr(payload)))
             return
         
-        device_info_spec = '<BH7iB'
-        
         (cmd_subsystem_id, subcommand_code, errno,
             num_blocks, pages_per_block, page_size,
             total_page_size, maker_id, device_id,
-            device_type) = unpack(device_info_spec, payload[:calcsize(device_info_spec)])
+            device_type) = EFS2_DEV_INFO_RESPONSE.unpack_from(payload)
         
-        device_name : str = payload[calcsize(device_info_spec):].rstrip(b'\x00').decode('utf8')
+        device_name : str = payload[EFS2_DEV_INFO_RESPONSE.size:].rstrip(b'\x00').decode('utf8')
         
         if errno:
             print('Error executing DEV_INFO: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
@@ -7,12 +7,15 @@ from struct import pack, unpack, calcsize
 from typing import List, Dict, Optional
 from os import strerror, getcwd
 from datetime import datetime
+from time import time
 
 from ._base_efs_shell_command import BaseEfsShellCommand
+from ._efs_transfer import read_efs_file, get_efs_file_size, format_throughput, EfsTransferError
 from ...inputs._base_input import message_id_to_name
 from ...protocol.subsystems import *
 from ...protocol.messages import *
 from ...protocol.efs2 import *
+from ...protocol.headers import EFS2_RESPONSE_HEADER, EFS2_OPEN_RESPONSE
 
 class GetCommand(BaseEfsShellCommand):
     
@@ -51,7 +54,7 @@ class GetCommand(BaseEfsShellCommand):
             return
         
         (cmd_subsystem_id, subcommand_code,
-            file_fd, errno) = unpack('<BHIi', payload)
+            file_fd, errno) = EFS2_OPEN_RESPONSE.unpack(payload)
         
         if errno:
             print('Error executing OPEN: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
@@ -59,37 +62,20 @@ class GetCommand(BaseEfsShellCommand):
         
         try: # try/finally block for remotely closing the file opened with the "EFS2_DIAG_OPEN" command in all cases:
             
-            BYTES_TO_READ = 1024
+            file_size : Optional[int] = get_efs_file_size(diag_input, file_fd)
+            
+            start_time : float = time()
             
             with open(local_dst, 'wb') as output_file:
                 
-                while True:
-                    
-                    opcode, payload = diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BHiII',
-                        DIAG_SUBSYS_FS, # Command subsystem number
-                        EFS2_DIAG_READ,
-                        file_fd, # File descriptor to read from
-                        BYTES_TO_READ, # Bytes to read at once
-                        output_file.tell() # Offset where to read
-                    ))
-                    
-                    read_struct = '<BHiIii'
-                    
-                    (cmd_subsystem_id, subcommand_code,
-                            file_fd, offset, num_bytes_read,
-                            errno) = unpack(read_struct, payload[:calcsize(read_struct)])
-                    
-                    read_data : bytes = payload[calcsize(read_struct):]
-                    
-                    output_file.write(read_data)
-                    
-                    if errno:
-                        print('Error executing READ: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
-                        return
-                    
-                    if len(read_data) < BYTES_TO_READ:
-                        break # EOF was reached
+                try:
+                    num_bytes_read : int = read_efs_file(diag_input, file_fd, output_file, file_size, self.efs_windows)
+                
+                except EfsTransferError as transfer_error:
+                    print(transfer_error)
+                    return
             
+            print('Downloaded %s' % format_throughput(num_bytes_read, time() - start_time))
         
         finally:
             
@@ -99,7 +85,7 @@ class GetCommand(BaseEfsShellCommand):
                 file_fd
             ))
             
-            (cmd_subsystem_id, subcommand_code, errno) = unpack('<BHi', payload)
+            (cmd_subsystem_id, subcommand_code, errno) = EFS2_RESPONSE_HEADER.unpack(payload)
             
             if errno:
                 print('Error executing CLOSE: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
@@ -6,9 +6,9 @@ from os.path import basename, dirname, expanduser, exists, isdir
 from struct import pack, unpack, calcsize
 from typing import List, Dict, Optional
 from os import strerror, getcwd
-from random import randint
 
 from ._base_efs_shell_command import BaseEfsShellCommand
+from ._efs_transfer import get_efs_md5sum
 from ...inputs._base_input import message_id_to_name
 from ...protocol.subsystems import *
 from ...protocol.messages import *
@@ -27,33 +27,12 @@ class Md5sumCommand(BaseEfsShellCommand):
         
     def execute_command(self, diag_input, args : Namespace):
         
-        # Obtain the file checksum
+        # Obtain the file checksum (EFS2_DIAG_MD5SUM)
         
-        sequence_number = randint(0, 0xffff)
+        digest : Optional[bytes] = get_efs_md5sum(diag_input, args.path.encode('latin1').decode('unicode_escape').encode('latin1'))
         
-        opcode, payload = diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BHH',
-            DIAG_SUBSYS_FS, # Command subsystem number
-            EFS2_DIAG_MKDIR,
-            sequence_number
-        ) + args.path.encode('latin1').decode('unicode_escape').encode('latin1') + b'\x00', accept_error = True)
-        
-        if opcode != DIAG_SUBSYS_CMD_F:
-            print('Error executing MD5SUM: %s received with payload "%s"' % (
-                message_id_to_name.get(opcode, opcode),
-                repr(payload)))
+        if digest is None:
+            print('Error executing MD5SUM: the device did not return a checksum')
             return
         
-        md5sum_spec = '<BHHi'
-        
-        (cmd_subsystem_id, subcommand_code, sequence_number, errno) = unpack(md5sum_spec, payload[:calcsize(md5sum_spec)])
-        
-        text_hash : str = payload[calcsize(md5sum_spec):].hex()
-        
-        if errno:
-            print('Error executing MD5SUM: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
-            return
-        
-        print(text_hash)
-        
-        
-        
+        print(digest.hex())
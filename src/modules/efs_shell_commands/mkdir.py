@@ -13,9 +13,12 @@ from ...inputs._base_input import message_id_to_name
 from ...protocol.subsystems import *
 from ...protocol.messages import *
 from ...protocol.efs2 import *
+from ...protocol.headers import EFS2_RESPONSE_HEADER
 
 class MkdirCommand(BaseEfsShellCommand):
     
+    modified_path_arguments = ['path']
+    
     def get_argument_parser(self, subparsers_object : _SubParsersAction) -> ArgumentParser:
         
         argument_parser = subparsers_object.add_parser('mkdir',
@@ -41,7 +44,7 @@ class MkdirCommand(BaseEfsShellCommand):
                 repr(payload)))
             return
         
-        (cmd_subsystem_id, subcommand_code, errno) = unpack('<BHi', payload)
+        (cmd_subsystem_id, subcommand_code, errno) = EFS2_RESPONSE_HEADER.unpack(payload)
         
         if errno:
             print('Error executing MKDIR: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
@@ -2,30 +2,49 @@
 #-*- encoding: Utf-8 -*-
 
 from argparse import ArgumentParser, _SubParsersAction, Namespace
-from os.path import basename, dirname, expanduser, exists, isdir
+from os.path import basename, dirname, expanduser, exists, isdir, join, relpath
 from struct import pack, unpack, calcsize
 from typing import List, Dict, Optional
-from os import strerror, getcwd
+from os import strerror, getcwd, fstat, walk
 from datetime import datetime
+from hashlib import md5
+from time import time
 
 from ._base_efs_shell_command import BaseEfsShellCommand
+from ._efs_transfer import open_efs_file, close_efs_file, write_efs_file, compare_efs_file, \
+    get_efs_md5sum, make_efs_directory, format_throughput, EfsDirEntry, EfsTransferError, S_IFMT, S_IFDIR, S_IFLNK
 from ...inputs._base_input import message_id_to_name
 from ...protocol.subsystems import *
 from ...protocol.messages import *
 from ...protocol.efs2 import *
 
+"""
+    Upload a file or a directory tree to the EFS.
+    
+    Before writing a file which already exists remotely with the same size,
+    its contents are compared with the local file, through the MD5 digest
+    computed by the device (EFS2_DIAG_MD5SUM), or by reading it back when
+    the device does not support it. Files with the same contents are
+    skipped, unless --force is passed.
+"""
+
 class PutCommand(BaseEfsShellCommand):
     
+    modified_path_arguments = ['remote_dst']
+    
     def get_argument_parser(self, subparsers_object : _SubParsersAction) -> ArgumentParser:
         
         argument_parser = subparsers_object.add_parser('put',
-            description = "Read a file from the local disk, and upload it to the EFS (create it if does not exist).")
+            description = "Read a file, or a directory recursively, from the local disk, and upload it to the EFS (create it if does not exist). Files which are unchanged on the EFS are skipped.")
+        
+        argument_parser.add_argument('-f', '--force', action = 'store_true',
+            help = 'Upload files even when the EFS already holds the same contents.')
         
         argument_parser.add_argument('local_src')
         argument_parser.add_argument('remote_dst')
         
         return argument_parser
-        
+    
     def execute_command(self, diag_input, args : Namespace):
         
         local_src : str = expanduser(args.local_src)
@@ -36,102 +55,254 @@ class PutCommand(BaseEfsShellCommand):
             print('Error: "%s" does not exist on your local disk' % local_src)
             return
         
-        with open(local_src, 'rb') as input_file:
+        # First, find out whether the remote target path input by the user
+        # is a directory or not, and the UNIX mode of the original file in
+        # the case where it already exists, so that we don't have to
+        # overwrite it when uploading our new file with open()
+        # (EFS2_DIAG_OPEN). This is served from the listing of the parent
+        # directory when it was cached, or else from a stat()
+        # (EFS2_DIAG_STAT) call
+        
+        encoded_dst : bytes = remote_dst.encode('latin1').decode('unicode_escape').encode('latin1')
+        
+        remote_entry : Optional[EfsDirEntry] = self.efs_cache.get_entry(diag_input, encoded_dst)
+        
+        if remote_entry and remote_entry.mode & S_IFMT == S_IFDIR:
             
-            # First, emit a stat() (EFS2_DIAG_STAT) call in order to understand whether
-            # the remote target path input by the user is a directory or not, and to
-            # know the UNIX mode of the original file in the case where it already
-            # exists, so that we don't have to overwrite it when uploading our
-            # new file with open() (EFS2_DIAG_OPEN)
+            encoded_dst = encoded_dst.rstrip(b'/') + b'/' + basename(local_src.rstrip('/')).encode('latin1')
             
-            file_mode_int : int = 0o100777 # By default, our remotely created file will have all rights, and be a regular file (S_IFREG)
-            is_directory : bool = False
+            remote_entry = self.efs_cache.get_entry(diag_input, encoded_dst)
+        
+        self.force : bool = args.force
+        
+        self.use_md5sum : bool = True # Cleared once the device did not answer EFS2_DIAG_MD5SUM
+        
+        self.num_files_uploaded = self.num_files_unchanged = self.num_files_failed = 0
+        self.num_bytes_uploaded = 0
+        
+        start_time : float = time()
+        
+        if isdir(local_src):
+            
+            self.put_directory(diag_input, local_src, encoded_dst, remote_entry)
             
-            opcode, payload = diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BH',
-                DIAG_SUBSYS_FS, # Command subsystem number
-                EFS2_DIAG_STAT,
-            ) + remote_dst.encode('latin1').decode('unicode_escape').encode('latin1') + b'\x00', accept_error = True)
+            print('Uploaded %d files (%s), %d unchanged, %d failed' % (self.num_files_uploaded,
+                format_throughput(self.num_bytes_uploaded, time() - start_time),
+                self.num_files_unchanged, self.num_files_failed))
+        
+        else:
             
-            if opcode == DIAG_SUBSYS_CMD_F: # No error, file or directory exists?
+            try:
                 
-                (cmd_subsystem_id, subcommand_code,
-                    errno, file_mode, file_size, num_links,
-                    atime, mtime, ctime) = unpack('<BH7i', payload)
+                num_bytes_written : Optional[int] = self.put_file(diag_input, local_src, encoded_dst, remote_entry)
+            
+            except (EfsTransferError, OSError) as transfer_error:
                 
-                if not errno:
-                    
-                    if file_mode & 0o170000 == 0o040000: # S_IFDIR
-                        is_directory = True
-                    
-                    else:
-                        file_mode_int = file_mode
+                print(transfer_error)
+                return
             
-            if is_directory:
+            if num_bytes_written is None:
                 
-                remote_dst += '/' + basename(local_src)
+                print('Unchanged, the EFS already holds the same contents')
             
-            # Then, actually open the file for write and/or creation
+            else:
+                
+                print('Uploaded %s' % format_throughput(num_bytes_written, time() - start_time))
+    
+    """
+        Upload the files of a local directory, creating the remote
+        directories which are missing.
+        
+        :param remote_entry: The remote directory if it already exists
+    """
+    
+    def put_directory(self, diag_input, local_dir : str, encoded_dir : bytes, remote_entry : Optional[EfsDirEntry]):
+        
+        try:
             
-            opcode, payload = diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BHii',
-                DIAG_SUBSYS_FS, # Command subsystem number
-                EFS2_DIAG_OPEN,
-                0o1101, # oflag - "O_WRONLY | O_TRUNC | O_CREAT "
-                file_mode_int, # mode
-            ) + remote_dst.encode('latin1').decode('unicode_escape').encode('latin1') + b'\x00', accept_error = True)
+            if remote_entry is None:
+                
+                make_efs_directory(diag_input, encoded_dir)
             
-            if opcode != DIAG_SUBSYS_CMD_F:
-                print('Error executing OPEN: %s received with payload "%s"' % (message_id_to_name.get(opcode, opcode),
-                    repr(payload)))
-                return
+            elif remote_entry.mode & S_IFMT != S_IFDIR:
+                
+                raise EfsTransferError('Error: "%s" is not a directory on the EFS' % encoded_dir.decode('latin1'))
+        
+        except EfsTransferError as transfer_error:
             
-            (cmd_subsystem_id, subcommand_code,
-                file_fd, errno) = unpack('<BHIi', payload)
+            print(transfer_error)
+            return
+        
+        # Directories created by the command, whose listing is known to be
+        # empty
+        
+        created_directories : set = {encoded_dir.rstrip(b'/')} if remote_entry is None else set()
+        
+        for local_path, dir_names, file_names in walk(local_dir):
             
-            if errno:
-                print('Error executing OPEN: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
-                return
+            relative_path : str = relpath(local_path, local_dir)
             
-            try: # try/finally block for remotely closing the file opened with the "EFS2_DIAG_OPEN" command in all cases:
+            encoded_path : bytes = encoded_dir.rstrip(b'/')
+            
+            if relative_path != '.':
+                encoded_path += b'/' + relative_path.replace('\\', '/').encode('latin1')
+            
+            if encoded_path in created_directories:
+                
+                remote_entries : Dict[bytes, EfsDirEntry] = {}
+            
+            else:
+                
+                try:
+                    
+                    remote_entries = {entry.name: entry for entry in self.efs_cache.list_directory(diag_input, encoded_path or b'/')}
+                
+                except EfsTransferError as transfer_error:
+                    
+                    print('%s: %s' % (encoded_path.decode('latin1'), transfer_error))
+                    
+                    self.num_files_failed += len(file_names)
+                    
+                    dir_names.clear() # Don't descend into it
+                    
+                    continue
+            
+            for dir_name in sorted(dir_names):
+                
+                encoded_subdir : bytes = encoded_path + b'/' + dir_name.encode('latin1')
                 
-                BYTES_TO_WRITE = 1024
+                entry : Optional[EfsDirEntry] = remote_entries.get(dir_name.encode('latin1'))
                 
-                while True:
+                if entry and entry.mode & S_IFMT == S_IFLNK:
                     
-                    read_position : int = input_file.tell()
-                    read_data : bytes = input_file.read(BYTES_TO_WRITE)
+                    entry = self.efs_cache.get_entry(diag_input, encoded_subdir) # Follow the link
+                
+                try:
                     
-                    if not read_data: # EOF was reached
-                        break
+                    if entry is None:
+                        
+                        make_efs_directory(diag_input, encoded_subdir)
+                        
+                        created_directories.add(encoded_subdir)
                     
-                    opcode, payload = diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BHiI',
-                        DIAG_SUBSYS_FS, # Command subsystem number
-                        EFS2_DIAG_WRITE,
-                        file_fd, # File descriptor to write to
-                        read_position # File position to write at
-                    ) + read_data)
+                    elif entry.mode & S_IFMT != S_IFDIR:
+                        
+                        raise EfsTransferError('Error: "%s" is not a directory on the EFS' % encoded_subdir.decode('latin1'))
+                
+                except EfsTransferError as transfer_error:
                     
-                    (cmd_subsystem_id, subcommand_code,
-                            file_fd, offset, num_bytes_written,
-                            errno) = unpack('<BHiIii', payload)
+                    print(transfer_error)
                     
-                    if errno:
-                        print('Error executing WRITE: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
-                        return
+                    dir_names.remove(dir_name) # Don't descend into it
+            
+            dir_names.sort()
+            
+            for file_name in sorted(file_names):
+                
+                encoded_file_path : bytes = encoded_path + b'/' + file_name.encode('latin1')
                 
+                entry : Optional[EfsDirEntry] = remote_entries.get(file_name.encode('latin1'))
+                
+                try:
+                    
+                    if entry and entry.mode & S_IFMT == S_IFLNK:
+                        
+                        entry = self.efs_cache.get_entry(diag_input, encoded_file_path) # Follow the link
+                    
+                    num_bytes_written : Optional[int] = self.put_file(diag_input, join(local_path, file_name),
+                        encoded_file_path, entry)
+                
+                except (EfsTransferError, OSError) as transfer_error:
+                    
+                    print('%s: %s' % (encoded_file_path.decode('latin1'), transfer_error))
+                    
+                    self.num_files_failed += 1
+                    
+                    continue
+                
+                if num_bytes_written is None:
+                    
+                    self.num_files_unchanged += 1
+                
+                else:
+                    
+                    self.num_files_uploaded += 1
+                    self.num_bytes_uploaded += num_bytes_written
+    
+    """
+        Upload a file, unless the EFS already holds the same contents.
+        
+        :param remote_entry: The remote file if it already exists
+        
+        :returns The number of bytes written, or None if the file was
+            unchanged
+    """
+    
+    def put_file(self, diag_input, local_path : str, encoded_path : bytes, remote_entry : Optional[EfsDirEntry]) -> Optional[int]:
+        
+        with open(local_path, 'rb') as input_file:
+            
+            file_size : int = fstat(input_file.fileno()).st_size
+            
+            file_mode_int : int = 0o100777 # By default, our remotely created file will have all rights, and be a regular file (S_IFREG)
+            
+            if remote_entry is not None:
+                
+                if remote_entry.mode & S_IFMT == S_IFDIR:
+                    
+                    raise EfsTransferError('Error: "%s" is a directory on the EFS' % encoded_path.decode('latin1'))
+                
+                file_mode_int = remote_entry.mode
+                
+                if (not self.force and remote_entry.size == file_size and
+                    self.has_same_contents(diag_input, input_file, encoded_path, file_size)):
+                    
+                    return None
+            
+            # Then, actually open the file for write and/or creation
+            
+            file_fd : int = open_efs_file(diag_input, encoded_path,
+                0o1101, # oflag - "O_WRONLY | O_TRUNC | O_CREAT "
+                file_mode_int)
+            
+            try: # try/finally block for remotely closing the file opened with the "EFS2_DIAG_OPEN" command in all cases:
+                
+                return write_efs_file(diag_input, file_fd, input_file, file_size, self.efs_windows)
             
             finally:
                 
-                opcode, payload = diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BHi',
-                    DIAG_SUBSYS_FS, # Command subsystem number
-                    EFS2_DIAG_CLOSE,
-                    file_fd
-                ))
+                close_efs_file(diag_input, file_fd)
+    
+    """
+        Compare the contents of a remote file of the same size as a local
+        file with it.
+    """
+    
+    def has_same_contents(self, diag_input, input_file, encoded_path : bytes, file_size : int) -> bool:
+        
+        if self.use_md5sum:
+            
+            remote_digest : Optional[bytes] = get_efs_md5sum(diag_input, encoded_path)
+            
+            if remote_digest is not None:
+                
+                local_digest = md5()
+                
+                input_file.seek(0)
                 
-                (cmd_subsystem_id, subcommand_code, errno) = unpack('<BHi', payload)
+                for block in iter(lambda: input_file.read(0x10000), b''):
+                    local_digest.update(block)
                 
-                if errno:
-                    print('Error executing CLOSE: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
-                    return
+                return remote_digest == local_digest.digest()
             
+            self.use_md5sum = False
+        
+        file_fd : int = open_efs_file(diag_input, encoded_path)
+        
+        try:
             
+            return compare_efs_file(diag_input, file_fd, input_file, file_size, self.efs_windows)
+        
+        finally:
             
+            close_efs_file(diag_input, file_fd)
@@ -7,10 +7,12 @@ from typing import List, Dict, Optional
 from datetime import datetime
 
 from ._base_efs_shell_command import BaseEfsShellCommand
+from ._efs_transfer import EfsTransferError
 from ...inputs._base_input import message_id_to_name
 from ...protocol.subsystems import *
 from ...protocol.messages import *
 from ...protocol.efs2 import *
+from ...protocol.headers import EFS2_STAT_RESPONSE
 from os import strerror
 
 class StatCommand(BaseEfsShellCommand):
@@ -27,17 +29,13 @@ class StatCommand(BaseEfsShellCommand):
         
     def execute_command(self, diag_input, args : Namespace):
 
-        encoded_path : bytes = args.path.encode('latin1').decode('unicode_escape').encode('latin1') + b'\x00'
+        encoded_path : bytes = args.path.encode('latin1').decode('unicode_escape').encode('latin1')
 
-        opcode, payload = diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BH',
-            DIAG_SUBSYS_FS, # Command subsystem number,
-            EFS2_DIAG_STAT) + encoded_path, accept_error = True)
+        opcode, payload = self.efs_cache.stat(diag_input, encoded_path)
             
-        readdir_struct = '<BHI8i'
-        
         (cmd_subsystem_id, subcommand_code,
             errno, mode, size, num_links,
-            atime, mtime, ctime) = unpack('<BH7i', payload)
+            atime, mtime, ctime) = EFS2_STAT_RESPONSE.unpack(payload)
         
         if errno:
             print('Error executing STAT: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
@@ -67,19 +65,12 @@ class StatCommand(BaseEfsShellCommand):
         
         if mode & 0o170000 == 0o120000: # S_IFLNK
 
-            opcode, payload = diag_input.send_recv(DIAG_SUBSYS_CMD_F, pack('<BH',
-                DIAG_SUBSYS_FS, # Command subsystem number,
-                EFS2_DIAG_READLINK) + encoded_path, accept_error = False)
-                
-            readlink_struct = '<BHI'
-            
-            (cmd_subsystem_id, subcommand_code, errno) = unpack(readlink_struct, payload[:calcsize(readlink_struct)])
-            
-            real_path = payload[calcsize(readlink_struct):].rstrip(b'\x00').decode('latin1')
+            try:
+                real_path = self.efs_cache.read_link(diag_input, encoded_path).decode('latin1')
             
-            if errno:
-                print('Error executing READLINK: %s' % (EFS2_ERROR_CODES.get(errno) or strerror(errno)))
-                return                    
+            except EfsTransferError as transfer_error:
+                print(transfer_error)
+                return
         
         print()
         
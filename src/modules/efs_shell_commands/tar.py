@@ -0,0 +1,41 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+
+from argparse import ArgumentParser, _SubParsersAction, Namespace
+from os.path import expanduser
+from time import time
+
+from ._base_efs_shell_command import BaseEfsShellCommand
+from ._efs_transfer import format_throughput
+from ..efs_tar import open_tar_stream, write_efs_tree_to_tar
+
+class TarCommand(BaseEfsShellCommand):
+    
+    def get_argument_parser(self, subparsers_object : _SubParsersAction) -> ArgumentParser:
+        
+        argument_parser = subparsers_object.add_parser('tar',
+            description = 'Archive a directory of the EFS, with its subdirectories, symbolic links and file modes, to a tar archive on the disk (compressed if its name ends with ".tar.gz", ".tgz", ".tar.bz2" or ".tar.xz").')
+        
+        argument_parser.add_argument('remote_src')
+        argument_parser.add_argument('local_dst')
+        
+        return argument_parser
+        
+    def execute_command(self, diag_input, args : Namespace):
+        
+        remote_src : bytes = args.remote_src.encode('latin1').decode('unicode_escape').encode('latin1')
+        local_dst : str = expanduser(args.local_dst)
+        
+        start_time : float = time()
+        
+        try:
+            tar = open_tar_stream(local_dst)
+        
+        except OSError as error:
+            print('Error: "%s": %s' % (local_dst, error.strerror))
+            return
+        
+        with tar:
+            num_members, num_bytes = write_efs_tree_to_tar(diag_input, remote_src, tar, self.efs_windows)
+        
+        print('Archived %d entries: %s' % (num_members, format_throughput(num_bytes, time() - start_time)))
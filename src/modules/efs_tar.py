@@ -0,0 +1,330 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from tarfile import TarInfo, DIRTYPE, SYMTYPE, REGTYPE, BLOCKSIZE, RECORDSIZE, NUL
+from logging import warning
+from os.path import basename
+from sys import stdout
+from time import time
+import gzip
+import bz2
+import lzma
+
+from .efs_shell_commands._efs_transfer import EfsWindows, send_efs_handshake, list_efs_directory, \
+    read_efs_link, open_efs_file, close_efs_file, read_efs_file, format_throughput, \
+    EfsTransferError, S_IFMT, S_IFDIR, S_IFREG, S_IFLNK, S_IFITM
+
+"""
+    This module streams a subtree of the EFS into a tar archive, without
+    writing the files to the disk.
+    
+    The archive is written as a stream, so that it may be piped ("-" for the
+    standard output), and compressed when its name ends with one of the
+    suffixes of TAR_SUFFIX_TO_OPEN_COMPRESSED.
+    
+    The metadata of the members (size, mode, modification time) comes from
+    the EFS2_DIAG_READDIR responses listing the tree, and the targets of
+    symbolic links from EFS2_DIAG_READLINK. The contents of files are read
+    into the archive as they are received.
+"""
+
+TAR_SUFFIX_TO_OPEN_COMPRESSED = {
+    '.tar.gz': gzip.open,
+    '.tgz': gzip.open,
+    '.tar.bz2': bz2.open,
+    '.tar.xz': lzma.open
+}
+
+"""
+    Write a tar archive as a stream.
+    
+    TarFile.addfile() can't be used for adding the members whose contents
+    are received from the EFS while being archived: it requires a file
+    object to copy these from (since Python 3.13), and writing the contents
+    ourselves would rely on its private attributes. Hence, this writes the
+    headers built by TarInfo.tobuf() followed by the contents and keeps track
+    of the offset in the archive, like TarFile does.
+"""
+
+class TarStreamWriter:
+    
+    """
+        :param file: A file object opened for writing in binary mode
+        :param files_to_close: The file objects closed along with the writer
+    """
+    
+    def __init__(self, file, files_to_close : list):
+        
+        self.file = file
+        self.files_to_close = files_to_close
+        
+        self.offset = 0 # Number of bytes written to the archive
+    
+    def write(self, data : bytes):
+        
+        self.file.write(data)
+        
+        self.offset += len(data)
+    
+    """
+        Write the header of a member, which has to be followed by its
+        contents when these are not empty (see TarMemberWriter).
+    """
+    
+    def write_header(self, tar_info : TarInfo):
+        
+        self.write(tar_info.tobuf())
+    
+    """
+        Write the end-of-archive marker (two empty blocks) and pad the
+        archive to a full record, as TarFile.close() does, then close the
+        underlying files.
+    """
+    
+    def close(self):
+        
+        try:
+            
+            self.write(NUL * (BLOCKSIZE * 2))
+            
+            remainder = self.offset % RECORDSIZE
+            
+            if remainder:
+                self.write(NUL * (RECORDSIZE - remainder))
+            
+            self.file.flush()
+        
+        finally:
+            
+            for file in self.files_to_close:
+                file.close()
+    
+    def __enter__(self):
+        
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        
+        self.close()
+
+"""
+    :param archive_path: Path of the archive, or "-" for the standard output
+    :returns A TarStreamWriter
+"""
+
+def open_tar_stream(archive_path : str) -> TarStreamWriter:
+    
+    open_compressed = next((open_compressed for suffix, open_compressed in TAR_SUFFIX_TO_OPEN_COMPRESSED.items()
+        if archive_path.lower().endswith(suffix)), None)
+    
+    if archive_path == '-':
+        
+        file = stdout.buffer
+        files_to_close = []
+    
+    else:
+        
+        file = open(archive_path, 'wb')
+        files_to_close = [file]
+    
+    if open_compressed:
+        
+        file = open_compressed(file, 'wb') # Leaves the underlying file open when closed
+        files_to_close.insert(0, file)
+    
+    return TarStreamWriter(file, files_to_close)
+
+"""
+    Write the contents of a file, as read from the EFS, as the data of the
+    member of a tar archive whose header was just written, making sure that
+    exactly the size announced in the header is written.
+"""
+
+class TarMemberWriter:
+    
+    def __init__(self, tar : TarStreamWriter, size : int):
+        
+        self.tar = tar
+        self.size = size
+        
+        self.num_bytes_written = 0
+    
+    def write(self, data : bytes):
+        
+        data = data[:self.size - self.num_bytes_written] # The file grew since it was listed
+        
+        self.tar.write(data)
+        
+        self.num_bytes_written += len(data)
+    
+    def close(self):
+        
+        # Pad the data if the file shrank since it was listed, and to the
+        # next block
+        
+        self.tar.write(NUL * (self.size - self.num_bytes_written))
+        
+        remainder = self.size % BLOCKSIZE
+        
+        if remainder:
+            self.tar.write(NUL * (BLOCKSIZE - remainder))
+
+"""
+    Add a subtree of the EFS to a tar archive, depth-first. Entries which
+    can't be read are skipped with a warning.
+    
+    :param encoded_path: Path of the root of the subtree, as bytes. Members
+        are named relatively to its parent directory.
+    :param tar: A TarStreamWriter, see open_tar_stream()
+    
+    :returns A (number of members, number of bytes of file contents) tuple
+"""
+
+def write_efs_tree_to_tar(diag_input, encoded_path : bytes, tar : TarStreamWriter, efs_windows : EfsWindows):
+    
+    encoded_path = b'/' + encoded_path.strip(b'/')
+    
+    root_name = basename(encoded_path.decode('latin1'))
+    
+    num_members = num_bytes = 0
+    
+    if root_name:
+        
+        root_info = TarInfo(root_name)
+        root_info.type = DIRTYPE
+        root_info.mode = 0o755
+        root_info.mtime = int(time())
+        
+        tar.write_header(root_info)
+        
+        num_members += 1
+    
+    directories = [(encoded_path, root_name)]
+    
+    while directories:
+        
+        directory, directory_name = directories.pop()
+        
+        try:
+            
+            entries = list_efs_directory(diag_input, directory)
+        
+        except EfsTransferError as transfer_error:
+            
+            warning('%s: %s' % (directory.decode('latin1'), transfer_error))
+            continue
+        
+        subdirectories = []
+        
+        for entry in entries:
+            
+            if entry.name in (b'.', b'..'):
+                continue
+            
+            entry_path = directory.rstrip(b'/') + b'/' + entry.name
+            
+            tar_info = TarInfo((directory_name + '/' if directory_name else '') + entry.name.decode('latin1'))
+            tar_info.mode = entry.mode & 0o7777
+            tar_info.mtime = entry.mtime
+            
+            file_type = entry.mode & S_IFMT
+            
+            if file_type == S_IFDIR:
+                
+                tar_info.type = DIRTYPE
+                
+                tar.write_header(tar_info)
+                
+                subdirectories.append((entry_path, tar_info.name))
+            
+            elif file_type == S_IFLNK:
+                
+                try:
+                    tar_info.linkname = read_efs_link(diag_input, entry_path).decode('latin1')
+                
+                except EfsTransferError as transfer_error:
+                    warning('%s: %s' % (entry_path.decode('latin1'), transfer_error))
+                    continue
+                
+                tar_info.type = SYMTYPE
+                
+                tar.write_header(tar_info)
+            
+            elif file_type in (S_IFREG, S_IFITM):
+                
+                try:
+                    file_fd = open_efs_file(diag_input, entry_path)
+                
+                except EfsTransferError as transfer_error:
+                    warning('%s: %s' % (entry_path.decode('latin1'), transfer_error))
+                    continue
+                
+                tar_info.type = REGTYPE
+                tar_info.size = entry.size
+                
+                tar.write_header(tar_info)
+                
+                member_writer = TarMemberWriter(tar, entry.size)
+                
+                try:
+                    
+                    read_efs_file(diag_input, file_fd, member_writer, entry.size, efs_windows)
+                
+                except EfsTransferError as transfer_error:
+                    
+                    warning('%s: %s' % (entry_path.decode('latin1'), transfer_error))
+                
+                finally:
+                    
+                    member_writer.close()
+                    
+                    try:
+                        close_efs_file(diag_input, file_fd)
+                    
+                    except EfsTransferError as transfer_error:
+                        warning('%s: %s' % (entry_path.decode('latin1'), transfer_error))
+                
+                if member_writer.num_bytes_written != entry.size:
+                    
+                    warning('%s: %d bytes were read instead of %d, the archived file was padded' % (
+                        entry_path.decode('latin1'), member_writer.num_bytes_written, entry.size))
+                
+                num_bytes += member_writer.num_bytes_written
+            
+            else:
+                
+                continue
+            
+            num_members += 1
+        
+        directories += reversed(subdirectories)
+    
+    return num_members, num_bytes
+
+"""
+    Module exporting a subtree of the EFS to a tar archive (--efs-tar).
+"""
+
+class EfsTarExporter:
+    
+    def __init__(self, diag_input, archive_path : str, remote_path : str = '/'):
+        
+        self.diag_input = diag_input
+        
+        self.archive_path = archive_path
+        self.remote_path = remote_path
+    
+    def on_init(self):
+        
+        efs_windows = send_efs_handshake(self.diag_input)
+        
+        start_time = time()
+        
+        with open_tar_stream(self.archive_path) as tar:
+            
+            num_members, num_bytes = write_efs_tree_to_tar(self.diag_input,
+                self.remote_path.encode('latin1'), tar, efs_windows)
+        
+        if self.archive_path != '-':
+            
+            print('Archived %d entries of the EFS to %s: %s' % (num_members, self.archive_path,
+                format_throughput(num_bytes, time() - start_time)))
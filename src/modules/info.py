@@ -7,6 +7,7 @@ from time import sleep
 from ctypes import *
 
 from ..protocol.messages import *
+from ..protocol.headers import DIAG_EXT_BUILD_ID_HEADER
 
 """
     This module exposes a class from which a module may inherit in order to
@@ -83,7 +84,7 @@ class InfoRetriever:
         
         if opcode == DIAG_EXT_BUILD_ID_F:
             
-            (msm_hw_version_format, msm_hw_version, mobile_model_id), ver_strings = unpack('<B2xII', payload[:11]), payload[11:]
+            (msm_hw_version_format, msm_hw_version, mobile_model_id), ver_strings = DIAG_EXT_BUILD_ID_HEADER.unpack_from(payload), payload[DIAG_EXT_BUILD_ID_HEADER.size:]
             
             build_id, model_string, _ = ver_strings.split(b'\x00', 2)
             
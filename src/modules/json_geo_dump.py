@@ -27,6 +27,8 @@ DELAY_CHECK_GEOLOCATION = 10 # Check GPS location every 10 seconds
 
 class JsonGeoDumper(EnableLogMixin):
     
+    accepts_memoryviews = True # See BaseInput.dispatch_received_diag_packet
+    
     def __init__(self, diag_input, json_geo_file):
         
         self.json_geo_file = json_geo_file
@@ -58,15 +60,15 @@ class JsonGeoDumper(EnableLogMixin):
                 
                 self.last_time_geolocation_was_checked = time()
         
-        if log_type in TYPES_FOR_RAW_PACKET_LOGGING:
-    
-            json_record = dumps({
-                'log_type': log_type,
-                'log_frame': b64encode(log_header + log_payload).decode('ascii'),
-                'timestamp': time()
-            }, sort_keys = True)
-            
-            self.json_geo_file.write(json_record + '\n')
+        # Only logs from "self.limit_registered_logs" are dispatched here
+        
+        json_record = dumps({
+            'log_type': log_type,
+            'log_frame': b64encode(bytes(log_header) + log_payload).decode('ascii'),
+            'timestamp': time()
+        }, sort_keys = True)
+        
+        self.json_geo_file.write(json_record + '\n')
     
     def __del__(self):
         
@@ -1,11 +1,17 @@
 #!/usr/bin/python3
 #-*- encoding: Utf-8 -*-
-from struct import pack, unpack_from, calcsize
 from ..protocol.messages import *
+from ..protocol.headers import DIAG_PEEK_HEADER
+from os.path import join, exists, getsize
+from typing import Optional
 from datetime import datetime
-from struct import unpack
-from enum import IntEnum
 from os import makedirs
+from collections import deque
+from time import time
+
+from ..inputs._base_input import message_id_to_name
+from ._memory_map import MemoryMap, MEMORY_MAP_FILE_NAME
+from ..inputs._log_masks import get_firmware_build_id
 
 """
     This module is meant to dump the memory from a QCDM device. It will better
@@ -19,26 +25,60 @@ from os import makedirs
 
 """
     The Diag commands purporting to read the memory allow only reading a word
-    of memory at once.
-
+    of memory at once (WORD_SIZE bytes).
+    
     In order to find the readable memory ranges faster when only certain are,
-    it will seek through memory by increments of 0x1000 bytes (state
-    LOOKING_FORWARD_1000_BY_1000) until one is found.
+    the memory is first probed every PROBE_STEP bytes. Where two successive
+    probes differ, the boundary of the memory range lying between them is
+    found through a binary search, at the granularity of a word.
     
-    When an offset pertaining to a readable chunk is found, it will seek
-    backwards one word at once (LOOKING_BACKWARDS_10_BY_10) until the beginning
-    of this chunk is found.
+    The readable and unreadable ranges found are recorded into a MemoryMap,
+    saved into the output directory (see "_memory_map.py"), so that an
+    interrupted dump resumes where it stopped, and that dumping again the
+    same firmware skips probing.
     
-    Once done, it reads it sequentially (READING_FORWARD_10_BY_10).
+    The readable ranges are then read with the DIAG_PEEK* command which
+    transfers the most bytes at once on the device, keeping several requests
+    in flight, and resuming the chunks already partly written.
 """
 
-class MemoryReaderState(IntEnum):
-    LOOKING_FORWARD_1000_BY_1000 = 0
-    LOOKING_BACKWARDS_10_BY_10 = 1
-    READING_FORWARD_10_BY_10 = 2
+WORD_SIZE = 0x10
+PROBE_STEP = 0x1000
+
+# The DIAG_PEEK* commands read a number of units of the given size, at most
+# 16 bytes according to the original protocol, which certain devices
+# exceed. PEEK_SIZES are the transfer sizes tried, in bytes.
+
+PEEK_COMMANDS = [(DIAG_PEEKD_F, 4), (DIAG_PEEKW_F, 2), (DIAG_PEEKB_F, 1)]
+PEEK_SIZES = [0x400, 0x100, 0x40, WORD_SIZE]
+
+
+WRITE_BUFFER_SIZE = 0x100000
+
+PROGRESS_INTERVAL = 0.5 # In seconds
+
+MAP_SAVE_INTERVAL = 5 # In seconds
+
+AVOIDED_RANGES = [(0xc0000000, 0xd0000000)] # Reading at 0xc0000000 may crash certain devices
 
 CLEAR_LINE = '\x1b[2K' # From https://en.wikipedia.org/wiki/ANSI_escape_code#CSI_sequences
 
+"""
+    Raised when the device refuses to read memory at all.
+"""
+
+class MemoryReadRefused(Exception):
+    
+    pass
+
+"""
+    :returns A description of a transfer rate, to be displayed
+"""
+
+def format_rate(num_bytes : int, duration : float) -> str:
+    
+    return '%.1f KiB/s' % (num_bytes / max(duration, 0.001) / 1024)
+
 class MemoryDumper:
     
     def __init__(self, diag_input, output_dir, start_address, end_address):
@@ -49,148 +89,358 @@ class MemoryDumper:
         
         makedirs(self.output_dir, exist_ok = True)
         
-        self.start_address, self.end_address = start_address, end_address
-    
-    def on_init(self):
+        # Work on whole words
+        
+        self.start_address = start_address - start_address % WORD_SIZE
+        self.end_address = end_address + -end_address % WORD_SIZE
+        
+        self.map_path = join(self.output_dir, MEMORY_MAP_FILE_NAME)
         
-        """
-            Initialize the state machine and local variables
-        """
+        self.memory_map : Optional[MemoryMap] = None
         
-        state = MemoryReaderState.READING_FORWARD_10_BY_10
+        self.last_map_save_time = time()
+        self.last_progress_time = time()
         
-        output_file = None
+        # Command used for reading the readable ranges, see
+        # select_peek_command()
+        
+        self.peek_opcode, self.unit_size, self.peek_size = DIAG_PEEKB_F, 1, WORD_SIZE
+        self.is_peek_command_selected = False
+        
+        self.num_bytes_dumped = 0
+    
+    def on_init(self):
         
         print()
         
-        current_address = self.start_address
+        self.memory_map = MemoryMap.load(self.map_path, get_firmware_build_id(self.diag_input))
         
-        """
-            Start seeking through the memory in a loop
-        """
+        for avoided_start, avoided_end in AVOIDED_RANGES:
+            self.memory_map.mark(avoided_start, avoided_end, False)
         
-        while current_address < self.end_address:
+        try:
             
             """
-                Print the state of the program
+                Probe the memory ranges not known from a previous dump
             """
             
-            if state != MemoryReaderState.READING_FORWARD_10_BY_10:
-            
-                print(CLEAR_LINE + 'Trying to read at %08x/%08x (%.1f%%)...' % (
-                    current_address,
-                    self.end_address,
-                    current_address / self.end_address * 100
-                ), end = '\r')
-            
-            else:
+            for unknown_start, unknown_end in self.memory_map.get_unknown_ranges(self.start_address, self.end_address):
                 
-                print(CLEAR_LINE + 'Reading at %08x/%08x (%.1f%%)...' % (
-                    current_address,
-                    self.end_address,
-                    current_address / self.end_address * 100
-                ), end = '\r')
+                self.probe_range(unknown_start, unknown_end)
+            
+            self.memory_map.save(self.map_path)
             
             """
-                Try to read a given address
+                Read the readable ranges, probing again what follows a word
+                which turned out not to be readable
             """
             
-            opcode, payload = self.diag_input.send_recv(DIAG_PEEKB_F, pack('<IH', current_address, 16), accept_error = True)
+            current_address = self.start_address
+            
+            start_time = time()
             
-            if opcode == DIAG_PEEKB_F: # Read succeeded
+            while True:
                 
-                address_read, bytes_read, contents = unpack('<IH16s', payload)
-                assert address_read == current_address and bytes_read == 16
+                readable_ranges = self.memory_map.get_ranges(current_address, self.end_address, True)
                 
-                # We hit redable data in the middle of a chunk will trying to
-                # read an address incrementing 0x1000 by 0x1000: start reading
-                # backwards word by word until we find the start of the chunk.
+                if not readable_ranges:
+                    break
                 
-                if state == MemoryReaderState.LOOKING_FORWARD_1000_BY_1000:
-                    
-                    state = MemoryReaderState.LOOKING_BACKWARDS_10_BY_10
+                range_start, range_end = readable_ranges[0]
                 
-                # We're reading forward the contents of a chunk word by word:
-                # write the contents to a file.
+                failed_address = self.dump_range(range_start, range_end)
                 
-                elif state == MemoryReaderState.READING_FORWARD_10_BY_10:
+                if failed_address is None:
+                    
+                    current_address = range_end
                 
-                    if not output_file: # Open the output file if we're writing to an new chunk.
-                        
-                        current_chunk_base_address = current_address
-                        
-                        output_file_name = '%s/chunk_%08x' % (self.output_dir, current_chunk_base_address)
-                        
-                        output_file = open(output_file_name, 'wb')
+                else:
+                    
+                    self.memory_map.forget(failed_address, range_end)
+                    self.memory_map.mark(failed_address, failed_address + WORD_SIZE, False)
                     
-                    output_file.write(contents)
+                    self.probe_range(failed_address + WORD_SIZE, range_end)
+                    
+                    current_address = failed_address + WORD_SIZE
+            
+            print(CLEAR_LINE + 'Dumped %d bytes of memory (%s)' % (self.num_bytes_dumped,
+                format_rate(self.num_bytes_dumped, time() - start_time)))
+        
+        except MemoryReadRefused:
+            
+            print(CLEAR_LINE + 'Dumping memory seems not to be supported on this device')
+        
+        finally:
             
-            elif opcode == DIAG_BAD_PARM_F: # Read failed
+            self.memory_map.save(self.map_path)
+        
+        print()
+    
+    """
+        Save the map of the memory when the module is stopped, including when
+        the dump is interrupted.
+    """
+    
+    def on_deinit(self):
+        
+        if self.memory_map:
+            
+            self.memory_map.save(self.map_path)
+    
+    """
+        Try to read a given address.
+        
+        :returns The word read, or None if the address is not readable
+    """
+    
+    def read_word(self, address : int) -> Optional[bytes]:
+        
+        opcode, payload = self.diag_input.send_recv(DIAG_PEEKB_F, DIAG_PEEK_HEADER.pack(address, WORD_SIZE), accept_error = True)
+        
+        if opcode == DIAG_PEEKB_F: # Read succeeded
+            
+            (address_read, bytes_read), contents = DIAG_PEEK_HEADER.unpack_from(payload), payload[DIAG_PEEK_HEADER.size:]
+            assert address_read == address and bytes_read == WORD_SIZE and len(contents) == WORD_SIZE
+            
+            return contents
+        
+        elif opcode == DIAG_BAD_PARM_F: # Read failed
+            
+            return None
+        
+        else: # Command refused
+            
+            raise MemoryReadRefused
+    
+    """
+        Find the readable and unreadable ranges within [start, end), both
+        aligned to words, recording them into the map as the probing goes.
+    """
+    
+    def probe_range(self, start : int, end : int):
+        
+        if start >= end:
+            return
+        
+        probe_addresses = list(range(start + PROBE_STEP - start % PROBE_STEP, end, PROBE_STEP))
+        
+        if end - WORD_SIZE > max([start] + probe_addresses): # Don't miss a boundary in the last step
+            probe_addresses.append(end - WORD_SIZE)
+        
+        segment_start = previous_address = start
+        segment_is_readable = self.read_word(start) is not None
+        
+        if segment_is_readable:
+            print(CLEAR_LINE + 'Found memory at %08x' % start)
+        
+        for address in probe_addresses:
+            
+            print(CLEAR_LINE + 'Trying to read at %08x/%08x (%.1f%%)...' % (
+                address,
+                self.end_address,
+                address / self.end_address * 100
+            ), end = '\r')
+            
+            is_readable = self.read_word(address) is not None
+            
+            if is_readable != segment_is_readable:
                 
-                # We hit the word right before the beginning of a memory chunk
-                # when searching for the beginning this memory chunk: start
-                # reading the chunk forward.
+                boundary = self.find_boundary(previous_address, address, segment_is_readable)
                 
-                if state == MemoryReaderState.LOOKING_BACKWARDS_10_BY_10:
-                    
-                    state = MemoryReaderState.READING_FORWARD_10_BY_10
-                    
-                    print(CLEAR_LINE + 'Found memory at %08x' % (current_address + 0x10))
+                self.memory_map.mark(segment_start, boundary, segment_is_readable)
                 
-                # We hit the word right after the end of a memory chunk when
-                # reading the chunk forward: get back to searching for more chunks.
+                segment_start, segment_is_readable = boundary, is_readable
                 
-                elif state == MemoryReaderState.READING_FORWARD_10_BY_10:
-                    
-                    state = MemoryReaderState.LOOKING_FORWARD_1000_BY_1000
-                    
-                    if output_file: # Close the current output file and print status.
-                        
-                        print(CLEAR_LINE + 'Memory at %08x had length %08x\n' % (
-                            current_chunk_base_address,
-                            output_file.tell()
-                        ))
-                        
-                        output_file.close()
-                        output_file = None
+                if is_readable:
+                    print(CLEAR_LINE + 'Found memory at %08x' % boundary)
             
-            else: # Command refused
+            self.memory_map.mark(segment_start, address, segment_is_readable)
+            
+            previous_address = address
+            
+            if time() - self.last_map_save_time > MAP_SAVE_INTERVAL:
                 
-                print(CLEAR_LINE + 'Dumping memory seems not to be supported on this device')
+                self.memory_map.save(self.map_path)
                 
-                break
+                self.last_map_save_time = time()
+        
+        self.memory_map.mark(segment_start, end, segment_is_readable)
+    
+    """
+        Binary search the first word of a range.
+        
+        :param low: An address of the given status, known to be followed by a
+            single range of the other status
+        :param high: An address of the other status, aligned to words like low
+        :param low_is_readable: The status of low
+        
+        :returns The first address of the other status
+    """
+    
+    def find_boundary(self, low : int, high : int, low_is_readable : bool) -> int:
+        
+        while high - low > WORD_SIZE:
             
-            """
-                Mutate the read address for the next iteration, depending on the
-                current state of the state machine
-            """
+            middle = low + (high - low) // (2 * WORD_SIZE) * WORD_SIZE
             
-            if state == MemoryReaderState.READING_FORWARD_10_BY_10:
-                
-                current_address += 0x10
+            if (self.read_word(middle) is not None) == low_is_readable:
+                low = middle
+            else:
+                high = middle
+        
+        return high
+    
+    """
+        Find which of the DIAG_PEEK* commands reads the most bytes at once on
+        the device, by trying the largest transfer sizes first at the start
+        of a readable range.
+    """
+    
+    def select_peek_command(self, range_start : int, range_end : int):
+        
+        for peek_size in PEEK_SIZES:
             
-            elif state == MemoryReaderState.LOOKING_BACKWARDS_10_BY_10:
-                
-                current_address -= 0x10
+            if peek_size > range_end - range_start:
+                continue
             
-            elif state == MemoryReaderState.LOOKING_FORWARD_1000_BY_1000:
+            for peek_opcode, unit_size in PEEK_COMMANDS:
                 
-                if current_address % 0x1000 == 0:
-                    current_address += 0x1000
-                else:
-                    current_address += -current_address % 0x1000
+                opcode, payload = self.diag_input.send_recv(peek_opcode, DIAG_PEEK_HEADER.pack(
+                    range_start, peek_size // unit_size), accept_error = True)
                 
-                if current_address == 0xc0000000: # Reading at 0xc0000000 may crash certain devices
-                    current_address += 0x10000000
+                if self.get_peek_contents(peek_opcode, unit_size, range_start, peek_size, opcode, payload) is not None:
+                    
+                    self.peek_opcode, self.unit_size, self.peek_size = peek_opcode, unit_size, peek_size
+                    
+                    self.is_peek_command_selected = True
+                    
+                    print(CLEAR_LINE + 'Reading memory with %s, %d bytes per request' % (
+                        message_id_to_name.get(peek_opcode, peek_opcode), peek_size))
+                    
+                    return
+    
+    """
+        :returns The memory contents held by a DIAG_PEEK* response, or None
+            if it is not a valid response to the given request
+    """
+    
+    def get_peek_contents(self, peek_opcode : int, unit_size : int, address : int, size : int,
+        opcode : int, payload : bytes) -> Optional[bytes]:
         
-        print()
+        if opcode != peek_opcode or len(payload) < DIAG_PEEK_HEADER.size + size:
+            return None
+        
+        address_read, units_read = DIAG_PEEK_HEADER.unpack_from(payload)
+        
+        if address_read != address or units_read * unit_size != size:
+            return None
+        
+        return payload[DIAG_PEEK_HEADER.size:DIAG_PEEK_HEADER.size + size]
+    
+    """
+        Write a readable range to its chunk file, resuming what a previous
+        dump already wrote.
+        
+        As many DIAG_PEEK* requests as the request window allows are kept in
+        flight. When one of them fails, the requests in flight are awaited,
+        and the words of the failed request are read one by one to find the
+        first one which is not readable.
+        
+        :returns None if the whole range was read, or the address of the
+            first word which could not be read
+    """
+    
+    def dump_range(self, range_start : int, range_end : int) -> Optional[int]:
         
-        """
-            Deinitialize remaining descriptors
-        """
+        output_file_name = '%s/chunk_%08x' % (self.output_dir, range_start)
         
-        if output_file:
+        already_written = getsize(output_file_name) if exists(output_file_name) else 0
+        already_written -= already_written % WORD_SIZE
+        
+        if already_written >= range_end - range_start:
             
-            output_file.close()
-
-
+            print(CLEAR_LINE + 'Memory at %08x had length %08x (already dumped)' % (range_start, range_end - range_start))
+            
+            return None
+        
+        if not self.is_peek_command_selected:
+            
+            self.select_peek_command(range_start + already_written, range_end)
+        
+        failed_address = None
+        
+        start_time = time()
+        
+        with open(output_file_name, 'r+b' if already_written else 'wb', buffering = WRITE_BUFFER_SIZE) as output_file:
+            
+            output_file.seek(already_written)
+            output_file.truncate()
+            
+            pending_reads = deque() # [(address, size, future)], in the order requests were sent
+            
+            next_address = range_start + already_written
+            
+            while (pending_reads or next_address < range_end) and failed_address is None:
+                
+                while next_address < range_end and len(pending_reads) < self.diag_input.diag_request_window.max_size:
+                    
+                    size = min(self.peek_size, range_end - next_address)
+                    
+                    pending_reads.append((next_address, size, self.diag_input.send_recv_async(self.peek_opcode,
+                        DIAG_PEEK_HEADER.pack(next_address, size // self.unit_size))))
+                    
+                    next_address += size
+                
+                address, size, future = pending_reads.popleft()
+                
+                opcode, payload = self.diag_input.wait_diag_response(future, accept_error = True)
+                
+                contents = self.get_peek_contents(self.peek_opcode, self.unit_size, address, size, opcode, payload)
+                
+                if contents is None:
+                    
+                    for other_address, other_size, other_future in pending_reads:
+                        self.diag_input.wait_diag_response(other_future, accept_error = True)
+                    
+                    pending_reads.clear()
+                    
+                    next_address = address + size
+                    
+                    # Read the words of the failed request one by one
+                    
+                    contents = b''
+                    
+                    for word_address in range(address, address + size, WORD_SIZE):
+                        
+                        word = self.read_word(word_address)
+                        
+                        if word is None:
+                            
+                            failed_address = word_address
+                            
+                            break
+                        
+                        contents += word
+                
+                output_file.write(contents)
+                
+                self.num_bytes_dumped += len(contents)
+                
+                if time() - self.last_progress_time > PROGRESS_INTERVAL:
+                    
+                    print(CLEAR_LINE + 'Reading at %08x/%08x (%.1f%%), %s...' % (
+                        address,
+                        self.end_address,
+                        address / self.end_address * 100,
+                        format_rate(output_file.tell() - already_written, time() - start_time)
+                    ), end = '\r')
+                    
+                    self.last_progress_time = time()
+            
+            print(CLEAR_LINE + 'Memory at %08x had length %08x (%s)\n' % (
+                range_start,
+                output_file.tell(),
+                format_rate(output_file.tell() - already_written, time() - start_time)
+            ))
+        
+        return failed_address
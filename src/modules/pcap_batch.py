@@ -0,0 +1,336 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from collections import deque, namedtuple
+from tempfile import TemporaryDirectory
+from os.path import isdir, join, getsize
+from mmap import mmap, ACCESS_READ
+from multiprocessing import Pool
+from shutil import copyfileobj
+from itertools import chain
+from logging import info
+from heapq import merge
+from os import listdir, remove
+from time import time
+import gzip
+
+from ..inputs.dlf_read import iter_dlf_records, iter_streamed_dlf_records
+from ..protocol.headers import LOG_HEADER, PCAP_RECORD_HEADER
+from ..modules.decoded_sibs_dump import DecodedSibsDumper
+from ..modules import decoded_sibs_dump
+from ..modules.pcap_dump import PcapDumper, PCAP_FILE_HEADER
+from ..protocol.log_types import *
+
+"""
+    This module converts DLF files to a PCAP offline, running the PcapDumper
+    module over a pool of processes.
+    
+    Each DLF file is split into chunks made of whole records, which are
+    converted into separate PCAP fragments in parallel, then concatenated in
+    order. When a directory of DLF files is passed, the records of the
+    different files are merged by timestamp.
+    
+    PcapDumper keeps state across records, which is rebuilt at the start of
+    each chunk:
+    
+    * The current radio access technology, which only depends on the code of
+      the latest signalling log, is computed when splitting the files.
+    
+    * When --reassemble-sibs is used, the 3G RRC frames logged during the
+      SIB_WARMUP_DURATION seconds preceding a chunk are replayed before it,
+      without output, so that SIBs spanning the boundary are reassembled.
+    
+    Gzipped DLF files can't be split, they are converted as a single chunk.
+"""
+
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+
+SIB_WARMUP_DURATION = 10 # In seconds, much larger than SIB repetition periods
+
+RECORDS_BATCH_SIZE = 256 * 1024 # PCAP records written at once by a worker, in bytes
+
+LOG_TYPE_TO_RAT = { # Log codes setting PcapDumper.current_rat
+    WCDMA_SIGNALLING_MESSAGE: '3g',
+    LOG_GSM_RR_SIGNALING_MESSAGE_C: '2g',
+    LOG_LTE_RRC_OTA_MSG_LOG_C: '4g',
+    LOG_NR_RRC_OTA_MSG_LOG_C: '5g'
+}
+
+"""
+    :param dlf_path: Path to the DLF file
+    :param warmup_offset: Offset of the first record to replay for SIB reassembly
+    :param start_offset: Offset of the first record of the chunk
+    :param end_offset: Offset following the last record, None for the end of the file
+    :param timestamp: Timestamp of the record preceding the one at warmup_offset
+    :param current_rat: Radio access technology at start_offset
+"""
+
+DlfChunk = namedtuple('DlfChunk', [
+    'dlf_path',
+    'warmup_offset',
+    'start_offset',
+    'end_offset',
+    'timestamp',
+    'current_rat'
+])
+
+def split_dlf_file(dlf_path, chunk_size, reassemble_sibs):
+    
+    if dlf_path.endswith('.gz'):
+        
+        yield DlfChunk(dlf_path, 0, 0, None, 0, None)
+        
+        return
+    
+    with open(dlf_path, 'rb') as dlf_file:
+        
+        if not getsize(dlf_path):
+            
+            return
+        
+        dlf_map = mmap(dlf_file.fileno(), 0, access = ACCESS_READ)
+    
+    chunk = DlfChunk(dlf_path, 0, 0, None, 0, None)
+    
+    current_rat = None
+    previous_timestamp = 0
+    
+    recent_sib_records = deque() # (offset, timestamp, previous timestamp) of 3G RRC frames within the warm-up duration
+    
+    for offset, log_length, log_type, timestamp in iter_dlf_records(dlf_map):
+        
+        if offset - chunk.start_offset >= chunk_size:
+            
+            yield chunk._replace(end_offset = offset)
+            
+            while recent_sib_records and recent_sib_records[0][1] < timestamp - SIB_WARMUP_DURATION:
+                recent_sib_records.popleft()
+            
+            if recent_sib_records:
+                warmup_offset, _, warmup_timestamp = recent_sib_records[0]
+            else:
+                warmup_offset, warmup_timestamp = offset, previous_timestamp
+            
+            chunk = DlfChunk(dlf_path, warmup_offset, offset, None, warmup_timestamp, current_rat)
+        
+        current_rat = LOG_TYPE_TO_RAT.get(log_type, current_rat)
+        
+        if reassemble_sibs and log_type == WCDMA_SIGNALLING_MESSAGE:
+            
+            recent_sib_records.append((offset, timestamp, previous_timestamp))
+            
+            while recent_sib_records and recent_sib_records[0][1] < timestamp - SIB_WARMUP_DURATION:
+                recent_sib_records.popleft()
+        
+        previous_timestamp = timestamp
+    
+    yield chunk
+
+"""
+    PcapDumper writing the PCAP records of a chunk, without a PCAP file header.
+"""
+
+class ChunkPcapDumper(PcapDumper):
+    
+    buffered_output = False # Records are written by batches, see write_records
+    
+    def __init__(self, pcap_file, reassemble_sibs, decrypt_nas, include_ip_traffic):
+        
+        pcap_file.appending_to_file = True
+        
+        super().__init__(None, pcap_file, reassemble_sibs, decrypt_nas, include_ip_traffic)
+    
+    @staticmethod
+    def install_wireshark_plugin():
+        
+        pass # Done once by the parent process
+    
+    """
+        Write the PCAP records built once they fill a batch, rather than
+        after each log packet (see convert_dlf_chunk for the last batch).
+    """
+    
+    def write_records(self, force = False):
+        
+        if force or len(self.pcap_records) >= RECORDS_BATCH_SIZE:
+            
+            super().write_records()
+    
+    """
+        Feed a 3G RRC frame preceding the chunk to the SIB reassembly logic,
+        discarding the SIBs that it completes (these were written along with
+        the previous chunk).
+    """
+    
+    def warm_up(self, log_type, log_payload, log_header, timestamp):
+        
+        num_pending_bytes = len(self.pcap_records)
+        
+        DecodedSibsDumper.on_log(self, log_type, log_payload, log_header, timestamp)
+        
+        self.pcap_records.truncate(num_pending_bytes)
+
+"""
+    Convert a chunk of a DLF file, from a worker process.
+    
+    :returns The path of the PCAP fragment written
+"""
+
+def convert_dlf_chunk(chunk, output_path, reassemble_sibs, decrypt_nas, include_ip_traffic):
+    
+    # The SIB reassembly state is global to the process, and must not be
+    # carried from a chunk to another one converted by the same process
+    
+    decoded_sibs_dump.bearer_to_sib_type_to_sib.clear()
+    decoded_sibs_dump.bearer_to_sib_schedule_to_sib_type.clear()
+    
+    with open(output_path, 'wb') as pcap_file:
+        
+        dumper = ChunkPcapDumper(pcap_file, reassemble_sibs, decrypt_nas, include_ip_traffic)
+        
+        dumper.current_rat = chunk.current_rat
+        
+        if chunk.dlf_path.endswith('.gz'):
+            
+            with gzip.open(chunk.dlf_path, 'rb') as dlf_file:
+                
+                for log_header, log_payload, log_type, timestamp in iter_streamed_dlf_records(dlf_file):
+                    
+                    dumper.on_log(log_type, log_payload, log_header, timestamp)
+        
+        else:
+            
+            with open(chunk.dlf_path, 'rb') as dlf_file:
+                
+                dlf_map = mmap(dlf_file.fileno(), 0, access = ACCESS_READ)
+            
+            dlf_view = memoryview(dlf_map)
+            
+            header_size = LOG_HEADER.size
+            
+            for offset, log_length, log_type, timestamp in iter_dlf_records(dlf_map, chunk.warmup_offset, chunk.timestamp):
+                
+                if chunk.end_offset is not None and offset >= chunk.end_offset:
+                    
+                    break
+                
+                log_header = dlf_view[offset:offset + header_size]
+                log_payload = dlf_view[offset + header_size:offset + log_length]
+                
+                if offset < chunk.start_offset:
+                    
+                    if log_type == WCDMA_SIGNALLING_MESSAGE:
+                        
+                        dumper.warm_up(log_type, log_payload, log_header, timestamp)
+                
+                else:
+                    
+                    dumper.on_log(log_type, log_payload, log_header, timestamp)
+        
+        dumper.write_records(force = True)
+        
+        dumper.pcap_file = None # Closed here rather than by PcapDumper.__del__
+    
+    return output_path
+
+def convert_dlf_chunk_task(task):
+    
+    chunk = task[0]
+    
+    return chunk.dlf_path, convert_dlf_chunk(*task)
+
+def iter_pcap_records(pcap_path):
+    
+    with open(pcap_path, 'rb') as pcap_file:
+        
+        while True:
+            
+            record_header = pcap_file.read(PCAP_RECORD_HEADER.size)
+            
+            if not record_header:
+                
+                break
+            
+            timestamp_sec, timestamp_usec, included_length, original_length = PCAP_RECORD_HEADER.unpack(record_header)
+            
+            yield (timestamp_sec, timestamp_usec), record_header + pcap_file.read(included_length)
+    
+    remove(pcap_path)
+
+"""
+    :param dlf_path: A DLF file, or a directory containing DLF files (named
+        "*.dlf" or "*.dlf.gz")
+    :param pcap_file: A file object opened in binary mode
+    :param jobs: Number of worker processes, by default the number of CPUs
+    :param chunk_size: Approximate size of the chunks of DLF files
+    :param install_wireshark_plugin: See PcapDumper.install_wireshark_plugin
+"""
+
+def convert_dlf_to_pcap(dlf_path, pcap_file, reassemble_sibs, decrypt_nas, include_ip_traffic,
+    jobs = None, chunk_size = DEFAULT_CHUNK_SIZE, install_wireshark_plugin = True):
+    
+    if isdir(dlf_path):
+        
+        dlf_paths = sorted(
+            join(dlf_path, file_name) for file_name in listdir(dlf_path)
+            if file_name.lower().endswith(('.dlf', '.dlf.gz'))
+        )
+    
+    else:
+        
+        dlf_paths = [dlf_path]
+    
+    if install_wireshark_plugin:
+        
+        PcapDumper.install_wireshark_plugin()
+    
+    if not pcap_file.appending_to_file:
+        
+        pcap_file.write(PCAP_FILE_HEADER)
+    
+    start_time = time()
+    
+    with TemporaryDirectory(prefix = 'qcsuper-') as temp_dir, Pool(jobs) as pool:
+        
+        # Chunks are converted while the DLF files are still being split
+        
+        tasks = (
+            (chunk, join(temp_dir, '%d.pcap' % chunk_index), reassemble_sibs, decrypt_nas, include_ip_traffic)
+            for chunk_index, chunk in enumerate(chain.from_iterable(
+                split_dlf_file(path, chunk_size, reassemble_sibs) for path in dlf_paths
+            ))
+        )
+        
+        dlf_path_to_fragments = {path: [] for path in dlf_paths}
+        
+        num_chunks = 0
+        
+        for chunk_dlf_path, fragment_path in pool.imap(convert_dlf_chunk_task, tasks):
+            
+            num_chunks += 1
+            
+            if len(dlf_paths) == 1: # Concatenate fragments as they are completed
+                
+                with open(fragment_path, 'rb') as fragment:
+                    
+                    copyfileobj(fragment, pcap_file)
+                
+                remove(fragment_path)
+            
+            else:
+                
+                dlf_path_to_fragments[chunk_dlf_path].append(fragment_path)
+        
+        if len(dlf_paths) > 1:
+            
+            for timestamp, record in merge(*(
+                chain.from_iterable(iter_pcap_records(fragment_path) for fragment_path in fragment_paths)
+                for fragment_paths in dlf_path_to_fragments.values()
+            ), key = lambda item: item[0]):
+                
+                pcap_file.write(record)
+    
+    dlf_size = sum(getsize(path) for path in dlf_paths)
+    duration = time() - start_time
+    
+    info('Converted %d DLF file(s) (%d bytes in %d chunks) in %.1f seconds (%.1f MB/s)' % (
+        len(dlf_paths), dlf_size, num_chunks, duration, dlf_size / max(duration, 0.001) / 1e6))
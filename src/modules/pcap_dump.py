@@ -1,6 +1,6 @@
 #!/usr/bin/python3
 #-*- encoding: Utf-8 -*-
-from struct import pack, unpack, unpack_from, calcsize
+from struct import pack
 from subprocess import Popen, PIPE, DEVNULL, STDOUT
 from os.path import expandvars, dirname, realpath
 from os import makedirs, getenv, listdir
@@ -12,6 +12,7 @@ import gzip
 
 from ..modules._enable_log_mixin import EnableLogMixin, TYPES_FOR_RAW_PACKET_LOGGING
 from ..modules.decoded_sibs_dump import DecodedSibsDumper
+from ..modules._buffered_writer import BufferedRecordWriter
 
 MODULES_DIR = realpath(dirname(__file__))
 SRC_WIRESHARK_PLUGIN_DIR = realpath(MODULES_DIR + '/wireshark_plugin')
@@ -27,6 +28,209 @@ except Exception:
 
 from ..protocol.log_types import *
 from ..protocol.gsmtap import *
+from ..protocol.headers import *
+
+"""
+    PCAP file header - https://wiki.wireshark.org/Development/LibpcapFileFormat#File_Format
+"""
+
+PCAP_FILE_HEADER = pack('<IHHi4xII',
+    0xa1b2c3d4, # PCAP Magic
+    2, 4, # Version
+    0, # Timezone
+    65535, # Max packet length
+    228 # LINKTYPE_IPV4 (for GSMTAP)
+)
+
+"""
+    Lookup tables from the channel types found in logs to GSMTAP channel
+    types, built once rather than for each packet.
+    
+    GSMTAP definition:
+    - https://github.com/wireshark/wireshark/blob/wireshark-2.5.0/epan/dissectors/packet-gsmtap.h
+    - http://osmocom.org/projects/baseband/wiki/GSMTAP
+"""
+
+# RRC channel types:
+# - https://github.com/fgsect/scat/blob/0e1d3a4/parsers/qualcomm/diagwcdmalogparser.py#L259
+
+WCDMA_RRC_CHANNEL_TYPES = {
+    RRCLOG_SIG_UL_CCCH: GSMTAP_RRC_SUB_UL_CCCH_Message,
+    RRCLOG_SIG_UL_DCCH: GSMTAP_RRC_SUB_UL_DCCH_Message,
+    RRCLOG_SIG_DL_CCCH: GSMTAP_RRC_SUB_DL_CCCH_Message,
+    RRCLOG_SIG_DL_DCCH: GSMTAP_RRC_SUB_DL_DCCH_Message,
+    RRCLOG_SIG_DL_BCCH_BCH: GSMTAP_RRC_SUB_BCCH_BCH_Message,
+    RRCLOG_SIG_DL_BCCH_FACH: GSMTAP_RRC_SUB_BCCH_FACH_Message,
+    RRCLOG_SIG_DL_PCCH: GSMTAP_RRC_SUB_PCCH_Message,
+    RRCLOG_SIG_DL_MCCH: GSMTAP_RRC_SUB_MCCH_Message,
+    RRCLOG_SIG_DL_MSCH: GSMTAP_RRC_SUB_MSCH_Message
+}
+
+GSM_RR_CHANNEL_TYPES = {
+    DCCH: GSMTAP_CHANNEL_SDCCH,
+    BCCH: GSMTAP_CHANNEL_BCCH,
+    L2_RACH: GSMTAP_CHANNEL_RACH,
+    CCCH: GSMTAP_CHANNEL_CCCH,
+    SACCH: GSMTAP_CHANNEL_SDCCH | GSMTAP_CHANNEL_ACCH,
+    SDCCH: GSMTAP_CHANNEL_SDCCH,
+    FACCH_F: GSMTAP_CHANNEL_TCH_F | GSMTAP_CHANNEL_ACCH,
+    FACCH_H: GSMTAP_CHANNEL_TCH_F | GSMTAP_CHANNEL_ACCH,
+    L2_RACH_WITH_NO_DELAY: GSMTAP_CHANNEL_RACH
+}
+
+GPRS_MAC_CHANNEL_TYPES = {
+    PACCH_RRBP_CHANNEL: GSMTAP_CHANNEL_PACCH,
+    UL_PACCH_CHANNEL: GSMTAP_CHANNEL_PACCH,
+    DL_PACCH_CHANNEL: GSMTAP_CHANNEL_PACCH
+}
+
+# See here for LTE channel constants (they heavily depend on baseband
+# versions): https://github.com/fgsect/scat/blob/01d5b81/parsers/qualcomm/diagltelogparser.py#L1207
+
+LTE_RRC_CHANNEL_TYPES_NB = {
+    LTE_BCCH_BCH_NB: GSMTAP_LTE_RRC_SUB_BCCH_BCH_Message_NB,
+    LTE_BCCH_DL_SCH_NB: GSMTAP_LTE_RRC_SUB_BCCH_DL_SCH_Message_NB,
+    LTE_PCCH_NB: GSMTAP_LTE_RRC_SUB_PCCH_Message_NB,
+    LTE_DL_CCCH_NB: GSMTAP_LTE_RRC_SUB_DL_CCCH_Message_NB,
+    LTE_DL_DCCH_NB: GSMTAP_LTE_RRC_SUB_DL_DCCH_Message_NB,
+    LTE_UL_CCCH_NB: GSMTAP_LTE_RRC_SUB_UL_CCCH_Message_NB,
+    LTE_UL_DCCH_NB: GSMTAP_LTE_RRC_SUB_UL_DCCH_Message_NB
+}
+
+LTE_RRC_CHANNEL_TYPES_V9 = {
+    LTE_BCCH_BCH_v9: GSMTAP_LTE_RRC_SUB_BCCH_BCH_Message,
+    LTE_BCCH_DL_SCH_v9: GSMTAP_LTE_RRC_SUB_BCCH_DL_SCH_Message,
+    LTE_MCCH_v9: GSMTAP_LTE_RRC_SUB_MCCH_Message,
+    LTE_PCCH_v9: GSMTAP_LTE_RRC_SUB_PCCH_Message,
+    LTE_DL_CCCH_v9: GSMTAP_LTE_RRC_SUB_DL_CCCH_Message,
+    LTE_DL_DCCH_v9: GSMTAP_LTE_RRC_SUB_DL_DCCH_Message,
+    LTE_UL_CCCH_v9: GSMTAP_LTE_RRC_SUB_UL_CCCH_Message,
+    LTE_UL_DCCH_v9: GSMTAP_LTE_RRC_SUB_UL_DCCH_Message
+}
+
+LTE_RRC_CHANNEL_TYPES_V14 = {
+    LTE_BCCH_BCH_v14: GSMTAP_LTE_RRC_SUB_BCCH_BCH_Message,
+    LTE_BCCH_DL_SCH_v14: GSMTAP_LTE_RRC_SUB_BCCH_DL_SCH_Message,
+    LTE_MCCH_v14: GSMTAP_LTE_RRC_SUB_MCCH_Message,
+    LTE_PCCH_v14: GSMTAP_LTE_RRC_SUB_PCCH_Message,
+    LTE_DL_CCCH_v14: GSMTAP_LTE_RRC_SUB_DL_CCCH_Message,
+    LTE_DL_DCCH_v14: GSMTAP_LTE_RRC_SUB_DL_DCCH_Message,
+    LTE_UL_CCCH_v14: GSMTAP_LTE_RRC_SUB_UL_CCCH_Message,
+    LTE_UL_DCCH_v14: GSMTAP_LTE_RRC_SUB_UL_DCCH_Message
+}
+
+LTE_RRC_CHANNEL_TYPES_V19 = {
+    LTE_BCCH_BCH_v19: GSMTAP_LTE_RRC_SUB_BCCH_BCH_Message,
+    LTE_BCCH_DL_SCH_v19: GSMTAP_LTE_RRC_SUB_BCCH_DL_SCH_Message,
+    LTE_MCCH_v19: GSMTAP_LTE_RRC_SUB_MCCH_Message,
+    LTE_PCCH_v19: GSMTAP_LTE_RRC_SUB_PCCH_Message,
+    LTE_DL_CCCH_v19: GSMTAP_LTE_RRC_SUB_DL_CCCH_Message,
+    LTE_DL_DCCH_v19: GSMTAP_LTE_RRC_SUB_DL_DCCH_Message,
+    LTE_UL_CCCH_v19: GSMTAP_LTE_RRC_SUB_UL_CCCH_Message,
+    LTE_UL_DCCH_v19: GSMTAP_LTE_RRC_SUB_UL_DCCH_Message
+}
+
+LTE_RRC_CHANNEL_TYPES_V0 = {
+    LTE_BCCH_BCH_v0: GSMTAP_LTE_RRC_SUB_BCCH_BCH_Message,
+    LTE_BCCH_DL_SCH_v0: GSMTAP_LTE_RRC_SUB_BCCH_DL_SCH_Message,
+    LTE_MCCH_v0: GSMTAP_LTE_RRC_SUB_MCCH_Message,
+    LTE_PCCH_v0: GSMTAP_LTE_RRC_SUB_PCCH_Message,
+    LTE_DL_CCCH_v0: GSMTAP_LTE_RRC_SUB_DL_CCCH_Message,
+    LTE_DL_DCCH_v0: GSMTAP_LTE_RRC_SUB_DL_DCCH_Message,
+    LTE_UL_CCCH_v0: GSMTAP_LTE_RRC_SUB_UL_CCCH_Message,
+    LTE_UL_DCCH_v0: GSMTAP_LTE_RRC_SUB_UL_DCCH_Message
+}
+
+LTE_RRC_UPLINK_CHANNEL_TYPES = frozenset([
+    GSMTAP_LTE_RRC_SUB_UL_CCCH_Message,
+    GSMTAP_LTE_RRC_SUB_UL_DCCH_Message,
+    GSMTAP_LTE_RRC_SUB_UL_CCCH_Message_NB,
+    GSMTAP_LTE_RRC_SUB_UL_DCCH_Message_NB
+])
+
+_lte_rrc_channel_lookup_tables = {} # {LTE RRC log header version: lookup table}
+
+"""
+    :param ext_header_ver: Version of the header of a LOG_LTE_RRC_OTA_MSG_LOG_C log
+    
+    :returns The {log channel type: GSMTAP channel type} lookup table for
+        this version, built on the first call for the version
+"""
+
+def get_lte_rrc_channel_lookup_table(ext_header_ver : int) -> dict:
+    
+    channel_lookup_table = _lte_rrc_channel_lookup_tables.get(ext_header_ver)
+    
+    if channel_lookup_table is None:
+        
+        channel_lookup_table = dict(LTE_RRC_CHANNEL_TYPES_NB)
+        
+        # The v9 channel type values don't overlap a lot with other
+        # existing values as they start at "8", so handle these in
+        # all case and allow these to be erased with other values
+        # subsequently
+        
+        channel_lookup_table.update(LTE_RRC_CHANNEL_TYPES_V9)
+        
+        if ext_header_ver in (14, 15, 16, 20, 24, 25):
+            
+            channel_lookup_table.update(LTE_RRC_CHANNEL_TYPES_V14)
+        
+        elif ext_header_ver == 19 or ext_header_ver >= 26:
+            
+            channel_lookup_table.update(LTE_RRC_CHANNEL_TYPES_V19)
+        
+        elif ext_header_ver not in (9, 12):
+            
+            channel_lookup_table.update(LTE_RRC_CHANNEL_TYPES_V0)
+        
+        _lte_rrc_channel_lookup_tables[ext_header_ver] = channel_lookup_table
+    
+    return channel_lookup_table
+
+SIB_TYPE_TO_GSMTAP_CHANNEL_TYPE = {
+    'masterInformationBlock': GSMTAP_RRC_SUB_MasterInformationBlock,
+    'systemInformationBlockType1': GSMTAP_RRC_SUB_SysInfoType1,
+    'systemInformationBlockType2': GSMTAP_RRC_SUB_SysInfoType2,
+    'systemInformationBlockType3': GSMTAP_RRC_SUB_SysInfoType3,
+    'systemInformationBlockType4': GSMTAP_RRC_SUB_SysInfoType4,
+    'systemInformationBlockType5': GSMTAP_RRC_SUB_SysInfoType5,
+    'systemInformationBlockType6': GSMTAP_RRC_SUB_SysInfoType6,
+    'systemInformationBlockType7': GSMTAP_RRC_SUB_SysInfoType7,
+    'systemInformationBlockType11': GSMTAP_RRC_SUB_SysInfoType11,
+    'systemInformationBlockType12': GSMTAP_RRC_SUB_SysInfoType12,
+    'systemInformationBlockType13': GSMTAP_RRC_SUB_SysInfoType13,
+    'systemInformationBlockType13-1': GSMTAP_RRC_SUB_SysInfoType13_1,
+    'systemInformationBlockType13-2': GSMTAP_RRC_SUB_SysInfoType13_2,
+    'systemInformationBlockType13-3': GSMTAP_RRC_SUB_SysInfoType13_3,
+    'systemInformationBlockType13-4': GSMTAP_RRC_SUB_SysInfoType13_4,
+    'systemInformationBlockType14': GSMTAP_RRC_SUB_SysInfoType14,
+    'systemInformationBlockType15': GSMTAP_RRC_SUB_SysInfoType15,
+    'systemInformationBlockType15-1': GSMTAP_RRC_SUB_SysInfoType15_1,
+    'systemInformationBlockType15-2': GSMTAP_RRC_SUB_SysInfoType15_2,
+    'systemInformationBlockType15-3': GSMTAP_RRC_SUB_SysInfoType15_3,
+    'systemInformationBlockType16': GSMTAP_RRC_SUB_SysInfoType16,
+    'systemInformationBlockType17': GSMTAP_RRC_SUB_SysInfoType17,
+    'systemInformationBlockType15-4': GSMTAP_RRC_SUB_SysInfoType15_4,
+    'systemInformationBlockType18': GSMTAP_RRC_SUB_SysInfoType18,
+    'schedulingBlock1': GSMTAP_RRC_SUB_SysInfoTypeSB1,
+    'schedulingBlock2': GSMTAP_RRC_SUB_SysInfoTypeSB2,
+    'systemInformationBlockType15-5': GSMTAP_RRC_SUB_SysInfoType15_5,
+    'systemInformationBlockType5bis': GSMTAP_RRC_SUB_SysInfoType5bis,
+    'systemInfoType11bis': GSMTAP_RRC_SUB_SysInfoType11bis,
+    'systemInfoType15bis': GSMTAP_RRC_SUB_SysInfoType15bis,
+    'systemInfoType15-1bis': GSMTAP_RRC_SUB_SysInfoType15_1bis,
+    'systemInfoType15-2bis': GSMTAP_RRC_SUB_SysInfoType15_2bis,
+    'systemInfoType15-3bis': GSMTAP_RRC_SUB_SysInfoType15_3bis,
+    'systemInfoType15-6': GSMTAP_RRC_SUB_SysInfoType15_6,
+    'systemInfoType15-7': GSMTAP_RRC_SUB_SysInfoType15_7,
+    'systemInfoType15-8': GSMTAP_RRC_SUB_SysInfoType15_8,
+    'systemInfoType19': GSMTAP_RRC_SUB_SysInfoType19,
+    'systemInfoType15-2ter': GSMTAP_RRC_SUB_SysInfoType15_2ter,
+    'systemInfoType20': GSMTAP_RRC_SUB_SysInfoType20,
+    'systemInfoType21': GSMTAP_RRC_SUB_SysInfoType21,
+    'systemInfoType22': GSMTAP_RRC_SUB_SysInfoType22
+}
 
 """
     This module registers various diag LOG events, and tries to generate a
@@ -38,23 +242,36 @@ from ..protocol.gsmtap import *
 
 class PcapDumper(DecodedSibsDumper):
     
-    def __init__(self, diag_input, pcap_file, reassemble_sibs, decrypt_nas, include_ip_traffic):
+    accepts_memoryviews = True # See BaseInput.dispatch_received_diag_packet
+    
+    # Whether records are written through a BufferedRecordWriter, batching
+    # these in memory (see "_buffered_writer.py")
+    
+    buffered_output = True
+    
+    """
+        :param flush_interval: See BufferedRecordWriter
+        :param fsync_interval: See BufferedRecordWriter
+    """
+    
+    def __init__(self, diag_input, pcap_file, reassemble_sibs, decrypt_nas, include_ip_traffic,
+        flush_interval = None, fsync_interval = None):
+        
+        if self.buffered_output:
+            
+            pcap_file = BufferedRecordWriter(pcap_file, flush_interval, fsync_interval = fsync_interval)
         
         self.pcap_file = pcap_file
         
+        self.pcap_records = PcapRecordBuilder() # Records not yet written
+        
         """
             Write a PCAP file header - https://wiki.wireshark.org/Development/LibpcapFileFormat#File_Format
         """
         
         if not self.pcap_file.appending_to_file:
             
-            self.pcap_file.write(pack('<IHHi4xII',
-                0xa1b2c3d4, # PCAP Magic
-                2, 4, # Version
-                0, # Timezone
-                65535, # Max packet length
-                228 # LINKTYPE_IPV4 (for GSMTAP)
-            ))
+            self.pcap_file.write(PCAP_FILE_HEADER)
         
         self.diag_input = diag_input
         
@@ -71,7 +288,8 @@ class PcapDumper(DecodedSibsDumper):
         
         self.install_wireshark_plugin()
     
-    def install_wireshark_plugin(self): # WIP
+    @staticmethod
+    def install_wireshark_plugin(): # WIP
         
         # See: https://www.wireshark.org/docs/wsug_html_chunked/ChPluginFolders.html
         # See: https://docs.python.org/3/library/os.path.html#os.path.expandvars
@@ -102,7 +320,7 @@ class PcapDumper(DecodedSibsDumper):
         
         except OSError:
             return # Could not create or write to the Wireshark plug-in directory, non-fatal
-        
+    
     
     """
         Process a single log packet containing raw signalling or data traffic,
@@ -111,13 +329,11 @@ class PcapDumper(DecodedSibsDumper):
     
     def on_log(self, log_type, log_payload, log_header, timestamp = 0):
         
-        packet = None
-        
         if log_type == WCDMA_SIGNALLING_MESSAGE: # 0x412f
             
             self.current_rat = '3g'
             
-            (channel_type, radio_bearer, length), signalling_message = unpack('<BBH', log_payload[:4]), log_payload[4:]
+            (channel_type, radio_bearer, length), signalling_message = WCDMA_SIGNALLING_HEADER.unpack_from(log_payload), log_payload[WCDMA_SIGNALLING_HEADER.size:]
             
             is_uplink = channel_type in (
                 RRCLOG_SIG_UL_CCCH,
@@ -140,30 +356,20 @@ class PcapDumper(DecodedSibsDumper):
             
             packet = signalling_message[:length]
             
-            gsmtap_channel_type = {
-                RRCLOG_SIG_UL_CCCH: GSMTAP_RRC_SUB_UL_CCCH_Message,
-                RRCLOG_SIG_UL_DCCH: GSMTAP_RRC_SUB_UL_DCCH_Message,
-                RRCLOG_SIG_DL_CCCH: GSMTAP_RRC_SUB_DL_CCCH_Message,
-                RRCLOG_SIG_DL_DCCH: GSMTAP_RRC_SUB_DL_DCCH_Message,
-                RRCLOG_SIG_DL_BCCH_BCH: GSMTAP_RRC_SUB_BCCH_BCH_Message,
-                RRCLOG_SIG_DL_BCCH_FACH: GSMTAP_RRC_SUB_BCCH_FACH_Message,
-                RRCLOG_SIG_DL_PCCH: GSMTAP_RRC_SUB_PCCH_Message,
-                RRCLOG_SIG_DL_MCCH: GSMTAP_RRC_SUB_MCCH_Message,
-                RRCLOG_SIG_DL_MSCH: GSMTAP_RRC_SUB_MSCH_Message
-            }.get(channel_type)
+            gsmtap_channel_type = WCDMA_RRC_CHANNEL_TYPES.get(channel_type)
             
             if gsmtap_channel_type is None:
                 
                 warning('Unknown log type received for WCDMA_SIGNALLING_MESSAGE: %d' % channel_type)
                 return
             
-            packet = build_gsmtap_ip(GSMTAP_TYPE_UMTS_RRC, gsmtap_channel_type, packet, is_uplink)
+            self.pcap_records.append_gsmtap(timestamp, GSMTAP_TYPE_UMTS_RRC, gsmtap_channel_type, packet, is_uplink)
         
         elif log_type == LOG_GSM_RR_SIGNALING_MESSAGE_C: # 0x512f
             
             self.current_rat = '2g'
             
-            (channel_type, message_type, length), signalling_message = unpack('<BBB', log_payload[:3]), log_payload[3:]
+            (channel_type, message_type, length), signalling_message = GSM_RR_SIGNALLING_HEADER.unpack_from(log_payload), log_payload[GSM_RR_SIGNALLING_HEADER.size:]
             
             packet = signalling_message[:length]
             
@@ -173,17 +379,7 @@ class PcapDumper(DecodedSibsDumper):
             # - https://github.com/wireshark/wireshark/blob/wireshark-2.5.0/epan/dissectors/packet-gsmtap.h
             # - http://osmocom.org/projects/baseband/wiki/GSMTAP
             
-            gsmtap_channel_type = {
-                DCCH: GSMTAP_CHANNEL_SDCCH,
-                BCCH: GSMTAP_CHANNEL_BCCH,
-                L2_RACH: GSMTAP_CHANNEL_RACH,
-                CCCH: GSMTAP_CHANNEL_CCCH,
-                SACCH: GSMTAP_CHANNEL_SDCCH | GSMTAP_CHANNEL_ACCH,
-                SDCCH: GSMTAP_CHANNEL_SDCCH,
-                FACCH_F: GSMTAP_CHANNEL_TCH_F | GSMTAP_CHANNEL_ACCH,
-                FACCH_H: GSMTAP_CHANNEL_TCH_F | GSMTAP_CHANNEL_ACCH,
-                L2_RACH_WITH_NO_DELAY: GSMTAP_CHANNEL_RACH
-            }.get(channel_type & 0x7f)
+            gsmtap_channel_type = GSM_RR_CHANNEL_TYPES.get(channel_type & 0x7f)
             
             if gsmtap_channel_type is None:
                 
@@ -203,11 +399,11 @@ class PcapDumper(DecodedSibsDumper):
                 
                 packet = packet[1:]
             
-            packet = build_gsmtap_ip(interface_type, gsmtap_channel_type, packet, is_uplink)
+            self.pcap_records.append_gsmtap(timestamp, interface_type, gsmtap_channel_type, packet, is_uplink)
         
         elif log_type == LOG_GPRS_MAC_SIGNALLING_MESSAGE_C: # 0x5226
             
-            (channel_type, message_type, length), signalling_message = unpack('<BBB', log_payload[:3]), log_payload[3:]
+            (channel_type, message_type, length), signalling_message = GPRS_MAC_SIGNALLING_HEADER.unpack_from(log_payload), log_payload[GPRS_MAC_SIGNALLING_HEADER.size:]
             
             if message_type == PACKET_CHANNEL_REQUEST:
                 return # "Internal use", discard
@@ -222,18 +418,14 @@ class PcapDumper(DecodedSibsDumper):
             if channel_type == 255:
                 return
             
-            gsmtap_channel_type = {
-                PACCH_RRBP_CHANNEL: GSMTAP_CHANNEL_PACCH,
-                UL_PACCH_CHANNEL: GSMTAP_CHANNEL_PACCH,
-                DL_PACCH_CHANNEL: GSMTAP_CHANNEL_PACCH
-            }.get(channel_type)
+            gsmtap_channel_type = GPRS_MAC_CHANNEL_TYPES.get(channel_type)
             
             if gsmtap_channel_type is None:
                 
                 warning('Unknown log type received for LOG_GPRS_MAC_SIGNALLING_MESSAGE_C: %d' % channel_type)
                 return
             
-            packet = build_gsmtap_ip(GSMTAP_TYPE_UM, gsmtap_channel_type, packet, is_uplink)
+            self.pcap_records.append_gsmtap(timestamp, GSMTAP_TYPE_UM, gsmtap_channel_type, packet, is_uplink)
         
         elif log_type == LOG_LTE_RRC_OTA_MSG_LOG_C: # 0xb0c0
             
@@ -245,22 +437,22 @@ class PcapDumper(DecodedSibsDumper):
             
             # Parse base header
             
-            (ext_header_ver, rrc_rel, rrc_ver, bearer_id, phy_cellid), ext_header = unpack('<BBBBH', log_payload[:6]), log_payload[6:]
+            (ext_header_ver, rrc_rel, rrc_ver, bearer_id, phy_cellid), ext_header = LTE_RRC_OTA_HEADER.unpack_from(log_payload), log_payload[LTE_RRC_OTA_HEADER.size:]
             
             if ext_header_ver >= 25: # Handle post-NR releases
-                (ext_header_ver, rrc_rel, rrc_ver, nc_rrc_rel, bearer_id, phy_cellid), ext_header = unpack('<BBBHBH', log_payload[:8]), log_payload[8:]
+                (ext_header_ver, rrc_rel, rrc_ver, nc_rrc_rel, bearer_id, phy_cellid), ext_header = LTE_RRC_OTA_HEADER_V25.unpack_from(log_payload), log_payload[LTE_RRC_OTA_HEADER_V25.size:]
             
             # Parse extended header
             
-            freq_type = 'H' if ext_header_ver < 8 else 'I'
+            is_32bit_freq = ext_header_ver >= 8
             
-            header_spec = '<' + freq_type + 'HBH'
+            ext_header_struct = LTE_RRC_OTA_EXT_HEADERS[is_32bit_freq, False]
             
-            if unpack_from('<H', ext_header, calcsize(header_spec) - 2)[0] != len(ext_header) - calcsize(header_spec): # SIB mask is present
+            if ext_header_struct.unpack_from(ext_header)[-1] != len(ext_header) - ext_header_struct.size: # SIB mask is present
                 
-                header_spec = '<' + freq_type + 'HB4xH'
+                ext_header_struct = LTE_RRC_OTA_EXT_HEADERS[is_32bit_freq, True]
             
-            (freq, sfn, channel_type, length), packet = unpack_from(header_spec, ext_header), ext_header[calcsize(header_spec):]
+            (freq, sfn, channel_type, length), packet = ext_header_struct.unpack_from(ext_header), ext_header[ext_header_struct.size:]
             
             # GSMTAP definition:
             # - https://github.com/wireshark/wireshark/blob/wireshark-2.5.0/epan/dissectors/packet-gsmtap.h
@@ -271,84 +463,11 @@ class PcapDumper(DecodedSibsDumper):
             
             if LTE_UL_DCCH_NB < channel_type <= LTE_UL_DCCH_NB + 9:
                 channel_type -= 9
-
             
-            # See here for LTE channel constants (they heavily depend on baseband
-            # versions): https://github.com/fgsect/scat/blob/01d5b81/parsers/qualcomm/diagltelogparser.py#L1207
-            
-            channel_lookup_table = {
-                LTE_BCCH_BCH_NB: GSMTAP_LTE_RRC_SUB_BCCH_BCH_Message_NB,
-                LTE_BCCH_DL_SCH_NB: GSMTAP_LTE_RRC_SUB_BCCH_DL_SCH_Message_NB,
-                LTE_PCCH_NB: GSMTAP_LTE_RRC_SUB_PCCH_Message_NB,
-                LTE_DL_CCCH_NB: GSMTAP_LTE_RRC_SUB_DL_CCCH_Message_NB,
-                LTE_DL_DCCH_NB: GSMTAP_LTE_RRC_SUB_DL_DCCH_Message_NB,
-                LTE_UL_CCCH_NB: GSMTAP_LTE_RRC_SUB_UL_CCCH_Message_NB,
-                LTE_UL_DCCH_NB: GSMTAP_LTE_RRC_SUB_UL_DCCH_Message_NB,
-            }
-            
-            # The v9 channel type values don't overlap a lot with other
-            # existing values as they start at "8", so handle these in
-            # all case and allow these to be erased with other values
-            # subsequently
-                        
-            channel_lookup_table.update({
-                LTE_BCCH_BCH_v9: GSMTAP_LTE_RRC_SUB_BCCH_BCH_Message,
-                LTE_BCCH_DL_SCH_v9: GSMTAP_LTE_RRC_SUB_BCCH_DL_SCH_Message,
-                LTE_MCCH_v9: GSMTAP_LTE_RRC_SUB_MCCH_Message,
-                LTE_PCCH_v9: GSMTAP_LTE_RRC_SUB_PCCH_Message,
-                LTE_DL_CCCH_v9: GSMTAP_LTE_RRC_SUB_DL_CCCH_Message,
-                LTE_DL_DCCH_v9: GSMTAP_LTE_RRC_SUB_DL_DCCH_Message,
-                LTE_UL_CCCH_v9: GSMTAP_LTE_RRC_SUB_UL_CCCH_Message,
-                LTE_UL_DCCH_v9: GSMTAP_LTE_RRC_SUB_UL_DCCH_Message,
-            })
-        
-            if ext_header_ver in (14, 15, 16, 20, 24, 25):
-
-                channel_lookup_table.update({
-                    LTE_BCCH_BCH_v14: GSMTAP_LTE_RRC_SUB_BCCH_BCH_Message,
-                    LTE_BCCH_DL_SCH_v14: GSMTAP_LTE_RRC_SUB_BCCH_DL_SCH_Message,
-                    LTE_MCCH_v14: GSMTAP_LTE_RRC_SUB_MCCH_Message,
-                    LTE_PCCH_v14: GSMTAP_LTE_RRC_SUB_PCCH_Message,
-                    LTE_DL_CCCH_v14: GSMTAP_LTE_RRC_SUB_DL_CCCH_Message,
-                    LTE_DL_DCCH_v14: GSMTAP_LTE_RRC_SUB_DL_DCCH_Message,
-                    LTE_UL_CCCH_v14: GSMTAP_LTE_RRC_SUB_UL_CCCH_Message,
-                    LTE_UL_DCCH_v14: GSMTAP_LTE_RRC_SUB_UL_DCCH_Message,
-                })
-            
-            elif ext_header_ver == 19 or ext_header_ver >= 26:
-                
-                channel_lookup_table.update({
-                    LTE_BCCH_BCH_v19: GSMTAP_LTE_RRC_SUB_BCCH_BCH_Message,
-                    LTE_BCCH_DL_SCH_v19: GSMTAP_LTE_RRC_SUB_BCCH_DL_SCH_Message,
-                    LTE_MCCH_v19: GSMTAP_LTE_RRC_SUB_MCCH_Message,
-                    LTE_PCCH_v19: GSMTAP_LTE_RRC_SUB_PCCH_Message,
-                    LTE_DL_CCCH_v19: GSMTAP_LTE_RRC_SUB_DL_CCCH_Message,
-                    LTE_DL_DCCH_v19: GSMTAP_LTE_RRC_SUB_DL_DCCH_Message,
-                    LTE_UL_CCCH_v19: GSMTAP_LTE_RRC_SUB_UL_CCCH_Message,
-                    LTE_UL_DCCH_v19: GSMTAP_LTE_RRC_SUB_UL_DCCH_Message,
-                })
-
-            elif ext_header_ver not in (9, 12):
-            
-                channel_lookup_table.update({
-                    LTE_BCCH_BCH_v0: GSMTAP_LTE_RRC_SUB_BCCH_BCH_Message,
-                    LTE_BCCH_DL_SCH_v0: GSMTAP_LTE_RRC_SUB_BCCH_DL_SCH_Message,
-                    LTE_MCCH_v0: GSMTAP_LTE_RRC_SUB_MCCH_Message,
-                    LTE_PCCH_v0: GSMTAP_LTE_RRC_SUB_PCCH_Message,
-                    LTE_DL_CCCH_v0: GSMTAP_LTE_RRC_SUB_DL_CCCH_Message,
-                    LTE_DL_DCCH_v0: GSMTAP_LTE_RRC_SUB_DL_DCCH_Message,
-                    LTE_UL_CCCH_v0: GSMTAP_LTE_RRC_SUB_UL_CCCH_Message,
-                    LTE_UL_DCCH_v0: GSMTAP_LTE_RRC_SUB_UL_DCCH_Message,
-                })
-                
-            gsmtap_channel_type = channel_lookup_table.get(channel_type)
             
-            is_uplink = gsmtap_channel_type in (
-                GSMTAP_LTE_RRC_SUB_UL_CCCH_Message,
-                GSMTAP_LTE_RRC_SUB_UL_DCCH_Message,
-                GSMTAP_LTE_RRC_SUB_UL_CCCH_Message_NB,
-                GSMTAP_LTE_RRC_SUB_UL_DCCH_Message_NB,
-            )
+            gsmtap_channel_type = get_lte_rrc_channel_lookup_table(ext_header_ver).get(channel_type)
+            
+            is_uplink = gsmtap_channel_type in LTE_RRC_UPLINK_CHANNEL_TYPES
             
             if gsmtap_channel_type is None:
                 
@@ -356,7 +475,7 @@ class PcapDumper(DecodedSibsDumper):
                     ext_header_ver, channel_type))
                 return
             
-            packet = build_gsmtap_ip(GSMTAP_TYPE_LTE_RRC, gsmtap_channel_type, packet, is_uplink)
+            self.pcap_records.append_gsmtap(timestamp, GSMTAP_TYPE_LTE_RRC, gsmtap_channel_type, packet, is_uplink)
         
         elif self.decrypt_nas and log_type in (
             LOG_LTE_NAS_ESM_OTA_IN_MSG_LOG_C,
@@ -367,15 +486,19 @@ class PcapDumper(DecodedSibsDumper):
             
             # Header source: https://github.com/mobile-insight/mobileinsight-core/blob/v3.2.0/dm_collector_c/log_packet.h#L274
             
-            (ext_header_ver, rrc_rel, rrc_ver_minor, rrc_ver_major), signalling_message = unpack('<BBBB', log_payload[:4]), log_payload[4:]
+            (ext_header_ver, rrc_rel, rrc_ver_minor, rrc_ver_major), signalling_message = LTE_NAS_OTA_HEADER.unpack_from(log_payload), log_payload[LTE_NAS_OTA_HEADER.size:]
             
             is_uplink = log_type in (LOG_LTE_NAS_ESM_OTA_OUT_MSG_LOG_C, LOG_LTE_NAS_EMM_OTA_OUT_MSG_LOG_C)
             
-            packet = build_gsmtap_ip(GSMTAP_TYPE_LTE_NAS, GSMTAP_LTE_NAS_PLAIN, signalling_message, is_uplink)
+            self.pcap_records.append_gsmtap(timestamp, GSMTAP_TYPE_LTE_NAS, GSMTAP_LTE_NAS_PLAIN, signalling_message, is_uplink)
         
         elif self.include_ip_traffic and log_type == LOG_DATA_PROTOCOL_LOGGING_C: # 0x11eb - IPv4 user-plane data
             
             packet = log_payload[8:]
+            
+            if packet:
+                
+                self.pcap_records.append_ip(timestamp, packet)
         
         elif log_type == LOG_UMTS_NAS_OTA_MESSAGE_LOG_PACKET_C: # 0x713a - 2G/3G DTAP from NAS
             
@@ -385,41 +508,45 @@ class PcapDumper(DecodedSibsDumper):
             
             # Header source: https://github.com/mobile-insight/mobileinsight-core/blob/v3.2.0/dm_collector_c/log_packet.h#L274
             
-            (is_uplink, length), signalling_message = unpack('<BI', log_payload[:5]), log_payload[5:]
+            (is_uplink, length), signalling_message = UMTS_NAS_OTA_HEADER.unpack_from(log_payload), log_payload[UMTS_NAS_OTA_HEADER.size:]
             
             packet = signalling_message[:length]
             
             is_uplink = bool(is_uplink)
             
-            packet = build_gsmtap_ip(GSMTAP_TYPE_ABIS, GSMTAP_CHANNEL_SDCCH, signalling_message, is_uplink)
+            self.pcap_records.append_gsmtap(timestamp, GSMTAP_TYPE_ABIS, GSMTAP_CHANNEL_SDCCH, signalling_message, is_uplink)
         
         elif log_type == LOG_NR_RRC_OTA_MSG_LOG_C: # LOG_NR_RRC_OTA_MSG_LOG_C = 0xb821
             
             # WIP
             
             self.current_rat = '5g'
-        
-            packet = build_nr_rrc_log_ip(log_payload)
             
-        if packet:
+            self.pcap_records.append_nr_rrc_log(timestamp, log_payload)
+        
+        # Also write a reassembled 3G SIB if present
+        
+        if self.reassemble_sibs:
+            DecodedSibsDumper.on_log(self, log_type, log_payload, log_header, timestamp)
+        
+        self.write_records()
+    
+    """
+        Write the PCAP records built while processing a log packet (the
+        packet itself, and possibly reassembled SIBs) with a single call.
+    """
+    
+    def write_records(self):
+        
+        if self.pcap_records:
             
             try:
                 
-                self.pcap_file.write(pack('<IIII',
-                    int(timestamp),
-                    int((timestamp * 1000000) % 1000000),
-                    len(packet),
-                    len(packet)
-                ) + packet)
+                self.pcap_records.write_to(self.pcap_file)
             
             except BrokenPipeError:
                 
                 self.diag_input.remove_module(self)
-        
-        # Also write a reassembled 3G SIB if present
-        
-        if self.reassemble_sibs:
-            DecodedSibsDumper.on_log(self, log_type, log_payload, log_header, timestamp)
     
     """
         Callback to the be called by the inherited "DecodedSibsDumper" class
@@ -436,67 +563,12 @@ class PcapDumper(DecodedSibsDumper):
         
         is_uplink = False
         
-        gsmtap_channel_type = {
-            'masterInformationBlock': GSMTAP_RRC_SUB_MasterInformationBlock,
-            'systemInformationBlockType1': GSMTAP_RRC_SUB_SysInfoType1,
-            'systemInformationBlockType2': GSMTAP_RRC_SUB_SysInfoType2,
-            'systemInformationBlockType3': GSMTAP_RRC_SUB_SysInfoType3,
-            'systemInformationBlockType4': GSMTAP_RRC_SUB_SysInfoType4,
-            'systemInformationBlockType5': GSMTAP_RRC_SUB_SysInfoType5,
-            'systemInformationBlockType6': GSMTAP_RRC_SUB_SysInfoType6,
-            'systemInformationBlockType7': GSMTAP_RRC_SUB_SysInfoType7,
-            'systemInformationBlockType11': GSMTAP_RRC_SUB_SysInfoType11,
-            'systemInformationBlockType12': GSMTAP_RRC_SUB_SysInfoType12,
-            'systemInformationBlockType13': GSMTAP_RRC_SUB_SysInfoType13,
-            'systemInformationBlockType13-1': GSMTAP_RRC_SUB_SysInfoType13_1,
-            'systemInformationBlockType13-2': GSMTAP_RRC_SUB_SysInfoType13_2,
-            'systemInformationBlockType13-3': GSMTAP_RRC_SUB_SysInfoType13_3,
-            'systemInformationBlockType13-4': GSMTAP_RRC_SUB_SysInfoType13_4,
-            'systemInformationBlockType14': GSMTAP_RRC_SUB_SysInfoType14,
-            'systemInformationBlockType15': GSMTAP_RRC_SUB_SysInfoType15,
-            'systemInformationBlockType15-1': GSMTAP_RRC_SUB_SysInfoType15_1,
-            'systemInformationBlockType15-2': GSMTAP_RRC_SUB_SysInfoType15_2,
-            'systemInformationBlockType15-3': GSMTAP_RRC_SUB_SysInfoType15_3,
-            'systemInformationBlockType16': GSMTAP_RRC_SUB_SysInfoType16,
-            'systemInformationBlockType17': GSMTAP_RRC_SUB_SysInfoType17,
-            'systemInformationBlockType15-4': GSMTAP_RRC_SUB_SysInfoType15_4,
-            'systemInformationBlockType18': GSMTAP_RRC_SUB_SysInfoType18,
-            'schedulingBlock1': GSMTAP_RRC_SUB_SysInfoTypeSB1,
-            'schedulingBlock2': GSMTAP_RRC_SUB_SysInfoTypeSB2,
-            'systemInformationBlockType15-5': GSMTAP_RRC_SUB_SysInfoType15_5,
-            'systemInformationBlockType5bis': GSMTAP_RRC_SUB_SysInfoType5bis,
-            'systemInfoType11bis': GSMTAP_RRC_SUB_SysInfoType11bis,
-            'systemInfoType15bis': GSMTAP_RRC_SUB_SysInfoType15bis,
-            'systemInfoType15-1bis': GSMTAP_RRC_SUB_SysInfoType15_1bis,
-            'systemInfoType15-2bis': GSMTAP_RRC_SUB_SysInfoType15_2bis,
-            'systemInfoType15-3bis': GSMTAP_RRC_SUB_SysInfoType15_3bis,
-            'systemInfoType15-6': GSMTAP_RRC_SUB_SysInfoType15_6,
-            'systemInfoType15-7': GSMTAP_RRC_SUB_SysInfoType15_7,
-            'systemInfoType15-8': GSMTAP_RRC_SUB_SysInfoType15_8,
-            'systemInfoType19': GSMTAP_RRC_SUB_SysInfoType19,
-            'systemInfoType15-2ter': GSMTAP_RRC_SUB_SysInfoType15_2ter,
-            'systemInfoType20': GSMTAP_RRC_SUB_SysInfoType20,
-            'systemInfoType21': GSMTAP_RRC_SUB_SysInfoType21,
-            'systemInfoType22': GSMTAP_RRC_SUB_SysInfoType22
-        }[sib_type]
-            
-        packet = build_gsmtap_ip(GSMTAP_TYPE_UMTS_RRC, gsmtap_channel_type, packet, is_uplink)
-        
-        assert len(packet) <= 65535
-        
-        try:
+        gsmtap_channel_type = SIB_TYPE_TO_GSMTAP_CHANNEL_TYPE[sib_type]
         
-            self.pcap_file.write(pack('<IIII',
-                int(timestamp),
-                int((timestamp * 1000000) % 1000000),
-                len(packet),
-                len(packet)
-            ) + packet)
+        assert GSMTAP_IP_HEADERS_SIZE + len(packet) <= 65535
         
-        except BrokenPipeError:
-            
-            self.diag_input.remove_module(self)
-
+        self.pcap_records.append_gsmtap(timestamp, GSMTAP_TYPE_UMTS_RRC, gsmtap_channel_type, packet, is_uplink)
+    
     def on_sib_decoding_error(self, decoding_error):
         
         pass
@@ -513,8 +585,8 @@ class PcapDumper(DecodedSibsDumper):
 """
 
 class WiresharkLive(PcapDumper):
-
-    def __init__(self, diag_input, reassemble_sibs, decrypt_nas, include_ip_traffic):
+    
+    def __init__(self, diag_input, reassemble_sibs, decrypt_nas, include_ip_traffic, flush_interval = None):
         
         wireshark = (
             which('C:\\Program Files\\Wireshark\\Wireshark.exe') or
@@ -539,7 +611,10 @@ class WiresharkLive(PcapDumper):
         
         wireshark_pipe.appending_to_file = False
         
-        super().__init__(diag_input, wireshark_pipe, reassemble_sibs, decrypt_nas, include_ip_traffic)
+        # Unless specified, records are written to the pipe within
+        # LOW_LATENCY_FLUSH_INTERVAL, see BufferedRecordWriter
+        
+        super().__init__(diag_input, wireshark_pipe, reassemble_sibs, decrypt_nas, include_ip_traffic, flush_interval)
     
     """
         Executed when we launch a Wireshark process, after fork()
@@ -560,9 +635,9 @@ class WiresharkLive(PcapDumper):
             if uid and gid:
                 
                 uid, gid = int(uid), int(gid)
-
+                
                 setgroups(getgrouplist(getpwuid(uid).pw_name, gid))
-
+                
                 setresgid(gid, gid, -1)
                 
                 setresuid(uid, uid, -1)
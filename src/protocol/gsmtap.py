@@ -1,5 +1,7 @@
 #!/usr/bin/python3
-from struct import pack, unpack
+from struct import Struct
+
+from .headers import GSMTAP_HEADER, UDP_HEADER, IPV4_HEADER, PCAP_RECORD_HEADER
 
 # GSMTAP definition:
 # - https://github.com/wireshark/wireshark/blob/wireshark-2.5.0/epan/dissectors/packet-gsmtap.h
@@ -9,66 +11,243 @@ from struct import pack, unpack
 GSMTAP_PORT = 4729
 NR_RRC_UDP_PORT = 47928
 
-def build_gsmtap_ip(gsmtap_protocol, gsmtap_channel_type, payload, is_uplink):
-    
-    packet = pack('>BBBxHxx4xBxxx',
-        2, # GSMTAP version
-        4, # Header words
-        gsmtap_protocol,
-        int(is_uplink) << 14,
-        gsmtap_channel_type
-    ) + payload
+# IPv4 and UDP headers, then IPv4, UDP and GSMTAP headers, each packed with
+# a single pack_into() call into a buffer (the IPv4 addresses are left as
+# zero padding, i.e. 0.0.0.0)
+
+IP_UDP_HEADERS = Struct(IPV4_HEADER.format.replace('4s4s', '8x') + UDP_HEADER.format[1:])
+GSMTAP_IP_HEADERS = Struct(IP_UDP_HEADERS.format + GSMTAP_HEADER.format[1:])
+
+IP_UDP_HEADERS_SIZE = IP_UDP_HEADERS.size
+GSMTAP_IP_HEADERS_SIZE = GSMTAP_IP_HEADERS.size
+
+"""
+    Write an IPv4/UDP/GSMTAP packet into a buffer, which should have room for
+    GSMTAP_IP_HEADERS_SIZE + len(payload) bytes from the offset.
     
-    # UDP:
+    :param buffer: A writable bytes-like object (bytearray)
+    :param offset: Offset of the packet within the buffer
     
-    packet = pack('>HHHH',
-        GSMTAP_PORT, # From GSMTAP UDP port
-        GSMTAP_PORT, # To GSMTAP UDP port
-        len(packet) + 8, # Total length
-        0 # Ignore checksum
-    ) + packet
+    :returns The offset following the packet
+"""
+
+def pack_gsmtap_ip_into(buffer, offset : int, gsmtap_protocol, gsmtap_channel_type, payload, is_uplink) -> int:
     
-    # IP:
+    end_offset = offset + GSMTAP_IP_HEADERS_SIZE + len(payload)
     
-    return pack('>BBHHHBBH8B',
+    GSMTAP_IP_HEADERS.pack_into(buffer, offset,
+        
+        # IP:
+        
         (4 << 4) | 5, # IPv4 version and header words
         0, # DSCP
-        len(packet) + 20, # Total length
+        end_offset - offset, # Total length
         0, # Identification
         0, # Fragment offset
         64, # Time to live
         17, # Protocol: UDP
         0, # Ignore checksum
-        0,0,0,0, # From 0.0.0.0
-        0,0,0,0, # To 0.0.0.0
-    ) + packet
-
-def build_nr_rrc_log_ip(log_payload : bytes):
+        
+        # UDP:
+        
+        GSMTAP_PORT, # From GSMTAP UDP port
+        GSMTAP_PORT, # To GSMTAP UDP port
+        end_offset - offset - IPV4_HEADER.size, # Total length
+        0, # Ignore checksum
+        
+        # GSMTAP:
+        
+        2, # GSMTAP version
+        4, # Header words
+        gsmtap_protocol,
+        0x4000 if is_uplink else 0,
+        gsmtap_channel_type
+    )
+    
+    buffer[offset + GSMTAP_IP_HEADERS_SIZE:end_offset] = payload
+    
+    return end_offset
 
-    # UDP:
+"""
+    Write an IPv4/UDP packet carrying a 5G RRC log, decoded by the QCSuper
+    Wireshark plug-in, into a buffer, which should have room for
+    IP_UDP_HEADERS_SIZE + len(log_payload) bytes from the offset.
+    
+    :returns The offset following the packet
+"""
 
-    packet = pack('>HHHH',
-        NR_RRC_UDP_PORT, # From custom QCSuper plug-in UDP port
-        NR_RRC_UDP_PORT, # To custom QCSuper plug-in UDP port
-        len(log_payload) + 8, # Total length
-        0 # Ignore checksum
-    ) + log_payload
+def pack_nr_rrc_log_ip_into(buffer, offset : int, log_payload) -> int:
     
-    # IP:
+    end_offset = offset + IP_UDP_HEADERS_SIZE + len(log_payload)
     
-    return pack('>BBHHHBBH8B',
+    IP_UDP_HEADERS.pack_into(buffer, offset,
+        
+        # IP:
+        
         (4 << 4) | 5, # IPv4 version and header words
         0, # DSCP
-        len(packet) + 20, # Total length
+        end_offset - offset, # Total length
         0, # Identification
         0, # Fragment offset
         64, # Time to live
         17, # Protocol: UDP
         0, # Ignore checksum
-        0,0,0,0, # From 0.0.0.0
-        0,0,0,0, # To 0.0.0.0
-    ) + packet
+        
+        # UDP:
+        
+        NR_RRC_UDP_PORT, # From custom QCSuper plug-in UDP port
+        NR_RRC_UDP_PORT, # To custom QCSuper plug-in UDP port
+        end_offset - offset - IPV4_HEADER.size, # Total length
+        0 # Ignore checksum
+    )
+    
+    buffer[offset + IP_UDP_HEADERS_SIZE:end_offset] = log_payload
+    
+    return end_offset
+
+def build_gsmtap_ip(gsmtap_protocol, gsmtap_channel_type, payload, is_uplink) -> bytes:
+    
+    packet = bytearray(GSMTAP_IP_HEADERS_SIZE + len(payload))
+    
+    pack_gsmtap_ip_into(packet, 0, gsmtap_protocol, gsmtap_channel_type, payload, is_uplink)
+    
+    return bytes(packet)
 
+def build_nr_rrc_log_ip(log_payload : bytes) -> bytes:
+    
+    packet = bytearray(IP_UDP_HEADERS_SIZE + len(log_payload))
+    
+    pack_nr_rrc_log_ip_into(packet, 0, log_payload)
+    
+    return bytes(packet)
+
+"""
+    Accumulates PCAP records (record header, then IPv4 packet) into a single
+    reusable buffer, so that many records may be written to the PCAP file at
+    once. Headers are written in place with pack_into().
+    
+    The buffer keeps its allocation when records are written or discarded,
+    and only grows (doubling) when a batch doesn't fit.
+"""
+
+class PcapRecordBuilder:
+    
+    """
+        :param initial_size: Initial size of the buffer, in bytes
+    """
+    
+    def __init__(self, initial_size : int = 0x10000):
+        
+        self.buffer = bytearray(initial_size)
+        
+        self.length = 0 # Number of bytes used in the buffer
+    
+    def __len__(self):
+        
+        return self.length
+    
+    """
+        Grow the buffer so that it holds at least self.length bytes.
+    """
+    
+    def _grow(self):
+        
+        self.buffer.extend(bytes(max(self.length, 2 * len(self.buffer)) - len(self.buffer)))
+    
+    """
+        Reserve room for a record at the end of the buffer, and write its
+        PCAP record header.
+        
+        :param timestamp: UNIX timestamp of the record
+        :param packet_length: Size of the packet following the record header
+        
+        :returns The offset of the packet within the buffer
+    """
+    
+    def _add_record(self, timestamp : float, packet_length : int) -> int:
+        
+        offset = self.length
+        
+        self.length = offset + PCAP_RECORD_HEADER.size + packet_length
+        
+        if self.length > len(self.buffer):
+            
+            self._grow()
+        
+        PCAP_RECORD_HEADER.pack_into(self.buffer, offset,
+            int(timestamp),
+            int((timestamp * 1000000) % 1000000),
+            packet_length,
+            packet_length
+        )
+        
+        return offset + PCAP_RECORD_HEADER.size
+    
+    def append_gsmtap(self, timestamp : float, gsmtap_protocol, gsmtap_channel_type, payload, is_uplink):
+        
+        # Same as _add_record, inlined for the most frequent records
+        
+        offset = self.length
+        
+        packet_length = GSMTAP_IP_HEADERS_SIZE + len(payload)
+        
+        self.length = offset + PCAP_RECORD_HEADER.size + packet_length
+        
+        if self.length > len(self.buffer):
+            
+            self._grow()
+        
+        PCAP_RECORD_HEADER.pack_into(self.buffer, offset,
+            int(timestamp),
+            int((timestamp * 1000000) % 1000000),
+            packet_length,
+            packet_length
+        )
+        
+        pack_gsmtap_ip_into(self.buffer, offset + PCAP_RECORD_HEADER.size, gsmtap_protocol, gsmtap_channel_type, payload, is_uplink)
+    
+    def append_nr_rrc_log(self, timestamp : float, log_payload):
+        
+        offset = self._add_record(timestamp, IP_UDP_HEADERS_SIZE + len(log_payload))
+        
+        pack_nr_rrc_log_ip_into(self.buffer, offset, log_payload)
+    
+    """
+        :param packet: A raw IPv4 packet
+    """
+    
+    def append_ip(self, timestamp : float, packet):
+        
+        offset = self._add_record(timestamp, len(packet))
+        
+        self.buffer[offset:offset + len(packet)] = packet
+    
+    """
+        Discard the records appended after the given length.
+    """
+    
+    def truncate(self, length : int = 0):
+        
+        self.length = min(self.length, length)
+    
+    """
+        Write the pending records with a single call, then clear them (even
+        if the write failed, e.g. with a BrokenPipeError).
+        
+        :param file: A file object opened in binary mode
+    """
+    
+    def write_to(self, file):
+        
+        try:
+            
+            with memoryview(self.buffer) as buffer_view, buffer_view[:self.length] as records:
+                
+                file.write(records)
+        
+        finally:
+            
+            self.length = 0
 
 
 GSMTAP_TYPE_UM = 0x01
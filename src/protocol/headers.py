@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from collections import namedtuple
+from struct import Struct
+
+"""
+    This file defines the binary headers of the Diag protocol, of the logs it
+    carries, and of the GSMTAP, PCAP and EFS2 formats, once, as precompiled
+    structures (struct.Struct), so that parsing doesn't have to interpret a
+    format string for each packet.
+    
+    Each header exposes the methods of its structure (size, pack, pack_into,
+    unpack, unpack_from, iter_unpack) for the hot paths, and parse(), which
+    returns a lightweight record view (a named tuple) with named fields.
+"""
+
+class Header:
+    
+    """
+        :param name: Name of the record view type
+        :param format: Format of the header, as for the struct module
+        :param fields: Space-separated names of the fields of the header
+    """
+    
+    def __init__(self, name : str, format : str, fields : str):
+        
+        self.struct = Struct(format)
+        
+        self.record = namedtuple(name, fields)
+        
+        assert len(self.record._fields) == len(self.struct.unpack(bytes(self.struct.size)))
+        
+        # Bound methods of the precompiled structure, copied for not paying
+        # an additional call
+        
+        self.format = self.struct.format
+        self.size = self.struct.size
+        self.pack = self.struct.pack
+        self.pack_into = self.struct.pack_into
+        self.unpack = self.struct.unpack
+        self.unpack_from = self.struct.unpack_from
+        self.iter_unpack = self.struct.iter_unpack
+    
+    """
+        :param data: A bytes-like object containing the header
+        :param offset: Offset of the header within data
+        
+        :returns A record view (named tuple) of the header fields
+    """
+    
+    def parse(self, data, offset : int = 0):
+        
+        return self.record._make(self.unpack_from(data, offset))
+
+"""
+    Diag headers (following the opcode byte)
+"""
+
+DIAG_SUBSYS_HEADER = Header('DiagSubsysHeader', '<BH', 'subsystem_id subcommand_code')
+
+DIAG_PEEK_HEADER = Header('DiagPeekHeader', '<IH', 'address num_units')
+
+DIAG_LOG_CONFIG_HEADER = Header('DiagLogConfigHeader', '<3xII', 'operation status')
+
+DIAG_EXT_BUILD_ID_HEADER = Header('DiagExtBuildIdHeader', '<B2xII', 'msm_hw_version_format msm_hw_version mobile_model_id')
+
+# DIAG_LOG_F, followed by a log header
+
+DIAG_LOG_OUTER_HEADER = Header('DiagLogOuterHeader', '<BH', 'pending_msgs log_outer_length')
+
+# Log header, as also found in DLF files
+
+LOG_HEADER = Header('LogHeader', '<HHQ', 'log_length log_code log_time')
+
+"""
+    Headers of the logs carrying signalling messages, see "pcap_dump.py"
+"""
+
+WCDMA_SIGNALLING_HEADER = Header('WcdmaSignallingHeader', '<BBH', 'channel_type radio_bearer length')
+
+GSM_RR_SIGNALLING_HEADER = Header('GsmRrSignallingHeader', '<BBB', 'channel_type message_type length')
+
+GPRS_MAC_SIGNALLING_HEADER = GSM_RR_SIGNALLING_HEADER
+
+LTE_RRC_OTA_HEADER = Header('LteRrcOtaHeader', '<BBBBH', 'ext_header_ver rrc_rel rrc_ver bearer_id phy_cellid')
+
+LTE_RRC_OTA_HEADER_V25 = Header('LteRrcOtaHeaderV25', '<BBBHBH', 'ext_header_ver rrc_rel rrc_ver nc_rrc_rel bearer_id phy_cellid')
+
+# Extended header following the above one: {(whether the frequency is 32-bit,
+# whether a SIB mask is present): header}
+
+LTE_RRC_OTA_EXT_HEADERS = {
+    (is_32bit_freq, has_sib_mask): Header('LteRrcOtaExtHeader',
+        '<' + ('I' if is_32bit_freq else 'H') + ('HB4xH' if has_sib_mask else 'HBH'),
+        'freq sfn channel_type length')
+    for is_32bit_freq in (False, True)
+    for has_sib_mask in (False, True)
+}
+
+LTE_NAS_OTA_HEADER = Header('LteNasOtaHeader', '<BBBB', 'ext_header_ver rrc_rel rrc_ver_minor rrc_ver_major')
+
+UMTS_NAS_OTA_HEADER = Header('UmtsNasOtaHeader', '<BI', 'is_uplink length')
+
+"""
+    PCAP record header - https://wiki.wireshark.org/Development/LibpcapFileFormat#Record_.28Packet.29_Header
+"""
+
+PCAP_RECORD_HEADER = Header('PcapRecordHeader', '<IIII', 'timestamp_sec timestamp_usec included_length original_length')
+
+"""
+    GSMTAP, UDP and IPv4 headers, see "gsmtap.py"
+"""
+
+GSMTAP_HEADER = Header('GsmtapHeader', '>BBBxHxx4xBxxx', 'version header_words type arfcn sub_type')
+
+UDP_HEADER = Header('UdpHeader', '>HHHH', 'source_port destination_port length checksum')
+
+IPV4_HEADER = Header('Ipv4Header', '>BBHHHBBH4s4s', 'version_ihl dscp total_length identification ' +
+    'fragment_offset ttl protocol checksum source destination')
+
+"""
+    EFS2 subsystem command responses (following the DIAG_SUBSYS_CMD_F opcode
+    byte), see "efs2.py"
+"""
+
+EFS2_HELLO_PARAMETERS = Header('Efs2HelloParameters', '<BH6I3II', 'subsystem_id subcommand_code ' +
+    'targ_pkt_window targ_byte_window host_pkt_window host_byte_window iter_pkt_window iter_byte_window ' +
+    'version min_version max_version feature_bits') # Request and response
+
+EFS2_RESPONSE_HEADER = Header('Efs2ResponseHeader', '<BHi', 'subsystem_id subcommand_code errno')
+
+EFS2_OPEN_RESPONSE = Header('Efs2OpenResponse', '<BHIi', 'subsystem_id subcommand_code fd errno')
+
+EFS2_READ_RESPONSE = Header('Efs2ReadResponse', '<BHiIii', 'subsystem_id subcommand_code fd offset num_bytes errno')
+
+EFS2_WRITE_RESPONSE = Header('Efs2WriteResponse', '<BHiIii', 'subsystem_id subcommand_code fd offset num_bytes errno')
+
+EFS2_STAT_RESPONSE = Header('Efs2StatResponse', '<BH7i', 'subsystem_id subcommand_code errno mode size num_links atime mtime ctime')
+
+EFS2_READDIR_RESPONSE = Header('Efs2ReaddirResponse', '<BHI8i', 'subsystem_id subcommand_code dir_fd sequence_number ' +
+    'errno entry_type mode size atime mtime ctime')
+
+EFS2_DEV_INFO_RESPONSE = Header('Efs2DevInfoResponse', '<BH7iB', 'subsystem_id subcommand_code errno ' +
+    'num_blocks pages_per_block page_size total_page_size maker_id device_id device_type')
+
+EFS2_MD5SUM_RESPONSE = Header('Efs2Md5sumResponse', '<BHHi', 'subsystem_id subcommand_code sequence_number errno')
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from os.path import dirname, realpath
+from struct import pack
+from argparse import ArgumentParser
+from timeit import repeat
+from io import BytesIO
+from os import devnull
+
+TESTS_DIR = dirname(realpath(__file__))
+ROOT_DIR = dirname(TESTS_DIR)
+
+import sys
+sys.path.insert(0, ROOT_DIR)
+
+from src.protocol.gsmtap import *
+
+"""
+    This script is a micro-benchmark, it is not part of the test suite.
+
+    It compares the building of the PCAP records of GSMTAP packets through
+    "PcapRecordBuilder" (headers packed in place into a reusable buffer,
+    records written by batches) against the previous implementation (IPv4,
+    UDP, GSMTAP and PCAP record headers packed separately and concatenated,
+    one write per record).
+
+    Usage: python3 tests/bench_gsmtap.py [--num-packets N] [--batch-size N]
+        [--payload-size BYTES] [--unbuffered]
+"""
+
+def legacy_build_record(timestamp, gsmtap_protocol, gsmtap_channel_type, payload, is_uplink):
+
+    packet = pack('>BBBxHxx4xBxxx', 2, 4, gsmtap_protocol, int(is_uplink) << 14, gsmtap_channel_type) + payload
+
+    packet = pack('>HHHH', GSMTAP_PORT, GSMTAP_PORT, len(packet) + 8, 0) + packet
+
+    packet = pack('>BBHHHBBH4s4s', (4 << 4) | 5, 0, len(packet) + 20, 0, 0, 64, 17, 0, bytes(4), bytes(4)) + packet
+
+    return pack('<IIII', int(timestamp), int((timestamp * 1000000) % 1000000), len(packet), len(packet)) + packet
+
+def legacy_dump(packets, pcap_file, batch_size):
+
+    for timestamp, payload in packets:
+
+        pcap_file.write(legacy_build_record(timestamp, GSMTAP_TYPE_LTE_RRC, GSMTAP_LTE_RRC_SUB_DL_DCCH_Message, payload, False))
+
+def builder_dump(packets, pcap_file, batch_size):
+
+    builder = PcapRecordBuilder()
+
+    for index, (timestamp, payload) in enumerate(packets):
+
+        builder.append_gsmtap(timestamp, GSMTAP_TYPE_LTE_RRC, GSMTAP_LTE_RRC_SUB_DL_DCCH_Message, payload, False)
+
+        if index % batch_size == batch_size - 1:
+
+            builder.write_to(pcap_file)
+
+    builder.write_to(pcap_file)
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser(description = 'Benchmark the building of GSMTAP PCAP records.')
+    parser.add_argument('--num-packets', type = int, default = 100000)
+    parser.add_argument('--batch-size', type = int, default = 64)
+    parser.add_argument('--payload-size', type = int, default = 200, help = 'Maximum payload size')
+    parser.add_argument('--unbuffered', action = 'store_true', help = 'Write to an unbuffered file ' +
+        '(as the pipe to Wireshark) rather than to memory')
+    parser.add_argument('--repeat', type = int, default = 5)
+    args = parser.parse_args()
+
+    packets = [(1700000000 + index / 1000, bytes(20 + index % args.payload_size)) for index in range(args.num_packets)]
+
+    legacy_file, builder_file = BytesIO(), BytesIO()
+    legacy_dump(packets[:100], legacy_file, 1)
+    builder_dump(packets[:100], builder_file, 7)
+    assert legacy_file.getvalue() == builder_file.getvalue()
+
+    print('%d packets, batches of %d records' % (len(packets), args.batch_size))
+
+    for name, function in [('legacy', legacy_dump), ('builder', builder_dump)]:
+        if args.unbuffered:
+            open_file = lambda: open(devnull, 'wb', buffering = 0)
+        else:
+            open_file = BytesIO
+        best = min(repeat(lambda: function(packets, open_file(), args.batch_size), number = 1, repeat = args.repeat))
+        print('%-12s %8.2f ms  %8.0f ns/packet' % (name, best * 1000, best / len(packets) * 1e9))
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from os.path import dirname, realpath, join
+from struct import pack, unpack, unpack_from
+from argparse import ArgumentParser
+from timeit import repeat
+
+TESTS_DIR = dirname(realpath(__file__))
+ROOT_DIR = dirname(TESTS_DIR)
+
+import sys
+sys.path.insert(0, ROOT_DIR)
+
+from src.inputs._hdlc_mixin import HdlcMixin
+
+"""
+    This script is a micro-benchmark, it is not part of the test suite.
+
+    It compares the decapsulation of pseudo-HDLC frames by "HdlcMixin"
+    against the previous implementation (two unconditional replacement
+    passes, and a CRC compared after being repacked), over a Diag stream
+    rebuilt from a recorded capture: each packet of the capture is wrapped
+    into a DIAG_LOG_F frame, and the stream is cut into fixed-size reads.
+
+    Usage: python3 tests/bench_hdlc.py [--pcap FILE] [--read-size BYTES]
+"""
+
+DEFAULT_PCAP = join(ROOT_DIR, 'docs', 'sample_pcaps', 'sample_2g_3g_4g_xperia_with_sib_and_nas.pcap')
+
+def read_pcap_payloads(path):
+
+    with open(path, 'rb') as fd:
+        data = fd.read()
+
+    payloads = []
+    offset = 24 # Skip the global header
+
+    while offset + 16 <= len(data):
+        incl_len, = unpack_from('<I', data, offset + 8)
+        payloads.append(data[offset + 16:offset + 16 + incl_len])
+        offset += 16 + incl_len
+
+    return payloads
+
+def legacy_decapsulate(hdlc, payload):
+
+    payload = bytes(payload[:-1])
+
+    payload = payload.replace(bytes([hdlc.ESCAPE_CHAR[0], hdlc.TRAILER_CHAR[0] ^ 0x20]), hdlc.TRAILER_CHAR)
+    payload = payload.replace(bytes([hdlc.ESCAPE_CHAR[0], hdlc.ESCAPE_CHAR[0] ^ 0x20]), hdlc.ESCAPE_CHAR)
+
+    if payload[-2:] != pack('<H', hdlc.ccitt_crc16(payload[:-2])):
+        raise hdlc.InvalidFrameError
+
+    return payload[:-2]
+
+def legacy_decapsulate_reads(hdlc, reads):
+
+    unframed_messages = []
+
+    for read in reads:
+        unframed_messages += [
+            legacy_decapsulate(hdlc, raw_payload)
+            for raw_payload in hdlc.hdlc_deframer.feed(read)
+        ]
+
+    return unframed_messages
+
+def batch_decapsulate_reads(hdlc, reads):
+
+    unframed_messages = []
+
+    for read in reads:
+        unframed_messages += hdlc.hdlc_decapsulate_batch(read)
+
+    return unframed_messages
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser(description = 'Benchmark the pseudo-HDLC decapsulation.')
+    parser.add_argument('--pcap', default = DEFAULT_PCAP, help = 'Capture file to take packets from.')
+    parser.add_argument('--read-size', type = int, default = 0x4000, help = 'Size of simulated reads from the device.')
+    parser.add_argument('--repeat', type = int, default = 5)
+    args = parser.parse_args()
+
+    hdlc = HdlcMixin()
+
+    log_payloads = [
+        pack('<BBHHHQ', 16, 0, 0, 12 + len(payload), 0xb0c0, 0) + payload
+        for payload in read_pcap_payloads(args.pcap)
+    ]
+
+    stream = b''.join(hdlc.hdlc_encapsulate(payload) for payload in log_payloads)
+
+    reads = [stream[offset:offset + args.read_size] for offset in range(0, len(stream), args.read_size)]
+
+    assert legacy_decapsulate_reads(hdlc, reads) == batch_decapsulate_reads(hdlc, reads) == log_payloads
+
+    print('%d frames, %d bytes, %d reads of %d bytes' % (len(log_payloads), len(stream), len(reads), args.read_size))
+
+    for name, function in [('legacy', legacy_decapsulate_reads), ('batch', batch_decapsulate_reads)]:
+        best = min(repeat(lambda: function(hdlc, reads), number = 20, repeat = args.repeat)) / 20
+        print('%-8s %8.2f ms  %8.1f MB/s' % (name, best * 1000, len(stream) / best / 1e6))
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from os.path import dirname, realpath
+from struct import pack, unpack, unpack_from, calcsize
+from argparse import ArgumentParser
+from timeit import repeat
+
+TESTS_DIR = dirname(realpath(__file__))
+ROOT_DIR = dirname(TESTS_DIR)
+
+import sys
+sys.path.insert(0, ROOT_DIR)
+
+from src.protocol.headers import DIAG_LOG_OUTER_HEADER, LOG_HEADER, WCDMA_SIGNALLING_HEADER, \
+    GSM_RR_SIGNALLING_HEADER, LTE_RRC_OTA_HEADER, LTE_RRC_OTA_HEADER_V25, LTE_RRC_OTA_EXT_HEADERS
+from src.protocol.log_types import WCDMA_SIGNALLING_MESSAGE, LOG_GSM_RR_SIGNALING_MESSAGE_C, LOG_LTE_RRC_OTA_MSG_LOG_C
+
+"""
+    This script is a micro-benchmark, it is not part of the test suite.
+
+    It compares the parsing of the headers of DIAG_LOG_F packets carrying
+    signalling messages (the outer and inner log headers, then the header
+    of the log itself, as done by "_base_input.py" and "pcap_dump.py"),
+    through the precompiled headers of "src/protocol/headers.py", against
+    the previous implementation (format strings passed to unpack() and
+    calcsize() for each packet).
+
+    Usage: python3 tests/bench_headers.py [--num-packets N]
+"""
+
+def build_log_packet(log_type, log_payload):
+
+    return pack('<BH', 0, 12 + len(log_payload)) + pack('<HHQ', 12 + len(log_payload), log_type, 0) + log_payload
+
+SAMPLE_PACKETS = [
+    build_log_packet(WCDMA_SIGNALLING_MESSAGE, pack('<BBH', 3, 0, 20) + bytes(20)),
+    build_log_packet(LOG_GSM_RR_SIGNALING_MESSAGE_C, pack('<BBB', 0x80, 0x15, 23) + bytes(23)),
+    build_log_packet(LOG_LTE_RRC_OTA_MSG_LOG_C, pack('<BBBBH', 7, 9, 0xb0, 0, 100) + pack('<HHBH', 6300, 12, 4, 30) + bytes(30)),
+    build_log_packet(LOG_LTE_RRC_OTA_MSG_LOG_C, pack('<BBBBH', 19, 14, 0x30, 0, 100) + pack('<IHB4xH', 1300, 12, 4, 30) + bytes(30)),
+    build_log_packet(LOG_LTE_RRC_OTA_MSG_LOG_C, pack('<BBBHBH', 26, 15, 0x40, 0, 0, 100) + pack('<IHBH', 1300, 12, 4, 30) + bytes(30))
+]
+
+def legacy_parse(payload):
+
+    (pending_msgs, log_outer_length), inner_log_packet = unpack_from('<BH', payload), payload[calcsize('<BH'):]
+
+    (log_inner_length, log_type, log_time), log_payload = unpack_from('<HHQ', inner_log_packet), inner_log_packet[calcsize('<HHQ'):]
+
+    if log_type == WCDMA_SIGNALLING_MESSAGE:
+
+        (channel_type, radio_bearer, length), signalling_message = unpack('<BBH', log_payload[:4]), log_payload[4:]
+
+    elif log_type == LOG_GSM_RR_SIGNALING_MESSAGE_C:
+
+        (channel_type, message_type, length), signalling_message = unpack('<BBB', log_payload[:3]), log_payload[3:]
+
+    else:
+
+        (ext_header_ver, rrc_rel, rrc_ver, bearer_id, phy_cellid), ext_header = unpack('<BBBBH', log_payload[:6]), log_payload[6:]
+
+        if ext_header_ver >= 25:
+            (ext_header_ver, rrc_rel, rrc_ver, nc_rrc_rel, bearer_id, phy_cellid), ext_header = unpack('<BBBHBH', log_payload[:8]), log_payload[8:]
+
+        freq_type = 'H' if ext_header_ver < 8 else 'I'
+
+        header_spec = '<' + freq_type + 'HBH'
+
+        if unpack_from('<H', ext_header, calcsize(header_spec) - 2)[0] != len(ext_header) - calcsize(header_spec):
+
+            header_spec = '<' + freq_type + 'HB4xH'
+
+        (freq, sfn, channel_type, length), signalling_message = unpack_from(header_spec, ext_header), ext_header[calcsize(header_spec):]
+
+    return channel_type, length, signalling_message
+
+def precompiled_parse(payload):
+
+    (pending_msgs, log_outer_length), inner_log_packet = DIAG_LOG_OUTER_HEADER.unpack_from(payload), payload[DIAG_LOG_OUTER_HEADER.size:]
+
+    (log_inner_length, log_type, log_time), log_payload = LOG_HEADER.unpack_from(inner_log_packet), inner_log_packet[LOG_HEADER.size:]
+
+    if log_type == WCDMA_SIGNALLING_MESSAGE:
+
+        (channel_type, radio_bearer, length), signalling_message = WCDMA_SIGNALLING_HEADER.unpack_from(log_payload), log_payload[WCDMA_SIGNALLING_HEADER.size:]
+
+    elif log_type == LOG_GSM_RR_SIGNALING_MESSAGE_C:
+
+        (channel_type, message_type, length), signalling_message = GSM_RR_SIGNALLING_HEADER.unpack_from(log_payload), log_payload[GSM_RR_SIGNALLING_HEADER.size:]
+
+    else:
+
+        (ext_header_ver, rrc_rel, rrc_ver, bearer_id, phy_cellid), ext_header = LTE_RRC_OTA_HEADER.unpack_from(log_payload), log_payload[LTE_RRC_OTA_HEADER.size:]
+
+        if ext_header_ver >= 25:
+            (ext_header_ver, rrc_rel, rrc_ver, nc_rrc_rel, bearer_id, phy_cellid), ext_header = LTE_RRC_OTA_HEADER_V25.unpack_from(log_payload), log_payload[LTE_RRC_OTA_HEADER_V25.size:]
+
+        is_32bit_freq = ext_header_ver >= 8
+
+        ext_header_struct = LTE_RRC_OTA_EXT_HEADERS[is_32bit_freq, False]
+
+        if ext_header_struct.unpack_from(ext_header)[-1] != len(ext_header) - ext_header_struct.size:
+
+            ext_header_struct = LTE_RRC_OTA_EXT_HEADERS[is_32bit_freq, True]
+
+        (freq, sfn, channel_type, length), signalling_message = ext_header_struct.unpack_from(ext_header), ext_header[ext_header_struct.size:]
+
+    return channel_type, length, signalling_message
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser(description = 'Benchmark the parsing of log headers.')
+    parser.add_argument('--num-packets', type = int, default = 100000)
+    parser.add_argument('--repeat', type = int, default = 5)
+    args = parser.parse_args()
+
+    packets = [memoryview(SAMPLE_PACKETS[index % len(SAMPLE_PACKETS)]) for index in range(args.num_packets)]
+
+    assert [legacy_parse(packet) for packet in packets[:len(SAMPLE_PACKETS)]] == \
+        [precompiled_parse(packet) for packet in packets[:len(SAMPLE_PACKETS)]]
+
+    print('%d packets' % len(packets))
+
+    for name, function in [('legacy', legacy_parse), ('precompiled', precompiled_parse)]:
+        best = min(repeat(lambda: [function(packet) for packet in packets], number = 1, repeat = args.repeat))
+        print('%-12s %8.2f ms  %8.0f ns/packet' % (name, best * 1000, best / len(packets) * 1e9))
@@ -11,4 +11,44 @@ runner = TextTestRunner(verbosity = 2)
 
 import tests_usbmodem_argparser
 suite = loader.loadTestsFromModule(tests_usbmodem_argparser)
-runner.run(suite)
\ No newline at end of file
+runner.run(suite)
+
+import tests_hdlc
+suite = loader.loadTestsFromModule(tests_hdlc)
+runner.run(suite)
+
+import tests_dispatch_queue
+suite = loader.loadTestsFromModule(tests_dispatch_queue)
+runner.run(suite)
+
+import tests_dlf_read
+suite = loader.loadTestsFromModule(tests_dlf_read)
+runner.run(suite)
+
+import tests_pcap_batch
+suite = loader.loadTestsFromModule(tests_pcap_batch)
+runner.run(suite)
+
+import tests_diag_requests
+suite = loader.loadTestsFromModule(tests_diag_requests)
+runner.run(suite)
+
+import tests_efs_transfer
+suite = loader.loadTestsFromModule(tests_efs_transfer)
+runner.run(suite)
+
+import tests_memory_dump
+suite = loader.loadTestsFromModule(tests_memory_dump)
+runner.run(suite)
+
+import tests_log_masks
+suite = loader.loadTestsFromModule(tests_log_masks)
+runner.run(suite)
+
+import tests_buffered_writer
+suite = loader.loadTestsFromModule(tests_buffered_writer)
+runner.run(suite)
+
+import tests_diag_tracer
+suite = loader.loadTestsFromModule(tests_diag_tracer)
+runner.run(suite)
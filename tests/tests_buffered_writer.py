@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from os.path import dirname, realpath, join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from io import BytesIO
+from time import sleep
+
+TESTS_DIR = dirname(realpath(__file__))
+ROOT_DIR = dirname(TESTS_DIR)
+
+import sys
+sys.path.insert(0, ROOT_DIR)
+
+from src.modules._buffered_writer import BufferedRecordWriter, is_regular_file
+
+"""
+    This file is an include file.
+
+    It should be run from the "tests.py" entry point
+    located into the current directory
+
+    It contains the tests for the
+    "src/modules/_buffered_writer.py" file.
+"""
+
+"""
+    In-memory file counting the calls to write()
+"""
+
+class CountingFile(BytesIO):
+
+    def __init__(self):
+        super().__init__()
+        self.num_writes = 0
+
+    def write(self, data):
+        self.num_writes += 1
+        return super().write(data)
+
+    def close(self):
+        self.closed_value = self.getvalue()
+        super().close()
+
+"""
+    In-memory file behaving like a non-blocking pipe, writing at most 3
+    bytes at once, or nothing every other call
+"""
+
+class NonBlockingFile(BytesIO):
+
+    def __init__(self):
+        super().__init__()
+        self.num_writes = 0
+
+    def write(self, data):
+        self.num_writes += 1
+        if self.num_writes % 2:
+            return None
+        return super().write(bytes(data[:3]))
+
+class BrokenPipeFile(BytesIO):
+
+    def write(self, data):
+        raise BrokenPipeError()
+
+class BufferedWriterTests(TestCase):
+
+    def test_partial_writes(self):
+        pcap_file = NonBlockingFile()
+        writer = BufferedRecordWriter(pcap_file, flush_interval = 0)
+        writer.write(b'0123456789')
+        self.assertEqual(pcap_file.getvalue(), b'0123456789')
+
+    def test_flush_on_size_and_close(self):
+        pcap_file = CountingFile()
+        writer = BufferedRecordWriter(pcap_file, flush_interval = 3600, flush_size = 100)
+        for index in range(30):
+            writer.write(bytes([index]) * 10)
+        self.assertEqual(pcap_file.num_writes, 3) # Every 10 records
+        writer.write(memoryview(b'last'))
+        writer.close()
+        writer.close()
+        self.assertEqual(pcap_file.num_writes, 4)
+        self.assertEqual(pcap_file.closed_value, b''.join(bytes([index]) * 10 for index in range(30)) + b'last')
+        self.assertRaises(ValueError, writer.write, b'closed')
+
+    def test_flush_on_age(self):
+        pcap_file = CountingFile()
+        writer = BufferedRecordWriter(pcap_file, flush_interval = 0.2)
+        for index in range(100):
+            writer.write(b'record')
+        self.assertEqual(pcap_file.num_writes, 0)
+        for attempt in range(100):
+            if pcap_file.num_writes:
+                break
+            sleep(0.05)
+        self.assertEqual(pcap_file.num_writes, 1) # All at once, from the background thread
+        self.assertEqual(pcap_file.getvalue(), b'record' * 100)
+        writer.close()
+
+    def test_write_through(self):
+        pcap_file = CountingFile()
+        writer = BufferedRecordWriter(pcap_file, flush_interval = 0)
+        writer.write(b'a')
+        writer.write(b'b')
+        self.assertEqual(pcap_file.num_writes, 2)
+        writer.close()
+
+    def test_broken_pipe(self):
+        writer = BufferedRecordWriter(BrokenPipeFile(), flush_interval = 0.01)
+        writer.write(b'record')
+        sleep(0.1)
+        self.assertRaises(BrokenPipeError, writer.write, b'record') # Error from the background thread
+        writer.close()
+
+    def test_fsync(self):
+        with TemporaryDirectory() as temp_dir:
+            with open(join(temp_dir, 'test.dlf'), 'ab') as dlf_file:
+                self.assertTrue(is_regular_file(dlf_file))
+                writer = BufferedRecordWriter(dlf_file, fsync_interval = 0)
+                writer.write(b'record')
+                writer.flush()
+                self.assertEqual(open(join(temp_dir, 'test.dlf'), 'rb').read(), b'record')
+                writer.close()
+        self.assertFalse(is_regular_file(BytesIO()))
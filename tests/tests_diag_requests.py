@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from os.path import dirname, realpath
+from unittest import TestCase
+from struct import pack, unpack_from
+from threading import Timer
+
+TESTS_DIR = dirname(realpath(__file__))
+ROOT_DIR = dirname(TESTS_DIR)
+
+import sys
+sys.path.insert(0, ROOT_DIR)
+
+from src.inputs._base_input import BaseInput
+from src.inputs._hdlc_mixin import HdlcMixin
+from src.inputs._diag_requests import DiagRequestWindow, get_request_key, get_response_key
+from src.protocol.subsystems import DIAG_SUBSYS_FS
+from src.protocol.messages import DIAG_SUBSYS_CMD_F, DIAG_BAD_CMD_F, DIAG_PEEKB_F
+from src.protocol.efs2 import EFS2_DIAG_READ
+
+"""
+    This file is an include file.
+
+    It should be run from the "tests.py" entry point
+    located into the current directory
+
+    It contains the tests for the
+    "src/inputs/_diag_requests.py" file, and for BaseInput.send_recv_batch.
+"""
+
+def efs_read_request(fd, offset):
+    return pack('<BHiII', DIAG_SUBSYS_FS, EFS2_DIAG_READ, fd, 0x400, offset)
+
+def efs_read_response(fd, offset, data):
+    return pack('<BHiIii', DIAG_SUBSYS_FS, EFS2_DIAG_READ, fd, offset, len(data), 0) + data
+
+"""
+    Input answering the requests sent while holding them, in reverse order
+"""
+
+class ReversingInput(BaseInput):
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    def send_request(self, opcode, payload):
+        self.requests.append((opcode, payload))
+
+    def reply_in_reverse(self):
+        for opcode, payload in reversed(self.requests):
+            fd, nbytes, offset = unpack_from('<iII', payload, 3)
+            self.dispatch_diag_response(bytes([opcode]) + efs_read_response(fd, offset, b'%d' % offset))
+        self.requests.clear()
+
+"""
+    HDLC input answering each write at once, echoing the requests
+"""
+
+class EchoingHdlcInput(HdlcMixin, BaseInput):
+
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+
+    def send_request(self, opcode, payload):
+        self.send_requests([(opcode, payload)])
+
+    def send_requests(self, requests):
+        raw_payload = self.hdlc_encapsulate_batch(requests)
+        self.writes.append(raw_payload)
+        self.dispatch_hdlc_data(raw_payload)
+
+class DiagRequestsTests(TestCase):
+
+    def test_keys(self):
+        self.assertEqual(get_request_key(DIAG_SUBSYS_CMD_F, efs_read_request(3, 0x800)),
+            (DIAG_SUBSYS_CMD_F, DIAG_SUBSYS_FS, EFS2_DIAG_READ, 3, 0x800))
+        self.assertEqual(get_response_key(DIAG_SUBSYS_CMD_F, efs_read_response(3, 0x800, b'data')),
+            (DIAG_SUBSYS_CMD_F, DIAG_SUBSYS_FS, EFS2_DIAG_READ, 3, 0x800))
+        self.assertEqual(get_request_key(DIAG_PEEKB_F, pack('<IH', 0x1000, 4)), (DIAG_PEEKB_F, 0x1000))
+        # Error responses embed the start of the request
+        self.assertEqual(get_response_key(DIAG_BAD_CMD_F, bytes([DIAG_SUBSYS_CMD_F]) + efs_read_request(3, 0x800)[:4]),
+            (DIAG_SUBSYS_CMD_F, DIAG_SUBSYS_FS, EFS2_DIAG_READ))
+
+    def test_window_pop(self):
+        window = DiagRequestWindow(4)
+        for key, future in [((1, 2), 'a'), ((1, 3), 'b'), ((1, 3), 'c')]:
+            window.reserve()
+            window.add(key, future)
+        self.assertEqual(window.pop((1, 3)), ('b', True))
+        self.assertEqual(window.pop((1,)), ('a', True)) # Truncated key of an error response
+        self.assertEqual(window.pop((4,)), ('c', False))
+        self.assertEqual(window.pop((1, 3)), (None, False))
+
+    def test_out_of_order_responses(self):
+        diag_input = ReversingInput()
+        futures = [
+            diag_input.send_recv_async(DIAG_SUBSYS_CMD_F, efs_read_request(3, offset))
+            for offset in range(0, 0x2000, 0x400)
+        ]
+        diag_input.reply_in_reverse()
+        for offset, future in zip(range(0, 0x2000, 0x400), futures):
+            resp_opcode, resp_payload = diag_input.wait_diag_response(future)
+            self.assertEqual(resp_payload[-len(b'%d' % offset):], b'%d' % offset)
+        self.assertEqual(diag_input.diag_request_window.pending_requests, [])
+
+    def test_no_retransmission_while_requests_are_pending(self):
+        diag_input = ReversingInput()
+        diag_input.DIAG_TIMEOUT = 0.05
+        num_sent_requests = []
+
+        def reply():
+            num_sent_requests.append(len(diag_input.requests))
+            diag_input.reply_in_reverse()
+
+        futures = [diag_input.send_recv_async(DIAG_SUBSYS_CMD_F, efs_read_request(3, offset)) for offset in (0, 0x400)]
+        Timer(0.2, reply).start() # Responses slower than the timeout
+        for offset, future in zip((0, 0x400), futures):
+            resp_opcode, resp_payload = diag_input.wait_diag_response(future)
+            self.assertEqual(resp_payload[-len(b'%d' % offset):], b'%d' % offset)
+
+        # Alone in flight, a request is retransmitted
+        future = diag_input.send_recv_async(DIAG_SUBSYS_CMD_F, efs_read_request(3, 0))
+        Timer(0.08, reply).start()
+        diag_input.wait_diag_response(future)
+
+        self.assertEqual(num_sent_requests, [2, 2])
+
+    def test_batch(self):
+        diag_input = EchoingHdlcInput()
+        diag_input.set_diag_request_window(4)
+        requests = [(DIAG_PEEKB_F, pack('<IH', address, 0x10)) for address in range(0x1000, 0x1a00, 0x100)]
+        responses = diag_input.send_recv_batch(requests)
+        self.assertEqual(responses, [(opcode, payload) for opcode, payload in requests])
+        self.assertEqual(len(diag_input.writes), 3) # Split following the request window
+        self.assertEqual(diag_input.diag_request_window.pending_requests, [])
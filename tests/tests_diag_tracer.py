@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from os.path import dirname, realpath
+from unittest import TestCase
+from unittest.mock import patch
+from logging import getLogger, DEBUG, INFO
+from io import BytesIO
+
+TESTS_DIR = dirname(realpath(__file__))
+ROOT_DIR = dirname(TESTS_DIR)
+
+import sys
+sys.path.insert(0, ROOT_DIR)
+
+from src.inputs._diag_tracer import *
+from src.inputs._hdlc_mixin import HdlcMixin
+from src.inputs._base_input import BaseInput
+from src.protocol.messages import *
+from src.protocol.headers import DIAG_LOG_OUTER_HEADER, LOG_HEADER
+
+"""
+    This file is an include file.
+
+    It should be run from the "tests.py" entry point
+    located into the current directory
+
+    It contains the tests for the
+    "src/inputs/_diag_tracer.py" file, and for the tracing hooks of
+    "src/inputs/_base_input.py".
+"""
+
+"""
+    :returns The (direction, packet type, code, payload) tuples of the
+        records of a trace file
+"""
+
+def read_trace_records(trace_data):
+    records = []
+    offset = 0
+    while offset < len(trace_data):
+        timestamp, direction, packet_type, code, length = TRACE_RECORD_HEADER.unpack_from(trace_data, offset)
+        offset += TRACE_RECORD_HEADER.size
+        records.append((direction, packet_type, code, trace_data[offset:offset + length]))
+        offset += length
+    return records
+
+def build_log_packet(log_type, log_payload):
+    inner_log_packet = LOG_HEADER.pack(LOG_HEADER.size + len(log_payload), log_type, 0) + log_payload
+    return bytes([DIAG_LOG_F]) + DIAG_LOG_OUTER_HEADER.pack(0, len(inner_log_packet)) + inner_log_packet
+
+class TracedInput(HdlcMixin, BaseInput):
+
+    def send_request(self, opcode, payload):
+        self.hdlc_encapsulate(bytes([opcode]) + payload)
+
+class DiagTracerTests(TestCase):
+
+    def test_trace_file_records(self):
+        trace_file = BytesIO()
+        tracer = DiagTracer(trace_file = trace_file)
+        tracer.trace_request(DIAG_VERNO_F, b'')
+        tracer.trace_response(DIAG_VERNO_F, memoryview(b'version'))
+        tracer.trace_log(0xb0c0, b'log payload')
+        tracer.trace_message(DIAG_EXT_MSG_F, b'message')
+        tracer.flush()
+
+        self.assertEqual(read_trace_records(trace_file.getvalue()), [
+            (TRACE_DIRECTION_SENT, TRACE_TYPE_REQUEST, DIAG_VERNO_F, b''),
+            (TRACE_DIRECTION_RECEIVED, TRACE_TYPE_RESPONSE, DIAG_VERNO_F, b'version'),
+            (TRACE_DIRECTION_RECEIVED, TRACE_TYPE_LOG, 0xb0c0, b'log payload'),
+            (TRACE_DIRECTION_RECEIVED, TRACE_TYPE_MESSAGE, DIAG_EXT_MSG_F, b'message'),
+        ])
+        self.assertEqual(len(trace_file.getvalue()), 4 * TRACE_RECORD_HEADER.size + 7 + 11 + 7)
+
+    def test_filters(self):
+        trace_file = BytesIO()
+        tracer = DiagTracer(log_codes = {0xb0c0}, opcodes = {DIAG_EXT_MSG_F}, trace_file = trace_file)
+        tracer.trace_log(0xb0c0, b'kept')
+        tracer.trace_log(0x412f, b'filtered')
+        tracer.trace_message(DIAG_EXT_MSG_F, b'kept')
+        tracer.trace_message(DIAG_MSG_F, b'filtered')
+        tracer.trace_request(DIAG_VERNO_F, b'filtered')
+        tracer.trace_response(DIAG_VERNO_F, b'filtered')
+
+        self.assertEqual([code for direction, packet_type, code, payload in read_trace_records(trace_file.getvalue())],
+            [0xb0c0, DIAG_EXT_MSG_F])
+
+    def test_debug_lines(self):
+        tracer = DiagTracer()
+        with self.assertLogs(level = DEBUG) as logs:
+            tracer.trace_request(DIAG_VERNO_F, b'\x01')
+            tracer.trace_log(0xb0c0, b'')
+        self.assertIn('DIAG_VERNO_F of length 1', logs.output[0])
+        self.assertIn('log 0xb0c0 of length 0', logs.output[1])
+
+    def test_disabled(self):
+        logger = getLogger()
+        previous_level = logger.level
+        logger.setLevel(INFO)
+        try:
+            diag_input = TracedInput()
+            diag_input.enable_diag_tracing()
+        finally:
+            logger.setLevel(previous_level)
+        self.assertIsNone(diag_input.diag_tracer)
+
+        with patch.object(DiagTracer, '_trace') as trace:
+            diag_input.send_request(DIAG_VERNO_F, b'')
+            diag_input.dispatch_received_diag_packet(build_log_packet(0xb0c0, b'log payload'))
+            diag_input.dispatch_received_diag_packet(bytes([DIAG_EXT_MSG_F]) + b'message')
+            diag_input.dispatch_received_diag_packet(bytes([DIAG_VERNO_F]) + b'version')
+            self.assertFalse(trace.called)
+
+            diag_input.enable_diag_tracing(trace_file = BytesIO()) # Checks that the hooks are reached
+            diag_input.send_request(DIAG_VERNO_F, b'')
+            diag_input.dispatch_received_diag_packet(build_log_packet(0xb0c0, b'log payload'))
+            diag_input.dispatch_received_diag_packet(bytes([DIAG_EXT_MSG_F]) + b'message')
+            diag_input.dispatch_received_diag_packet(bytes([DIAG_VERNO_F]) + b'version')
+            self.assertEqual(trace.call_count, 4)
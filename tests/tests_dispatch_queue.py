@@ -0,0 +1,45 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from os.path import dirname, realpath
+from unittest import TestCase
+
+TESTS_DIR = dirname(realpath(__file__))
+ROOT_DIR = dirname(TESTS_DIR)
+
+import sys
+sys.path.insert(0, ROOT_DIR)
+
+from src.inputs._dispatch_queue import DispatchQueue, \
+    DISPATCH_POLICY_DROP_OLDEST, DISPATCH_POLICY_DROP_NEWEST
+
+"""
+    This file is an include file.
+
+    It should be run from the "tests.py" entry point
+    located into the current directory
+
+    It contains the tests for the
+    "src/inputs/_dispatch_queue.py" file.
+"""
+
+class DispatchQueueTests(TestCase):
+
+    def drain(self, queue):
+        queue.put_end()
+        return list(iter(queue.get, None))
+
+    def test_drop_newest(self):
+        queue = DispatchQueue(2, DISPATCH_POLICY_DROP_NEWEST)
+        for item in range(4):
+            queue.put(item, 0xb0c0)
+        self.assertEqual(self.drain(queue), [0, 1])
+        self.assertEqual(queue.num_dropped_per_log_code[0xb0c0], 2)
+        self.assertEqual(queue.max_depth, 2)
+
+    def test_drop_oldest_by_log_code(self):
+        queue = DispatchQueue(2, DISPATCH_POLICY_DROP_OLDEST, {0x11eb})
+        queue.put('message')
+        queue.put('ip 1', 0x11eb)
+        queue.put('ip 2', 0x11eb)
+        self.assertEqual(self.drain(queue), ['message', 'ip 2'])
+        self.assertEqual(queue.num_dropped, 1)
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from tempfile import TemporaryDirectory
+from os.path import dirname, realpath, join
+from unittest import TestCase
+from struct import pack
+import gzip
+
+TESTS_DIR = dirname(realpath(__file__))
+ROOT_DIR = dirname(TESTS_DIR)
+
+import sys
+sys.path.insert(0, ROOT_DIR)
+
+from src.inputs.dlf_read import DlfReader, TIMESTAMP_OFFSET
+
+"""
+    This file is an include file.
+
+    It should be run from the "tests.py" entry point
+    located into the current directory
+
+    It contains the tests for the
+    "src/inputs/dlf_read.py" file.
+"""
+
+class RecordingDlfReader(DlfReader):
+
+    def dispatch_diag_log(self, log_type, log_payload, log_header, timestamp):
+        self.records.append((log_type, bytes(log_header) + bytes(log_payload), timestamp))
+
+def read_records(dlf_file, **kwargs):
+    reader = RecordingDlfReader(dlf_file, **kwargs)
+    reader.records = []
+    try:
+        reader.read_loop()
+    except SystemExit:
+        pass
+    dlf_file.close()
+    return reader.records
+
+def build_record(log_type, timestamp, payload):
+    log_time = int((timestamp - TIMESTAMP_OFFSET) * 50) << 20
+    return pack('<HHQ', 12 + len(payload), log_type, log_time) + payload
+
+class DlfReadTests(TestCase):
+
+    def test_selection_with_and_without_index(self):
+        with TemporaryDirectory() as temp_dir:
+            dlf_path = join(temp_dir, 'test.dlf')
+
+            with open(dlf_path, 'wb') as dlf_file:
+                for index in range(100):
+                    dlf_file.write(build_record([0xb0c0, 0x412f][index % 2], 1700000000 + index, bytes([index]) * index))
+
+            with gzip.open(dlf_path + '.gz', 'wb') as gzip_file, open(dlf_path, 'rb') as dlf_file:
+                gzip_file.write(dlf_file.read())
+
+            all_records = read_records(open(dlf_path, 'rb'))
+            self.assertEqual(len(all_records), 100)
+            self.assertEqual(all_records[10][2], 1700000010)
+
+            selection = dict(start_time = 1700000020, stop_time = 1700000029, log_codes = {0x412f})
+            expected_records = [record for record in all_records[20:30] if record[0] == 0x412f]
+
+            self.assertEqual(read_records(open(dlf_path, 'rb'), **selection), expected_records)
+            self.assertEqual(read_records(gzip.open(dlf_path + '.gz', 'rb'), **selection), expected_records)
+
+            # Build the index, then load it after records were appended
+            self.assertEqual(read_records(open(dlf_path, 'rb'), use_index = True, **selection), expected_records)
+
+            with open(dlf_path, 'ab') as dlf_file:
+                dlf_file.write(build_record(0x412f, 1700000025, b'appended'))
+
+            self.assertEqual(read_records(open(dlf_path, 'rb'), use_index = True, **selection)[-1][1][12:], b'appended')
+
+    def test_truncated_record(self):
+        with TemporaryDirectory() as temp_dir:
+            dlf_path = join(temp_dir, 'test.dlf')
+
+            with open(dlf_path, 'wb') as dlf_file:
+                dlf_file.write(build_record(0xb0c0, 1700000000, b'first'))
+                dlf_file.write(build_record(0xb0c0, 1700000001, b'second')[:-2])
+
+            with gzip.open(dlf_path + '.gz', 'wb') as gzip_file, open(dlf_path, 'rb') as dlf_file:
+                gzip_file.write(dlf_file.read())
+
+            for dlf_file in (open(dlf_path, 'rb'), gzip.open(dlf_path + '.gz', 'rb')):
+                with self.assertLogs(level = 'WARNING') as logs:
+                    records = read_records(dlf_file)
+                self.assertEqual(len(records), 1)
+                self.assertIn('offset 17', logs.output[0])
@@ -0,0 +1,375 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from os.path import dirname, realpath, join, exists, getsize
+from os import makedirs
+from tempfile import TemporaryDirectory
+from struct import pack, unpack_from
+from unittest import TestCase
+from argparse import Namespace
+from collections import Counter
+from hashlib import md5
+from io import BytesIO, StringIO
+from contextlib import redirect_stdout
+import tarfile
+import json
+
+TESTS_DIR = dirname(realpath(__file__))
+ROOT_DIR = dirname(TESTS_DIR)
+
+import sys
+sys.path.insert(0, ROOT_DIR)
+
+from src.inputs._base_input import BaseInput
+from src.modules.efs_shell_commands._efs_transfer import EfsWindows, DEFAULT_EFS_WINDOWS, \
+    read_efs_file, write_efs_file, get_efs_file_size, open_efs_file, EfsTransferError
+from src.modules.efs_dump import EfsDumper, MANIFEST_FILE_NAME, split_efs_windows
+from src.modules.efs_tar import open_tar_stream, write_efs_tree_to_tar
+from src.modules.efs_shell_commands._efs_cache import EfsMetadataCache
+from src.modules.efs_shell_commands.put import PutCommand
+from src.modules.efs_shell_commands.ls import LsCommand
+from src.protocol.subsystems import DIAG_SUBSYS_FS
+from src.protocol.messages import DIAG_SUBSYS_CMD_F, DIAG_BAD_LEN_F
+from src.protocol.efs2 import *
+
+"""
+    This file is an include file.
+
+    It should be run from the "tests.py" entry point
+    located into the current directory
+
+    It contains the tests for the
+    "src/modules/efs_shell_commands/_efs_transfer.py",
+    "src/modules/efs_shell_commands/_efs_cache.py",
+    "src/modules/efs_dump.py" and "src/modules/efs_tar.py" files.
+"""
+
+"""
+    Input emulating an EFS, answering requests as soon as they are sent.
+
+    :param files: {path: contents} of the regular files of the EFS, the
+        directories being deduced from the paths
+    :param links: {path: target} of the symbolic links of the EFS
+    :param max_chunk_size: Maximal number of bytes read or written at once
+    :param rejected_chunk_size: Requests above this size get an error response
+    :param supports_md5sum: Whether EFS2_DIAG_MD5SUM is answered
+"""
+
+class FakeEfsInput(BaseInput):
+
+    def __init__(self, files = {}, links = {}, max_chunk_size = 0x400, rejected_chunk_size = None, supports_md5sum = True):
+        super().__init__()
+        self.files = {path: bytearray(contents) for path, contents in files.items()}
+        self.links = links
+        self.mtimes = {path: 1262304000 for path in files}
+        self.max_chunk_size = max_chunk_size
+        self.rejected_chunk_size = rejected_chunk_size
+        self.requested_sizes = []
+        self.fd_to_path = {}
+        self.num_reads = 0
+        self.num_requests = 0
+        self.subcommand_counts = Counter()
+        self.directories = set()
+        self.supports_md5sum = supports_md5sum
+
+    def list_directory(self, directory):
+        prefix = directory.rstrip(b'/') + b'/'
+        names = {path[len(prefix):].split(b'/')[0] for path in [*self.files, *self.links] if path.startswith(prefix)}
+        return [b'.', b'..'] + sorted(names)
+
+    def resolve_links(self, path):
+        for link, target in self.links.items():
+            if path == link or path.startswith(link + b'/'):
+                return target + path[len(link):]
+        return path
+
+    def stat(self, path, follow_links = False):
+        if follow_links:
+            path = self.resolve_links(path)
+        if path in self.links:
+            return 0o120777, 0, 0
+        if path in self.files:
+            return 0o100644, len(self.files[path]), self.mtimes.get(path, 0)
+        if (path in (b'', b'/') or path in self.directories or path.endswith((b'/.', b'/..')) or
+            any(other_path.startswith(path.rstrip(b'/') + b'/') for other_path in [*self.files, *self.links])):
+            return 0o040755, 0, 0
+        return None
+
+    def send_request(self, opcode, payload):
+        subsystem_id, subcommand_code = unpack_from('<BH', payload)
+        self.num_requests += 1
+        self.subcommand_counts[subcommand_code] += 1
+
+        if subcommand_code == EFS2_DIAG_HELLO:
+            response = pack('<BH6I3II', subsystem_id, subcommand_code, 8, 0x10000, 8, 0x10000, 8, 0x10000, 1, 1, 1, 0)
+
+        elif subcommand_code in (EFS2_DIAG_OPEN, EFS2_DIAG_OPENDIR):
+            path = self.resolve_links(payload[3 + 8 * (subcommand_code == EFS2_DIAG_OPEN):].rstrip(b'\x00'))
+            if subcommand_code == EFS2_DIAG_OPEN and unpack_from('<i', payload, 3)[0] & 0o1000: # O_TRUNC
+                self.files[path] = bytearray()
+            fd = len(self.fd_to_path) + 1
+            self.fd_to_path[fd] = path
+            response = pack('<BHIi', subsystem_id, subcommand_code, fd, 0)
+
+        elif subcommand_code in (EFS2_DIAG_CLOSE, EFS2_DIAG_CLOSEDIR):
+            response = pack('<BHi', subsystem_id, subcommand_code, 0)
+
+        elif subcommand_code == EFS2_DIAG_READDIR:
+            fd, sequence_number = unpack_from('<Ii', payload, 3)
+            names = self.list_directory(self.fd_to_path[fd])
+            name = names[sequence_number - 1] if sequence_number <= len(names) else b''
+            mode, size, mtime = self.stat(self.fd_to_path[fd].rstrip(b'/') + b'/' + name)
+            response = pack('<BHI8i', subsystem_id, subcommand_code, fd, sequence_number, 0,
+                0x01 if mode & 0o040000 else 0, mode, size, mtime, mtime, mtime) + name + b'\x00'
+
+        elif subcommand_code == EFS2_DIAG_STAT:
+            mode, size, mtime = self.stat(payload[3:].rstrip(b'\x00'), follow_links = True) or (0, 0, 0)
+            errno = 0 if mode else 2 # ENOENT
+            response = pack('<BH7i', subsystem_id, subcommand_code, errno, mode, size, 1, mtime, mtime, mtime)
+
+        elif subcommand_code == EFS2_DIAG_MKDIR:
+            self.directories.add(payload[5:].rstrip(b'\x00'))
+            response = pack('<BHi', subsystem_id, subcommand_code, 0)
+
+        elif subcommand_code == EFS2_DIAG_MD5SUM:
+            if not self.supports_md5sum:
+                self.dispatch_diag_response(bytes([DIAG_BAD_LEN_F, opcode]) + payload)
+                return
+            sequence_number, = unpack_from('<H', payload, 3)
+            digest = md5(self.files[self.resolve_links(payload[5:].rstrip(b'\x00'))]).digest()
+            response = pack('<BHHi', subsystem_id, subcommand_code, sequence_number, 0) + digest
+
+        elif subcommand_code == EFS2_DIAG_READLINK:
+            response = pack('<BHi', subsystem_id, subcommand_code, 0) + self.links[payload[3:].rstrip(b'\x00')] + b'\x00'
+
+        elif subcommand_code == EFS2_DIAG_FSTAT:
+            fd, = unpack_from('<i', payload, 3)
+            mode, size, mtime = self.stat(self.fd_to_path[fd])
+            response = pack('<BH7i', subsystem_id, subcommand_code, 0, mode, size, 1, mtime, mtime, mtime)
+
+        elif subcommand_code == EFS2_DIAG_READ:
+            fd, nbytes, offset = unpack_from('<iII', payload, 3)
+            self.requested_sizes.append(nbytes)
+            self.num_reads += 1
+            if self.rejected_chunk_size and nbytes > self.rejected_chunk_size:
+                self.dispatch_diag_response(bytes([DIAG_BAD_LEN_F, opcode]) + payload)
+                return
+            data = bytes(self.files[self.fd_to_path[fd]][offset:offset + min(nbytes, self.max_chunk_size)])
+            response = pack('<BHiIii', subsystem_id, subcommand_code, fd, offset, len(data), 0) + data
+
+        elif subcommand_code == EFS2_DIAG_WRITE:
+            fd, offset = unpack_from('<iI', payload, 3)
+            contents = self.files.setdefault(self.fd_to_path[fd], bytearray())
+            data = payload[11:11 + self.max_chunk_size]
+            self.requested_sizes.append(len(payload) - 11)
+            contents[len(contents):offset] = bytes(max(0, offset - len(contents)))
+            contents[offset:offset + len(data)] = data
+            response = pack('<BHiIii', subsystem_id, subcommand_code, fd, offset, len(data), 0)
+
+        self.dispatch_diag_response(bytes([opcode]) + response)
+
+EFS_WINDOWS = EfsWindows(8, 0x10000, 8, 0x10000, 8, 0x10000)
+
+CONTENTS = bytes(range(256)) * 97 # Not a multiple of the chunk sizes
+
+class EfsTransferTests(TestCase):
+
+    def read(self, diag_input, windows = EFS_WINDOWS):
+        file_fd = open_efs_file(diag_input, b'/file')
+        output_file = BytesIO()
+        num_bytes = read_efs_file(diag_input, file_fd, output_file, get_efs_file_size(diag_input, file_fd), windows)
+        self.assertEqual(num_bytes, len(output_file.getvalue()))
+        self.assertEqual(diag_input.diag_request_window.pending_requests, [])
+        return output_file.getvalue()
+
+    def test_read_shrinks_chunks(self):
+        diag_input = FakeEfsInput({b'/file': CONTENTS}, max_chunk_size = 0x600)
+        self.assertEqual(self.read(diag_input), CONTENTS)
+        self.assertEqual(diag_input.requested_sizes[:2], [0x2000, 0x600]) # Probe, then remainder
+        self.assertEqual(max(diag_input.requested_sizes[2:]), 0x600)
+
+    def test_read_rejected_chunks(self):
+        diag_input = FakeEfsInput({b'/file': CONTENTS}, rejected_chunk_size = 0x400)
+        self.assertEqual(self.read(diag_input), CONTENTS)
+        self.assertEqual(max(diag_input.requested_sizes[1:]), 0x400)
+
+    def test_read_without_handshake(self):
+        diag_input = FakeEfsInput({b'/file': CONTENTS[:0x800]})
+        self.assertEqual(self.read(diag_input, DEFAULT_EFS_WINDOWS), CONTENTS[:0x800])
+        self.assertEqual(self.read(FakeEfsInput({b'/file': b''})), b'')
+
+    def test_write(self):
+        diag_input = FakeEfsInput(max_chunk_size = 0x700)
+        file_fd = open_efs_file(diag_input, b'/file', 0o1101, 0o100777)
+        num_bytes = write_efs_file(diag_input, file_fd, BytesIO(CONTENTS), len(CONTENTS), EFS_WINDOWS)
+        self.assertEqual(num_bytes, len(CONTENTS))
+        self.assertEqual(bytes(diag_input.files[b'/file']), CONTENTS)
+
+    def test_read_error(self):
+        diag_input = FakeEfsInput({b'/file': CONTENTS}, rejected_chunk_size = 0x100)
+        with self.assertRaises(EfsTransferError):
+            self.read(diag_input)
+        self.assertEqual(diag_input.diag_request_window.pending_requests, [])
+
+class EfsDumpTests(TestCase):
+
+    def test_split_windows(self):
+        num_workers, worker_windows = split_efs_windows(EfsWindows(8, 0x10000, 8, 0x10000, 8, 0x10000), 4)
+        self.assertEqual((num_workers, worker_windows.targ_pkt_window, worker_windows.targ_byte_window), (4, 2, 0x4000))
+        num_workers, worker_windows = split_efs_windows(EfsWindows(2, 0x8000, 8, 0x10000, 8, 0x10000), 4)
+        self.assertEqual((num_workers, worker_windows.targ_pkt_window, worker_windows.targ_byte_window), (2, 1, 0x4000))
+        self.assertEqual(split_efs_windows(DEFAULT_EFS_WINDOWS, 4), (1, DEFAULT_EFS_WINDOWS))
+
+    def test_incremental_dump(self):
+        diag_input = FakeEfsInput({
+            b'/nv/item_files/a': b'a' * 10,
+            b'/nv/item_files/b': CONTENTS,
+            b'/policyman/c': b'c',
+        })
+        with TemporaryDirectory() as output_dir:
+            EfsDumper(diag_input, output_dir).on_init()
+            with open(join(output_dir, 'nv', 'item_files', 'b'), 'rb') as local_file:
+                self.assertEqual(local_file.read(), CONTENTS)
+            with open(join(output_dir, MANIFEST_FILE_NAME)) as manifest_file:
+                manifest = json.load(manifest_file)
+            self.assertEqual(manifest['/nv/item_files/a'], {'size': 10, 'mtime': 1262304000, 'mode': 0o100644})
+            self.assertEqual(manifest['/nv']['mode'], 0o040755)
+
+            # Only the modified file is downloaded again, and the removed one is deleted
+            diag_input.files[b'/policyman/c'] = bytearray(b'cc')
+            del diag_input.files[b'/nv/item_files/a']
+            diag_input.num_reads = 0
+            dumper = EfsDumper(diag_input, output_dir)
+            dumper.on_init()
+            self.assertEqual((dumper.num_files_downloaded, dumper.num_files_unchanged), (1, 1))
+            self.assertEqual(diag_input.num_reads, 1)
+            self.assertFalse(exists(join(output_dir, 'nv', 'item_files', 'a')))
+            with open(join(output_dir, 'policyman', 'c'), 'rb') as local_file:
+                self.assertEqual(local_file.read(), b'cc')
+
+class EfsTarTests(TestCase):
+
+    def test_tar_subtree(self):
+        diag_input = FakeEfsInput({
+            b'/nv/item_files/a': b'a' * 10,
+            b'/nv/item_files/b': CONTENTS,
+            b'/policyman/c': b'c',
+        }, {b'/nv/link': b'/policyman/c'})
+        with TemporaryDirectory() as output_dir:
+            for archive_name in ('nv.tar', 'nv.tar.gz', 'nv.tar.xz'):
+                archive_path = join(output_dir, archive_name)
+                with open_tar_stream(archive_path) as tar:
+                    self.assertEqual(write_efs_tree_to_tar(diag_input, b'/nv', tar, EFS_WINDOWS), (5, 10 + len(CONTENTS)))
+                with tarfile.open(archive_path) as tar:
+                    self.assertEqual(tar.getnames(), ['nv', 'nv/item_files', 'nv/link', 'nv/item_files/a', 'nv/item_files/b'])
+                    self.assertEqual(tar.extractfile('nv/item_files/b').read(), CONTENTS)
+                    self.assertEqual(tar.getmember('nv/item_files/a').mode, 0o644)
+                    self.assertEqual(tar.getmember('nv/link').linkname, '/policyman/c')
+            self.assertEqual(getsize(join(output_dir, 'nv.tar')) % tarfile.RECORDSIZE, 0)
+
+class EfsCacheTests(TestCase):
+
+    FILES = {b'/nv/item_files/a': b'a', b'/nv/b': b'bb'}
+
+    def test_listing_cached_and_invalidated(self):
+        diag_input = FakeEfsInput(self.FILES)
+        efs_cache = EfsMetadataCache()
+        names = [entry.name for entry in efs_cache.list_directory(diag_input, b'/nv/')]
+        self.assertEqual(names, [b'.', b'..', b'b', b'item_files'])
+        num_requests = diag_input.num_requests
+        self.assertEqual(len(efs_cache.list_directory(diag_input, b'/nv')), 4)
+        self.assertEqual(efs_cache.get_mode(diag_input, b'/nv/b'), 0o100644) # From the listing
+        self.assertIsNone(efs_cache.get_mode(diag_input, b'/nv/c'))
+        self.assertEqual(diag_input.num_requests, num_requests)
+
+        diag_input.files[b'/nv/c'] = bytearray(b'c')
+        efs_cache.invalidate(b'/nv/c')
+        self.assertEqual(efs_cache.get_mode(diag_input, b'/nv/c'), 0o100644) # From a STAT
+        self.assertGreater(diag_input.num_requests, num_requests)
+
+    def test_links_with_the_same_name(self):
+        diag_input = FakeEfsInput(self.FILES, {b'/a/x': b'/nv/b', b'/b/x': b'/nv/item_files/a'})
+        efs_cache = EfsMetadataCache()
+        ls_command = LsCommand()
+        ls_command.efs_cache = efs_cache
+        with redirect_stdout(StringIO()) as output:
+            ls_command.execute_command(diag_input, Namespace(path = '/a'))
+            ls_command.execute_command(diag_input, Namespace(path = '/b'))
+        self.assertIn("'x' -> '/nv/b'", output.getvalue())
+        self.assertIn("'x' -> '/nv/item_files/a'", output.getvalue())
+        self.assertEqual(set(efs_cache.path_to_link_target), {b'/a/x', b'/b/x'})
+
+    def test_complete_path(self):
+        efs_cache = EfsMetadataCache()
+        diag_input = FakeEfsInput(self.FILES)
+        self.assertEqual(efs_cache.complete_path(diag_input, '/'), ['/nv/'])
+        self.assertEqual(efs_cache.complete_path(diag_input, '/nv/i'), ['/nv/item_files/'])
+        self.assertEqual(efs_cache.complete_path(diag_input, '/nv/item_files/'), ['/nv/item_files/a'])
+
+    def test_disabled(self):
+        diag_input = FakeEfsInput(self.FILES)
+        efs_cache = EfsMetadataCache(ttl = 0)
+        efs_cache.stat(diag_input, b'/nv/b')
+        num_requests = diag_input.num_requests
+        efs_cache.stat(diag_input, b'/nv/b')
+        self.assertEqual(diag_input.num_requests, num_requests + 1)
+        self.assertEqual(efs_cache.path_to_stat, {})
+
+class EfsPutTests(TestCase):
+
+    def put(self, diag_input, local_src, remote_dst, force = False):
+        PutCommand().execute_command(diag_input, Namespace(local_src = local_src, remote_dst = remote_dst, force = force))
+
+    def test_skip_unchanged_file(self):
+        for supports_md5sum in (True, False):
+            diag_input = FakeEfsInput({b'/nv/a': CONTENTS}, supports_md5sum = supports_md5sum)
+            with TemporaryDirectory() as local_dir:
+                local_path = join(local_dir, 'a')
+                with open(local_path, 'wb') as local_file:
+                    local_file.write(CONTENTS)
+                self.put(diag_input, local_path, '/nv')
+                self.assertEqual(diag_input.subcommand_counts[EFS2_DIAG_WRITE], 0)
+                self.assertEqual(diag_input.subcommand_counts[EFS2_DIAG_READ] > 0, not supports_md5sum)
+
+                with open(local_path, 'r+b') as local_file:
+                    local_file.seek(len(CONTENTS) - 1)
+                    local_file.write(b'!')
+                self.put(diag_input, local_path, '/nv/a')
+                self.assertEqual(bytes(diag_input.files[b'/nv/a']), CONTENTS[:-1] + b'!')
+
+                num_writes = diag_input.subcommand_counts[EFS2_DIAG_WRITE]
+                self.put(diag_input, local_path, '/nv/a', force = True)
+                self.assertGreater(diag_input.subcommand_counts[EFS2_DIAG_WRITE], num_writes)
+
+    def test_put_directory(self):
+        diag_input = FakeEfsInput({b'/conf/same': b'same', b'/conf/changed': b'old'})
+        with TemporaryDirectory() as local_dir:
+            for relative_path, contents in (('same', b'same'), ('changed', b'new'), ('sub/new', b'new file')):
+                makedirs(dirname(join(local_dir, 'conf', relative_path)), exist_ok = True)
+                with open(join(local_dir, 'conf', relative_path), 'wb') as local_file:
+                    local_file.write(contents)
+            self.put(diag_input, join(local_dir, 'conf'), '/')
+        self.assertEqual(diag_input.directories, {b'/conf/sub'})
+        self.assertEqual(bytes(diag_input.files[b'/conf/changed']), b'new')
+        self.assertEqual(bytes(diag_input.files[b'/conf/sub/new']), b'new file')
+        self.assertEqual(diag_input.subcommand_counts[EFS2_DIAG_OPEN], 2) # "same" was skipped
+
+    def test_put_through_symbolic_links(self):
+        diag_input = FakeEfsInput({b'/policyman/c': b'c', b'/conf/file': b'old'},
+            {b'/nv/link': b'/policyman', b'/conf/sub': b'/policyman', b'/conf/file_link': b'/conf/file'})
+        efs_cache = EfsMetadataCache()
+        efs_cache.list_directory(diag_input, b'/nv') # Lists "link" as a symbolic link
+        self.assertEqual(efs_cache.get_mode(diag_input, b'/nv/link'), 0o040755)
+        with TemporaryDirectory() as local_dir:
+            with open(join(local_dir, 'a'), 'wb') as local_file:
+                local_file.write(b'a')
+            self.put(diag_input, join(local_dir, 'a'), '/nv/link')
+            self.assertEqual(bytes(diag_input.files[b'/policyman/a']), b'a')
+
+            for relative_path, contents in (('sub/b', b'b'), ('file_link', b'new')):
+                makedirs(dirname(join(local_dir, 'conf', relative_path)), exist_ok = True)
+                with open(join(local_dir, 'conf', relative_path), 'wb') as local_file:
+                    local_file.write(contents)
+            self.put(diag_input, join(local_dir, 'conf'), '/')
+        self.assertEqual(bytes(diag_input.files[b'/policyman/b']), b'b')
+        self.assertEqual(bytes(diag_input.files[b'/conf/file']), b'new')
+        self.assertEqual(diag_input.directories, set())
@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from os.path import dirname, realpath
+from unittest import TestCase
+
+TESTS_DIR = dirname(realpath(__file__))
+ROOT_DIR = dirname(TESTS_DIR)
+
+import sys
+sys.path.insert(0, ROOT_DIR)
+
+from src.inputs._hdlc_mixin import HdlcMixin, HdlcDeframer
+
+"""
+    This file is an include file.
+
+    It should be run from the "tests.py" entry point
+    located into the current directory
+
+    It contains the tests for the
+    "src/inputs/_hdlc_mixin.py" file.
+"""
+
+class HdlcTests(TestCase):
+
+    def test_deframer_split_reads(self):
+        deframer = HdlcDeframer()
+
+        self.assertEqual(list(deframer.feed(b'\x01\x02')), [])
+        self.assertEqual(list(deframer.feed(b'\x03\x7e\x04')), [b'\x01\x02\x03\x7e'])
+        self.assertEqual(list(deframer.feed(b'\x7e\x7e\x05\x06\x7e')), [b'\x04\x7e', b'\x7e', b'\x05\x06\x7e'])
+
+        self.assertEqual(list(deframer.feed(b'\x07')), [])
+        deframer.reset()
+        self.assertEqual(list(deframer.feed(b'\x08\x7e')), [b'\x08\x7e'])
+
+    def test_encapsulate_roundtrip(self):
+        hdlc = HdlcMixin.__new__(HdlcMixin)
+
+        for payload in [b'\x00', b'\x10\x7e\x7d\x5e\x5d', bytes(range(256))]:
+            frame = hdlc.hdlc_encapsulate(payload)
+            self.assertEqual(frame.count(b'\x7e'), 1)
+            self.assertEqual(hdlc.hdlc_decapsulate(frame), payload)
+
+        with self.assertRaises(HdlcMixin.InvalidFrameError):
+            hdlc.hdlc_decapsulate(b'\x00\x00\x00\x7e')
+
+        with self.assertRaises(HdlcMixin.InvalidFrameError):
+            hdlc.hdlc_decapsulate(b'\x7d\x5e\x7e') # Too short once unescaped
+
+    def test_decapsulate_batch(self):
+        hdlc = HdlcMixin()
+
+        payloads = [b'\x10\x00', b'\x7d\x7e' * 3, b'\x4b\x13\x00\x00']
+        stream = b''.join(hdlc.hdlc_encapsulate(payload) for payload in payloads)
+        corrupted_frame = b'\x01\x02\x03\x7e'
+
+        self.assertEqual(hdlc.hdlc_decapsulate_batch(corrupted_frame + stream[:3]), [])
+        self.assertEqual(hdlc.hdlc_decapsulate_batch(stream[3:]), payloads)
+        self.assertTrue(hdlc.received_first_packet)
+
+    def test_decapsulate_batch_short_frames(self):
+        hdlc = HdlcMixin()
+        too_short_frames = []
+        hdlc.on_too_short_hdlc_frame = lambda: too_short_frames.append(True)
+
+        frame = hdlc.hdlc_encapsulate(b'\x10\x00')
+        self.assertEqual(hdlc.hdlc_decapsulate_batch(b'\x01\x7e' + b'\x7d\x5e\x7e' + frame), [b'\x10\x00'])
+        self.assertEqual(len(too_short_frames), 1)
@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from os.path import dirname, realpath, join
+from tempfile import TemporaryDirectory
+from struct import pack, unpack_from
+from unittest import TestCase
+import json
+
+TESTS_DIR = dirname(realpath(__file__))
+ROOT_DIR = dirname(TESTS_DIR)
+
+import sys
+sys.path.insert(0, ROOT_DIR)
+
+from src.inputs._base_input import BaseInput
+from src.inputs._log_mask_manager import LOG_CONFIG_RETRIEVE_ID_RANGES_OP, LOG_CONFIG_SET_MASK_OP
+from src.modules._enable_log_mixin import EnableLogMixin, TYPES_FOR_RAW_PACKET_LOGGING
+from src.inputs._log_masks import build_log_mask
+from src.protocol.messages import DIAG_LOG_CONFIG_F, DIAG_EXT_BUILD_ID_F
+
+"""
+    This file is an include file.
+
+    It should be run from the "tests.py" entry point
+    located into the current directory
+
+    It contains the tests for the
+    "src/inputs/_log_masks.py", "src/modules/_enable_log_mixin.py" and
+    "src/inputs/_log_mask_manager.py" files.
+"""
+
+ID_RANGES = [0, 0x600, 0, 0, 0x900, 0x800, 0, 0x800, 0, 0, 0, 0x900, 0, 0, 0, 0]
+
+"""
+    Reference implementation, setting the mask bit by bit.
+"""
+
+def build_log_mask_bit_by_bit(log_type, num_bits, enabled_log_codes):
+    mask = bytearray((num_bits + 7) // 8)
+    for i in range(num_bits):
+        if enabled_log_codes is None or ((log_type << 12) | i) in enabled_log_codes:
+            mask[i // 8] |= 1 << (i % 8)
+    return bytes(mask)
+
+class FakeLogConfigInput(BaseInput):
+
+    def __init__(self, log_mask_cache_path = None):
+        super().__init__()
+        self.log_mask_manager.cache_path = log_mask_cache_path
+        self.log_config_operations = []
+        self.log_type_to_mask = {}
+        self.num_bits_set = {}
+
+    def send_request(self, opcode, payload):
+        if opcode == DIAG_EXT_BUILD_ID_F:
+            response = pack('<B2xII', 2, 0, 0) + b'BUILD.1\x00\x00'
+        elif opcode == DIAG_LOG_CONFIG_F:
+            operation, = unpack_from('<3xI', payload)
+            self.log_config_operations.append(operation)
+            response = pack('<3xII', operation, 0)
+            if operation == LOG_CONFIG_RETRIEVE_ID_RANGES_OP:
+                response += pack('<16I', *ID_RANGES)
+            elif operation == LOG_CONFIG_SET_MASK_OP:
+                log_type, num_bits = unpack_from('<II', payload, 7)
+                self.log_type_to_mask[log_type] = payload[15:]
+                self.num_bits_set[log_type] = sum(bin(byte).count('1') for byte in payload[15:])
+        self.dispatch_diag_response(bytes([opcode]) + response)
+
+class LoggingModule(EnableLogMixin):
+
+    def __init__(self, diag_input, limit_registered_logs = TYPES_FOR_RAW_PACKET_LOGGING):
+        self.diag_input = diag_input
+        if limit_registered_logs is not None:
+            self.limit_registered_logs = limit_registered_logs
+
+class LogMaskTests(TestCase):
+
+    def test_build_log_mask(self):
+        enabled_log_codes = frozenset(TYPES_FOR_RAW_PACKET_LOGGING)
+        for log_type, num_bits in enumerate(ID_RANGES + [13, 1]):
+            for log_codes in (enabled_log_codes, None):
+                self.assertEqual(build_log_mask(log_type, num_bits, log_codes),
+                    build_log_mask_bit_by_bit(log_type, num_bits, log_codes))
+        self.assertEqual(build_log_mask(0xb, 0x900, bit_value = 0), bytes(0x120))
+
+    def test_cached_masks(self):
+        with TemporaryDirectory() as cache_dir:
+            cache_path = join(cache_dir, 'qcsuper', 'log_masks.json')
+
+            diag_input = FakeLogConfigInput(cache_path)
+            LoggingModule(diag_input).on_init()
+            self.assertEqual(diag_input.log_config_operations, [LOG_CONFIG_RETRIEVE_ID_RANGES_OP] + [LOG_CONFIG_SET_MASK_OP] * 5)
+            self.assertEqual(diag_input.log_type_to_mask[0xb], build_log_mask_bit_by_bit(0xb, 0x900, TYPES_FOR_RAW_PACKET_LOGGING))
+
+            # Starting again against the same firmware doesn't query the ID ranges
+
+            second_input = FakeLogConfigInput(cache_path)
+            LoggingModule(second_input).on_init()
+            self.assertEqual(second_input.log_config_operations, [LOG_CONFIG_SET_MASK_OP] * 5)
+            self.assertEqual(second_input.log_type_to_mask, diag_input.log_type_to_mask)
+
+    def test_malformed_cache(self):
+        with TemporaryDirectory() as cache_dir:
+            cache_path = join(cache_dir, 'log_masks.json')
+            for cache_contents in ([], {'BUILD.1': []}, {'BUILD.1': {'id_ranges': ['x'] * 16, 'masks': []}},
+                {'BUILD.1': {'id_ranges': ID_RANGES, 'masks': {'b:2304:*': 'not hex', '4:2304:*': 'ff'}}}):
+                with open(cache_path, 'w') as cache_file:
+                    json.dump(cache_contents, cache_file)
+                diag_input = FakeLogConfigInput(cache_path)
+                LoggingModule(diag_input, None).on_init() # All logs, masks cached as "<log type>:<number of bits>:*"
+                self.assertEqual(diag_input.log_type_to_mask[0xb], build_log_mask_bit_by_bit(0xb, 0x900, None))
+                self.assertEqual(diag_input.log_type_to_mask[0x4], build_log_mask_bit_by_bit(0x4, 0x900, None))
+
+            # The cache file was replaced with well-formed contents
+            with open(cache_path) as cache_file:
+                self.assertEqual(json.load(cache_file)['BUILD.1']['masks']['b:2304:*'], build_log_mask_bit_by_bit(0xb, 0x900, None).hex())
+
+    def test_merged_subscriptions(self):
+        diag_input = FakeLogConfigInput()
+        raw_packet_module = LoggingModule(diag_input)
+        gsm_module = LoggingModule(diag_input, [0x512f, 0x5130])
+        raw_packet_module.on_init()
+        gsm_module.on_init()
+        self.assertEqual(diag_input.log_config_operations, [LOG_CONFIG_RETRIEVE_ID_RANGES_OP] + [LOG_CONFIG_SET_MASK_OP] * 6)
+        self.assertEqual(diag_input.num_bits_set[0x5], 3) # 0x5226, 0x512f and 0x5130
+        self.assertEqual(diag_input.num_bits_set[0xb], 6)
+
+        # Stopping a module only updates the masks of the log types that
+        # change, and keeps the logs still needed by the other module
+
+        diag_input.log_config_operations.clear()
+        raw_packet_module.on_deinit()
+        self.assertEqual(diag_input.log_config_operations, [LOG_CONFIG_SET_MASK_OP] * 5)
+        self.assertEqual(diag_input.num_bits_set, {0x1: 0, 0x4: 0, 0x5: 2, 0x7: 0, 0xb: 0})
+
+        # A module enabling all logs, then the last module stopping
+
+        all_logs_module = LoggingModule(diag_input, None)
+        all_logs_module.on_init()
+        self.assertEqual(diag_input.num_bits_set, dict((log_type, num_bits) for log_type, num_bits in enumerate(ID_RANGES) if num_bits))
+        gsm_module.on_deinit()
+        all_logs_module.on_deinit()
+        self.assertEqual(set(diag_input.num_bits_set.values()), {0})
@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from os.path import dirname, realpath, join, exists
+from tempfile import TemporaryDirectory
+from struct import pack, unpack_from
+from unittest import TestCase
+from os import listdir
+
+TESTS_DIR = dirname(realpath(__file__))
+ROOT_DIR = dirname(TESTS_DIR)
+
+import sys
+sys.path.insert(0, ROOT_DIR)
+
+from src.inputs._base_input import BaseInput
+from src.modules.memory_dump import MemoryDumper
+from src.modules._memory_map import MemoryMap, MEMORY_MAP_FILE_NAME
+from src.protocol.messages import DIAG_PEEKB_F, DIAG_PEEKW_F, DIAG_PEEKD_F, DIAG_BAD_PARM_F, DIAG_BAD_CMD_F, \
+    DIAG_BAD_LEN_F, DIAG_EXT_BUILD_ID_F
+
+"""
+    This file is an include file.
+
+    It should be run from the "tests.py" entry point
+    located into the current directory
+
+    It contains the tests for the
+    "src/modules/memory_dump.py" and "src/modules/_memory_map.py" files.
+"""
+
+"""
+    Input emulating a device whose memory is readable within the given
+    ranges, a byte reading as the low byte of its address.
+
+    :param readable_ranges: [(start, end)] readable address ranges
+    :param max_peek_sizes: {opcode: maximal number of bytes read at once} of
+        the supported DIAG_PEEK* commands
+"""
+
+PEEK_UNIT_SIZES = {DIAG_PEEKB_F: 1, DIAG_PEEKW_F: 2, DIAG_PEEKD_F: 4}
+
+class FakeMemoryInput(BaseInput):
+
+    def __init__(self, readable_ranges, build_id = b'BUILD.1', max_peek_sizes = {DIAG_PEEKB_F: 0x10}):
+        super().__init__()
+        self.readable_ranges = readable_ranges
+        self.build_id = build_id
+        self.max_peek_sizes = max_peek_sizes
+        self.num_reads = 0
+        self.read_ranges = [] # [(address, size)] of the successful reads
+
+    def send_request(self, opcode, payload):
+        if opcode == DIAG_EXT_BUILD_ID_F:
+            self.dispatch_diag_response(bytes([opcode]) + pack('<B2xII', 2, 0, 0) + self.build_id + b'\x00\x00')
+        elif opcode in self.max_peek_sizes:
+            self.num_reads += 1
+            address, num_units = unpack_from('<IH', payload)
+            size = num_units * PEEK_UNIT_SIZES[opcode]
+            if size > self.max_peek_sizes[opcode]:
+                self.dispatch_diag_response(bytes([DIAG_BAD_LEN_F, opcode]) + payload)
+            elif any(start <= address and address + size <= end for start, end in self.readable_ranges):
+                self.read_ranges.append((address, size))
+                self.dispatch_diag_response(bytes([opcode]) + payload + expected_contents(address, address + size))
+            else:
+                self.dispatch_diag_response(bytes([DIAG_BAD_PARM_F, opcode]) + payload)
+        else:
+            self.dispatch_diag_response(bytes([DIAG_BAD_CMD_F, opcode]) + payload)
+
+def expected_contents(start, end):
+    return bytes(byte & 0xff for byte in range(start, end))
+
+class MemoryMapTests(TestCase):
+
+    def test_mark_and_query(self):
+        memory_map = MemoryMap()
+        memory_map.mark(0x1000, 0x2000, True)
+        memory_map.mark(0x2000, 0x3000, True)
+        memory_map.mark(0x1800, 0x1900, False)
+        self.assertEqual(memory_map.get_ranges(0, 0x10000, True), [(0x1000, 0x1800), (0x1900, 0x3000)])
+        self.assertEqual(memory_map.get_unknown_ranges(0, 0x4000), [(0, 0x1000), (0x3000, 0x4000)])
+        self.assertEqual([memory_map.get_status(address) for address in (0xfff, 0x1000, 0x1800, 0x2fff)], [None, True, False, True])
+        memory_map.forget(0x1800, 0x2000)
+        self.assertEqual(memory_map.get_unknown_ranges(0x1000, 0x3000), [(0x1800, 0x2000)])
+
+    def test_save_and_load(self):
+        memory_map = MemoryMap('BUILD.1')
+        memory_map.mark(0x1000, 0x2000, True)
+        memory_map.mark(0x2000, 0x3000, False)
+        with TemporaryDirectory() as output_dir:
+            map_path = join(output_dir, MEMORY_MAP_FILE_NAME)
+            memory_map.save(map_path)
+            self.assertEqual(MemoryMap.load(map_path, 'BUILD.1').ranges, memory_map.ranges)
+            self.assertEqual(MemoryMap.load(map_path, 'BUILD.2').ranges, []) # Another firmware
+
+class MemoryDumpTests(TestCase):
+
+    READABLE_RANGES = [(0x2340, 0x3400), (0x3500, 0x5000), (0x9000, 0x9100)] # The hole at 0x3400 lies between two probes
+
+    def test_dump_and_resume(self):
+        diag_input = FakeMemoryInput(self.READABLE_RANGES, max_peek_sizes = {DIAG_PEEKB_F: 0x10, DIAG_PEEKD_F: 0x100})
+        with TemporaryDirectory() as output_dir:
+            MemoryDumper(diag_input, output_dir, 0, 0x10000).on_init()
+            self.assertEqual(sorted(listdir(output_dir)), [MEMORY_MAP_FILE_NAME, 'chunk_00002340', 'chunk_00003500', 'chunk_00009000'])
+            for start, end in self.READABLE_RANGES:
+                with open(join(output_dir, 'chunk_%08x' % start), 'rb') as chunk_file:
+                    self.assertEqual(chunk_file.read(), expected_contents(start, end))
+
+            self.assertEqual({size for address, size in diag_input.read_ranges if address > 0x2340 + 0x100}, {0x10, 0x100})
+            self.assertLess(diag_input.num_reads, 0x100) # Word by word, it would be around 0x1000
+
+            # Dumping again the same firmware neither probes nor reads again
+
+            diag_input.num_reads = 0
+            MemoryDumper(diag_input, output_dir, 0, 0x10000).on_init()
+            self.assertEqual(diag_input.num_reads, 0)
+
+    def test_resume_interrupted_chunk(self):
+        diag_input = FakeMemoryInput(self.READABLE_RANGES)
+        with TemporaryDirectory() as output_dir:
+            memory_map = MemoryMap('BUILD.1')
+            memory_map.mark(0, 0x2340, False)
+            memory_map.mark(0x2340, 0x3400, True)
+            memory_map.save(join(output_dir, MEMORY_MAP_FILE_NAME))
+            with open(join(output_dir, 'chunk_00002340'), 'wb') as chunk_file:
+                chunk_file.write(expected_contents(0x2340, 0x2400) + b'\x00' * 5) # Partial word
+            dumper = MemoryDumper(diag_input, output_dir, 0, 0x3400)
+            dumper.on_init()
+            dumper.on_deinit()
+            self.assertEqual(min(diag_input.read_ranges), (0x2400, 0x10))
+            with open(join(output_dir, 'chunk_00002340'), 'rb') as chunk_file:
+                self.assertEqual(chunk_file.read(), expected_contents(0x2340, 0x3400))
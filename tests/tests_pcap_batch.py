@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+#-*- encoding: Utf-8 -*-
+from tempfile import TemporaryDirectory
+from os.path import dirname, realpath, join
+from unittest import TestCase
+from struct import pack
+from io import BytesIO
+
+TESTS_DIR = dirname(realpath(__file__))
+ROOT_DIR = dirname(TESTS_DIR)
+
+import sys
+sys.path.insert(0, ROOT_DIR)
+
+from src.modules.pcap_batch import convert_dlf_to_pcap, ChunkPcapDumper, PCAP_FILE_HEADER
+from src.modules.pcap_dump import get_lte_rrc_channel_lookup_table
+from src.protocol.gsmtap import PcapRecordBuilder
+from src.protocol.gsmtap import *
+from src.protocol.headers import *
+from src.protocol.log_types import *
+from tests_dlf_read import build_record, read_records
+
+"""
+    This file is an include file.
+
+    It should be run from the "tests.py" entry point
+    located into the current directory
+
+    It contains the tests for the
+    "src/modules/pcap_batch.py" file, for the channel lookup tables of
+    "src/modules/pcap_dump.py", and for the PCAP record builder of
+    "src/protocol/gsmtap.py".
+"""
+
+"""
+    Reference implementation, packing then concatenating each header.
+"""
+
+def build_gsmtap_record_by_concatenation(timestamp, gsmtap_protocol, gsmtap_channel_type, payload, is_uplink):
+    packet = pack('>BBBxHxx4xBxxx', 2, 4, gsmtap_protocol, int(is_uplink) << 14, gsmtap_channel_type) + payload
+    packet = pack('>HHHH', GSMTAP_PORT, GSMTAP_PORT, len(packet) + 8, 0) + packet
+    packet = pack('>BBHHHBBH4s4s', 0x45, 0, len(packet) + 20, 0, 0, 64, 17, 0, bytes(4), bytes(4)) + packet
+    return pack('<IIII', int(timestamp), int((timestamp * 1000000) % 1000000), len(packet), len(packet)) + packet
+
+class PcapBatchTests(TestCase):
+
+    def test_chunked_conversion_matches_sequential(self):
+        with TemporaryDirectory() as temp_dir:
+            dlf_path = join(temp_dir, 'test.dlf')
+
+            with open(dlf_path, 'wb') as dlf_file:
+                for index in range(300):
+                    message = bytes([index % 256]) * (index % 40 + 1)
+                    dlf_file.write(build_record(WCDMA_SIGNALLING_MESSAGE, 1700000000 + index / 10,
+                        pack('<BBH', RRCLOG_SIG_DL_DCCH, 0, len(message)) + message))
+
+            sequential_pcap = BytesIO(PCAP_FILE_HEADER)
+            sequential_pcap.seek(0, 2)
+            sequential_pcap.close = lambda: None
+
+            dumper = ChunkPcapDumper(sequential_pcap, False, False, False) # Runs the PcapDumper logic over the whole file
+            for log_type, log_frame, timestamp in read_records(open(dlf_path, 'rb')):
+                dumper.on_log(log_type, log_frame[12:], log_frame[:12], timestamp)
+            dumper.write_records(force = True)
+
+            with open(join(temp_dir, 'test.pcap'), 'wb') as batch_pcap:
+                batch_pcap.appending_to_file = False
+                convert_dlf_to_pcap(dlf_path, batch_pcap, False, False, False, jobs = 2, chunk_size = 1000,
+                    install_wireshark_plugin = False)
+
+            with open(join(temp_dir, 'test.pcap'), 'rb') as batch_pcap:
+                self.assertEqual(batch_pcap.read(), sequential_pcap.getvalue())
+
+    def test_memoryview_log_payloads(self):
+        log_packets = [
+            (WCDMA_SIGNALLING_MESSAGE, WCDMA_SIGNALLING_HEADER.pack(RRCLOG_SIG_DL_DCCH, 0, 4) + b'wcdm'),
+            (WCDMA_SIGNALLING_MESSAGE, WCDMA_SIGNALLING_HEADER.pack(RRCLOG_SIG_DL_DCCH + 0x80, 0, 4) + b'arfcwcdm'),
+            (LOG_GSM_RR_SIGNALING_MESSAGE_C, GSM_RR_SIGNALLING_HEADER.pack(BCCH | 0x80, 0, 4) + b'\x01gsm'),
+            (LOG_GPRS_MAC_SIGNALLING_MESSAGE_C, GPRS_MAC_SIGNALLING_HEADER.pack(DL_PACCH_CHANNEL, 0, 4) + b'gprs'),
+            (LOG_LTE_RRC_OTA_MSG_LOG_C, LTE_RRC_OTA_HEADER.pack(9, 9, 0, 0, 1) +
+                LTE_RRC_OTA_EXT_HEADERS[True, False].pack(1850, 0, LTE_DL_DCCH_v9, 3) + b'lte'),
+            (LOG_LTE_NAS_EMM_OTA_IN_MSG_LOG_C, LTE_NAS_OTA_HEADER.pack(1, 9, 0, 0) + b'nas'),
+            (LOG_DATA_PROTOCOL_LOGGING_C, bytes(8) + b'\x45' + bytes(19)),
+            (LOG_NR_RRC_OTA_MSG_LOG_C, b'nr rrc'),
+        ]
+
+        pcap_files = []
+        for as_memoryview in (False, True):
+            pcap_file = BytesIO()
+            pcap_file.appending_to_file = True
+            dumper = ChunkPcapDumper(pcap_file, True, True, True)
+            dumper.current_rat = '2g'
+            for index, (log_type, log_payload) in enumerate(log_packets):
+                if as_memoryview:
+                    log_payload = memoryview(bytearray(log_payload)) # Like the buffers of the inputs
+                dumper.on_log(log_type, log_payload, bytes(12), 1700000000 + index)
+            dumper.write_records(force = True)
+            pcap_files.append(pcap_file.getvalue())
+
+        self.assertEqual(pcap_files[0].count(GSMTAP_PORT.to_bytes(2, 'big') * 2), 6) # Not counting the IP and NR RRC records
+        self.assertEqual(pcap_files[1], pcap_files[0])
+
+    def test_lte_rrc_channel_lookup_tables(self):
+        self.assertEqual(get_lte_rrc_channel_lookup_table(14)[LTE_UL_DCCH_v14], GSMTAP_LTE_RRC_SUB_UL_DCCH_Message)
+        self.assertEqual(get_lte_rrc_channel_lookup_table(26)[LTE_PCCH_v19], GSMTAP_LTE_RRC_SUB_PCCH_Message)
+        self.assertEqual(get_lte_rrc_channel_lookup_table(2)[LTE_BCCH_BCH_v0], GSMTAP_LTE_RRC_SUB_BCCH_BCH_Message)
+        self.assertEqual(get_lte_rrc_channel_lookup_table(9)[LTE_DL_DCCH_v9], GSMTAP_LTE_RRC_SUB_DL_DCCH_Message)
+        self.assertEqual(get_lte_rrc_channel_lookup_table(9)[LTE_UL_CCCH_NB], GSMTAP_LTE_RRC_SUB_UL_CCCH_Message_NB)
+        # Resolved once for each version
+        self.assertIs(get_lte_rrc_channel_lookup_table(30), get_lte_rrc_channel_lookup_table(30))
+
+    def test_pcap_record_builder(self):
+        builder = PcapRecordBuilder(initial_size = 64) # Grown by the second record
+        expected = b''
+        for index, timestamp in enumerate([1700000000.25, 1700000001.5, 1700000002.75]):
+            payload = bytes([index]) * (index * 30 + 5)
+            builder.append_gsmtap(timestamp, GSMTAP_TYPE_LTE_RRC, GSMTAP_LTE_RRC_SUB_UL_DCCH_Message, payload, index % 2)
+            expected += build_gsmtap_record_by_concatenation(timestamp, GSMTAP_TYPE_LTE_RRC,
+                GSMTAP_LTE_RRC_SUB_UL_DCCH_Message, payload, index % 2)
+        builder.append_ip(1700000003.0, b'\x45' + bytes(19))
+        expected += pack('<IIII', 1700000003, 0, 20, 20) + b'\x45' + bytes(19)
+
+        pcap_file = BytesIO()
+        builder.write_to(pcap_file)
+        self.assertEqual(pcap_file.getvalue(), expected)
+        self.assertEqual(len(builder), 0)
+
+        # Discarded records
+        builder.append_nr_rrc_log(1700000004.0, b'log')
+        builder.truncate(0)
+        builder.write_to(pcap_file)
+        self.assertEqual(pcap_file.getvalue(), expected)